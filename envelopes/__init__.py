@@ -29,6 +29,55 @@ Mailing for human beings.
 
 __version__ = '0.4'
 
+import importlib
+import importlib.util
+import sys
 
-from .conn import *
-from .envelope import Envelope
+# Public names and modules they live in. Modules are imported on first
+# access, so importing the package doesn't pull in smtplib, email.mime etc.
+_LAZY_ATTRIBUTES = {
+    'SMTP': 'conn',
+    'GMailSMTP': 'conn',
+    'SendGridSMTP': 'conn',
+    'MailcatcherSMTP': 'conn',
+    'NullSMTP': 'conn',
+    'FileSMTP': 'conn',
+    'MessageTooLargeException': 'conn',
+    'TimeoutException': 'conn',
+    'Envelope': 'envelope',
+    'MXDeliverySMTP': 'mx',
+    'Router': 'router',
+    'NoRouteException': 'router'
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        # Submodules, e.g. envelopes.conn, are imported on access too.
+        if (not name.startswith('_') and
+                importlib.util.find_spec('.' + name, __name__) is not None):
+            return importlib.import_module('.' + name, __name__)
+
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name)
+        )
+
+    value = getattr(
+        importlib.import_module('.' + module_name, __name__), name
+    )
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ (PEP 562) isn't supported, import everything.
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
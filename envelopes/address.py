@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.address
+=================
+
+This module implements validation and normalization of e-mail addresses
+according to RFC 5321 and RFC 5322. Internationalized domain names are
+converted to their ASCII (punycode) form.
+"""
+
+from collections import OrderedDict
+import re
+import socket
+import threading
+
+__all__ = ['AddressError', 'normalize_address', 'validate_address',
+           'validate_many']
+
+_ATEXT = u"[A-Za-z0-9!#$%&'*+/=?^_`{|}~\\-\u0080-\uffff]"
+_DOT_ATOM_REGEXP = re.compile(r'^%s+(\.%s+)*\Z' % (_ATEXT, _ATEXT))
+_QUOTED_PAIR_REGEXP = re.compile(u'\\\\([\t\x20-\x7e\u0080-\uffff])')
+_QTEXT_REGEXP = re.compile(r'^[^"\\\x00-\x08\x0a-\x1f\x7f]*\Z')
+_LABEL_REGEXP = re.compile(r'^[a-z0-9]([a-z0-9\-]*[a-z0-9])?\Z')
+
+MAX_LOCAL_PART_LENGTH = 64
+MAX_DOMAIN_LENGTH = 255
+MAX_ADDRESS_LENGTH = 254
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 4096
+
+
+class AddressError(ValueError):
+    """Raised when an e-mail address is invalid."""
+
+    def __init__(self, addr, reason):
+        super(AddressError, self).__init__('%s: %s' % (reason, addr))
+        self.addr = addr
+        self.reason = reason
+
+
+def _addr_spec(addr):
+    # Accepts addresses in the forms Envelope does: bare addr-spec,
+    # "Name <addr-spec>" or (addr-spec, name) tuple.
+    if isinstance(addr, (list, tuple)):
+        return (addr[0] or '').strip()
+
+    addr = addr.strip()
+    if addr.endswith('>') and '<' in addr:
+        return addr[addr.rindex('<') + 1:-1].strip()
+
+    return addr
+
+
+def _local_part(addr, local):
+    if local.startswith('"'):
+        if len(local) < 2 or not local.endswith('"'):
+            raise AddressError(addr, 'Unterminated quoted local part')
+
+        text = _QUOTED_PAIR_REGEXP.sub('x', local[1:-1])
+        if not _QTEXT_REGEXP.match(text):
+            raise AddressError(addr, 'Invalid character in quoted local part')
+
+        value = _QUOTED_PAIR_REGEXP.sub(r'\1', local[1:-1])
+        if value and _DOT_ATOM_REGEXP.match(value):
+            # Quoting isn't needed, e.g. "john.doe"@example.com.
+            return value
+
+        return '"%s"' % re.sub(r'(["\\])', r'\\\1', value)
+
+    if not _DOT_ATOM_REGEXP.match(local):
+        raise AddressError(addr, 'Invalid local part')
+
+    return local
+
+
+def _domain_literal(addr, domain):
+    literal = domain[1:-1]
+    try:
+        if literal[:5].lower() == 'ipv6:':
+            socket.inet_pton(socket.AF_INET6, literal[5:])
+            return '[IPv6:%s]' % literal[5:].lower()
+
+        if literal.count('.') != 3:
+            raise ValueError(literal)
+
+        socket.inet_aton(literal)
+    except (ValueError, socket.error):
+        raise AddressError(addr, 'Invalid domain literal')
+
+    return domain
+
+
+def _domain(addr, domain):
+    if domain.startswith('[') and domain.endswith(']'):
+        return _domain_literal(addr, domain)
+
+    domain = domain.rstrip('.').lower()
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        raise AddressError(addr, 'Invalid domain')
+
+    if not domain or len(domain) > MAX_DOMAIN_LENGTH:
+        raise AddressError(addr, 'Invalid domain length')
+
+    labels = domain.split('.')
+    for label in labels:
+        if len(label) > 63 or not _LABEL_REGEXP.match(label):
+            raise AddressError(addr, 'Invalid domain')
+
+    if labels[-1].isdigit():
+        raise AddressError(addr, 'Invalid top level domain')
+
+    return domain
+
+
+def _normalize(addr):
+    spec = _addr_spec(addr)
+    local, at, domain = spec.rpartition('@')
+    if not at or not local or not domain:
+        raise AddressError(addr, 'Missing local part or domain')
+
+    local = _local_part(addr, local)
+    if len(local.encode('utf-8')) > MAX_LOCAL_PART_LENGTH:
+        raise AddressError(addr, 'Local part too long')
+
+    normalized = '%s@%s' % (local, _domain(addr, domain))
+    if len(normalized.encode('utf-8')) > MAX_ADDRESS_LENGTH:
+        raise AddressError(addr, 'Address too long')
+
+    return normalized
+
+
+def normalize_address(addr):
+    """Validates *addr* and returns its normalized addr-spec: domain is
+    lowercased and converted to punycode and needless quoting of the local
+    part is removed. *addr* can be given in any form accepted by
+    :py:class:`envelopes.envelope.Envelope`. Raises :py:exc:`AddressError`
+    if the address is invalid.
+
+    Results are memoized, so validating the same addresses repeatedly is
+    cheap."""
+    key = tuple(addr) if isinstance(addr, list) else addr
+    with _cache_lock:
+        cached = _cache.pop(key, None)
+        if cached is not None:
+            _cache[key] = cached
+
+    if cached is None:
+        # Failures are cached as arguments of AddressError, not exception
+        # instances, which would hold tracebacks and caller frames.
+        try:
+            cached = (_normalize(addr), None)
+        except AddressError as exc:
+            cached = (None, (exc.addr, exc.reason))
+
+        with _cache_lock:
+            _cache[key] = cached
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    result, error = cached
+    if error is not None:
+        raise AddressError(*error)
+
+    return result
+
+
+def validate_address(addr):
+    """Returns *True* if *addr* is a valid e-mail address."""
+    try:
+        normalize_address(addr)
+    except AddressError:
+        return False
+
+    return True
+
+
+def validate_many(addrs):
+    """Validates all addresses in *addrs*. Returns a tuple of two lists:
+    normalized valid addresses and :py:exc:`AddressError` instances describing
+    invalid ones. Order of addresses is preserved."""
+    valid = []
+    invalid = []
+    for addr in addrs:
+        try:
+            valid.append(normalize_address(addr))
+        except AddressError as exc:
+            invalid.append(exc)
+
+    return valid, invalid
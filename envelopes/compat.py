@@ -20,13 +20,7 @@
 # THE SOFTWARE.
 #
 
-import sys
 
 def encoded(_str, coding):
-    if sys.version_info[0] == 3:
-        return _str
-    else:
-        if isinstance(_str, unicode):
-            return _str.encode(coding)
-        else:
-            return _str
+    # Strings are kept as text on Python 3.
+    return _str
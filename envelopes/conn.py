@@ -27,20 +27,117 @@ envelopes.conn
 This module contains SMTP connection wrapper.
 """
 
+from email.utils import parseaddr
+import itertools
+import os
+import re
 import smtplib
 import socket
+import threading
+import time
+
+from .dialer import default_dialer
+from .profiling import active_profile, phase
+from .serializer import MessageSerializer, StreamingSerializer
+from .tracing import span
 
 TimeoutException = socket.timeout
 
+_monotonic = getattr(time, 'monotonic', time.time)
+
 __all__ = ['SMTP', 'GMailSMTP', 'SendGridSMTP', 'MailcatcherSMTP',
-           'TimeoutException']
+           'NullSMTP', 'FileSMTP', 'TimeoutException',
+           'MessageTooLargeException']
+
+
+class MessageTooLargeException(smtplib.SMTPException):
+    """Raised when a message exceeds size limit advertised by the server with
+    the SIZE ESMTP extension (RFC 1870)."""
+
+    def __init__(self, size, max_size):
+        super(MessageTooLargeException, self).__init__(
+            'Message size %d exceeds server limit of %d bytes' % (
+                size, max_size
+            )
+        )
+        self.size = size
+        self.max_size = max_size
+
+
+class _DataWriter(object):
+    # Normalizes line endings to CRLF and dot-stuffs (RFC 5321, section
+    # 4.5.2) the DATA payload chunk by chunk.
+
+    def __init__(self, send):
+        self._send = send
+        self._line_start = True
+        self._pending_cr = False
+
+    def write(self, chunk):
+        data = bytes(chunk)
+        if self._pending_cr:
+            data = b'\r' + data
+            self._pending_cr = False
+
+        # A trailing CR might be the first half of CRLF split between chunks.
+        if data.endswith(b'\r'):
+            data = data[:-1]
+            self._pending_cr = True
+
+        if not data:
+            return
+
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        data = data.replace(b'\n', b'\r\n').replace(b'\r\n.', b'\r\n..')
+        if self._line_start and data.startswith(b'.'):
+            data = b'.' + data
+
+        self._line_start = data.endswith(b'\r\n')
+        self._send(data)
+
+    def close(self):
+        if self._pending_cr or not self._line_start:
+            self._send(b'\r\n')
+        self._send(b'.\r\n')
 
 
 class SMTP(object):
-    """Wrapper around :py:class:`smtplib.SMTP` class."""
+    """Wrapper around :py:class:`smtplib.SMTP` class.
+
+    If *stream* is *True* messages are rendered and transmitted in chunks
+    during the ``DATA`` command, instead of being rendered in memory first
+    and sent with :py:meth:`smtplib.SMTP.sendmail`. Transmission starts
+    before rendering finishes and memory use stays flat regardless of
+    message size.
+
+    If *dkim* (:py:class:`envelopes.dkim.DKIMSigner`) is given, messages are
+    DKIM signed. Signed messages are always rendered in memory first.
+
+    Socket timeouts, in seconds, can be set separately for opening the
+    connection (*connect_timeout*), STARTTLS handshake (*tls_timeout*), SMTP
+    commands (*command_timeout*) and transmission of the message and its
+    final reply (*data_timeout*). Each defaults to *timeout*. Messages sent
+    with :py:meth:`smtplib.SMTP.sendmail` (when the server doesn't support
+    CHUNKING and *stream* is *False*) are sent under *data_timeout* as a
+    whole.
+
+    If *deadline* is given, a single send, including (re)connecting, has to
+    finish within that many seconds. Timeouts are capped at time left and
+    :py:data:`TimeoutException` is raised once it runs out. The connection
+    is closed then, as the transaction is left in an unknown state, and
+    reopened by the next send.
+
+    Connections are opened with *dialer* (:py:class:`envelopes.dialer.Dialer`,
+    :py:data:`envelopes.dialer.default_dialer` by default), which caches
+    addresses of *host* and races connection attempts to them."""
+
+    #: Size of ``BDAT`` chunks used to send pre-rendered messages.
+    BDAT_CHUNK_SIZE = 1024 * 1024
 
     def __init__(self, host=None, port=25, login=None, password=None,
-                 tls=False, timeout=None):
+                 tls=False, timeout=None, stream=False, dkim=None,
+                 connect_timeout=None, tls_timeout=None, command_timeout=None,
+                 data_timeout=None, deadline=None, dialer=None):
         self._conn = None
         self._host = host
         self._port = port
@@ -48,6 +145,20 @@ class SMTP(object):
         self._password = password
         self._tls = tls
         self._timeout = timeout
+        self._connect_timeout = (timeout if connect_timeout is None
+                                 else connect_timeout)
+        self._tls_timeout = timeout if tls_timeout is None else tls_timeout
+        self._command_timeout = (timeout if command_timeout is None
+                                 else command_timeout)
+        self._data_timeout = timeout if data_timeout is None else data_timeout
+        self._deadline = deadline
+        self._expires = None
+        self._dialer = dialer or default_dialer
+        self._lock = threading.RLock()
+        self._last_used = None
+        self._stream = stream and dkim is None
+        self._dkim = dkim
+        self._serializer = None
 
     @property
     def is_connected(self):
@@ -67,27 +178,352 @@ class SMTP(object):
             except (AttributeError, smtplib.SMTPServerDisconnected):
                 pass
 
-            if self._timeout:
-                self._conn = smtplib.SMTP(self._host, self._port,
-                                          timeout=self._timeout)
-            else:
-                self._conn = smtplib.SMTP(self._host, self._port)
+            with phase('connect'), span('smtp.connect') as current:
+                current.set_attribute('server.address', self._host or '')
+                current.set_attribute('server.port', self._port)
+                timeout = self._remaining(self._connect_timeout)
+                if timeout:
+                    self._conn = smtplib.SMTP(timeout=timeout)
+                else:
+                    self._conn = smtplib.SMTP()
+
+                self._conn._get_socket = self._get_socket
+                if self._host:
+                    code, msg = self._conn.connect(self._host, self._port)
+                    if code != 220:
+                        self._conn.close()
+                        raise smtplib.SMTPConnectError(code, msg)
 
         if self._tls:
-            self._conn.starttls()
+            with phase('tls'), span('smtp.starttls') as current:
+                self._set_timeout(self._tls_timeout)
+                self._traced_command(current, self._conn.starttls)
 
+        self._set_timeout(self._command_timeout)
         if self._login:
-            self._conn.login(self._login, self._password or '')
+            with phase('login'), span('smtp.login') as current:
+                self._traced_command(current, self._conn.login, self._login,
+                                     self._password or '')
 
-    def send(self, envelope):
-        """Sends an *envelope*."""
+        self._last_used = _monotonic()
+
+    def _get_socket(self, host, port, timeout):
+        # Replaces smtplib.SMTP._get_socket() of the connection.
+        if not isinstance(timeout, (int, float)):
+            timeout = socket.getdefaulttimeout()
+        return self._dialer.connect(host, port, timeout)
+
+    def _remaining(self, timeout):
+        # Caps *timeout* at time left until the send deadline.
+        if self._expires is None:
+            return timeout
+
+        remaining = self._expires - _monotonic()
+        if remaining <= 0:
+            if self._conn is not None:
+                self._conn.close()
+            raise TimeoutException('Send deadline of %ss exceeded' %
+                                   self._deadline)
+
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    def _set_timeout(self, timeout):
+        timeout = self._remaining(timeout)
+        sock = getattr(self._conn, 'sock', None)
+        if sock is not None:
+            if timeout is None:
+                timeout = socket.getdefaulttimeout()
+            sock.settimeout(timeout)
+
+    def _start_deadline(self):
+        if self._deadline is not None:
+            self._expires = _monotonic() + self._deadline
+
+    def _traced_command(self, current, command, *args):
+        # Records reply code of a command returning (code, resp) pair or
+        # failing with smtplib.SMTPResponseException.
+        try:
+            reply = command(*args)
+        except smtplib.SMTPResponseException as exc:
+            current.set_attribute('smtp.reply_code', exc.smtp_code)
+            raise
+
+        if isinstance(reply, tuple):
+            current.set_attribute('smtp.reply_code', reply[0])
+        return reply
+
+    @property
+    def max_message_size(self):
+        """Maximum message size in bytes advertised by the server with SIZE
+        ESMTP extension, or *None* if the server doesn't declare a limit.
+        Connects to the server if needed."""
         if not self.is_connected:
             self._connect()
 
-        msg = envelope.to_mime_message()
-        to_addrs = [envelope._addrs_to_header([addr]) for addr in envelope._to + envelope._cc + envelope._bcc]
+        return self._max_message_size()
+
+    def _max_message_size(self):
+        self._conn.ehlo_or_helo_if_needed()
+        if not self._conn.has_extn('size'):
+            return None
+
+        try:
+            max_size = int(self._conn.esmtp_features['size'])
+        except (KeyError, ValueError):
+            return None
+
+        return max_size or None
+
+    def _check_size(self, size):
+        max_size = self._max_message_size()
+        if max_size is not None and size > max_size:
+            raise MessageTooLargeException(size, max_size)
+
+    def _final_reply(self):
+        code, resp = self._conn.getreply()
+        if code != 250:
+            if code == 421:
+                self._conn.close()
+            else:
+                self._conn.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+    def _begin_transaction(self, from_addr, to_addrs, size, chunking):
+        # Mirrors smtplib.SMTP.sendmail() error handling.
+        conn = self._conn
+
+        mail_options = []
+        if conn.does_esmtp and conn.has_extn('size'):
+            mail_options.append('size=%d' % size)
+        if chunking and conn.has_extn('binarymime'):
+            mail_options.append('body=BINARYMIME')
+
+        code, resp = conn.mail(from_addr, mail_options)
+        if code != 250:
+            if code == 421:
+                conn.close()
+            else:
+                conn.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for to_addr in to_addrs:
+            code, resp = conn.rcpt(to_addr)
+            if code not in (250, 251):
+                refused[to_addr] = (code, resp)
+            if code == 421:
+                conn.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+
+        if len(refused) == len(to_addrs):
+            conn.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        return refused
+
+    def _bdat(self, chunk, last=False):
+        if self._expires is not None:
+            self._set_timeout(self._data_timeout)
+
+        if last:
+            self._conn.putcmd('bdat', '%d LAST' % len(chunk))
+        else:
+            self._conn.putcmd('bdat', '%d' % len(chunk))
+
+        if len(chunk):
+            self._conn.send(chunk)
+
+        self._final_reply()
+
+    def _send_bdat(self, msg):
+        # BDAT payload is sent verbatim, no dot-stuffing or EOL scanning.
+        view = memoryview(msg)
+        try:
+            if not len(view):
+                self._bdat(view, last=True)
+                return
+
+            for offset in range(0, len(view), self.BDAT_CHUNK_SIZE):
+                chunk = view[offset:offset + self.BDAT_CHUNK_SIZE]
+                try:
+                    self._bdat(chunk, last=(offset + len(chunk) == len(view)))
+                finally:
+                    chunk.release()
+        finally:
+            view.release()
+
+    def _send_chunk(self, data):
+        self._set_timeout(self._data_timeout)
+        self._conn.send(data)
+
+    def _stream_bdat(self, envelope):
+        try:
+            self._serializer.stream(envelope, self._bdat)
+        except smtplib.SMTPException:
+            raise
+        except Exception:
+            # Discard the partial message by dropping the connection.
+            self._conn.close()
+            raise
+
+        self._bdat(b'', last=True)
+
+    def _stream_data(self, envelope):
+        conn = self._conn
+
+        conn.putcmd('data')
+        code, resp = conn.getreply()
+        if code != 354:
+            conn.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        self._set_timeout(self._data_timeout)
+        if self._expires is not None:
+            writer = _DataWriter(self._send_chunk)
+        else:
+            writer = _DataWriter(conn.send)
+        try:
+            self._serializer.stream(envelope, writer.write)
+            writer.close()
+        except Exception:
+            # There's no way to abort DATA, so drop the connection to
+            # prevent the server from accepting a truncated message.
+            conn.close()
+            raise
+
+        self._final_reply()
+
+    def send(self, envelope):
+        """Sends an *envelope*.
+
+        Messages are transmitted with ``BDAT`` commands if the server
+        supports the CHUNKING ESMTP extension and with ``DATA`` otherwise."""
+        with self._lock:
+            self._start_deadline()
+            try:
+                return self._send(envelope)
+            finally:
+                self._expires = None
+                self._last_used = _monotonic()
+
+    def _send(self, envelope):
+        self._set_timeout(self._command_timeout)
+        if not self.is_connected:
+            self._connect(replace_current=True)
+
+        with phase('render'):
+            if self._serializer is None:
+                if self._stream:
+                    self._serializer = StreamingSerializer()
+                else:
+                    self._serializer = MessageSerializer(dkim=self._dkim)
+
+            from_addr = envelope._encoded(
+                envelope._addrs_to_header([envelope._from])
+            )
+            to_addrs = [envelope._addrs_to_header([addr]) for addr in envelope._recipients()]
+
+            if active_profile() is not None:
+                self._serializer.prepare(envelope)
+
+        if self._stream:
+            return self._transmit(from_addr, to_addrs, envelope=envelope)
+
+        with phase('serialize'):
+            msg = self._serializer.serialize(envelope)
 
-        return self._conn.sendmail(msg['From'], to_addrs, msg.as_string())
+        return self._transmit(from_addr, to_addrs, msg=msg)
+
+    def _transmit(self, from_addr, to_addrs, msg=None, envelope=None):
+        # Sends rendered *msg* or streams *envelope* if *msg* is None.
+        with phase('transmit'), span('smtp.sendmail') as current:
+            current.set_attribute('server.address', self._host or '')
+            current.set_attribute('smtp.recipients', len(to_addrs))
+
+            try:
+                self._set_timeout(self._command_timeout)
+                self._conn.ehlo_or_helo_if_needed()
+                chunking = bool(self._conn.does_esmtp and
+                                self._conn.has_extn('chunking'))
+
+                if msg is not None:
+                    current.set_attribute('smtp.message_size', len(msg))
+                    refused = self._send_rendered(from_addr, to_addrs, msg,
+                                                  chunking)
+                else:
+                    size = envelope.estimated_size()
+                    current.set_attribute('smtp.message_size', size)
+                    self._check_size(size)
+
+                    refused = self._begin_transaction(from_addr, to_addrs,
+                                                      size, chunking)
+                    if chunking:
+                        self._set_timeout(self._data_timeout)
+                        self._stream_bdat(envelope)
+                    else:
+                        self._stream_data(envelope)
+            except smtplib.SMTPResponseException as exc:
+                current.set_attribute('smtp.reply_code', exc.smtp_code)
+                raise
+
+            current.set_attribute('smtp.reply_code', 250)
+            current.set_attribute('smtp.refused_recipients',
+                                  len(refused or ()))
+            return refused
+
+    def _send_rendered(self, from_addr, to_addrs, msg, chunking):
+        self._check_size(len(msg))
+
+        if not chunking:
+            self._set_timeout(self._data_timeout)
+            return self._conn.sendmail(from_addr, to_addrs, msg)
+
+        refused = self._begin_transaction(from_addr, to_addrs, len(msg),
+                                          chunking)
+        self._set_timeout(self._data_timeout)
+        self._send_bdat(msg)
+        return refused
+
+    def send_rendered(self, from_addr, to_addrs, msg):
+        """Sends an already rendered message *msg* (bytes-like object, e.g.
+        returned by :py:meth:`envelopes.serializer.MessageSerializer.serialize`)
+        from *from_addr* to *to_addrs*. Used to deliver the same rendered
+        message through many connections."""
+        with self._lock:
+            self._start_deadline()
+            try:
+                self._set_timeout(self._command_timeout)
+                if not self.is_connected:
+                    self._connect(replace_current=True)
+
+                return self._transmit(from_addr, to_addrs, msg=msg)
+            finally:
+                self._expires = None
+                self._last_used = _monotonic()
+
+    @property
+    def idle_time(self):
+        """Seconds since the connection was last opened or used to send,
+        or *None* if it's closed."""
+        if self._conn is None or self._last_used is None:
+            return None
+
+        return _monotonic() - self._last_used
+
+    def close(self):
+        """Closes the connection with ``QUIT``. It's reopened by the next
+        send."""
+        with self._lock:
+            if self._conn is None:
+                return
+
+            try:
+                self._conn.quit()
+            except (smtplib.SMTPException, socket.error):
+                self._conn.close()
+            self._conn = None
 
 
 class GMailSMTP(SMTP):
@@ -128,3 +564,259 @@ class MailcatcherSMTP(SMTP):
         super(MailcatcherSMTP, self).__init__(
             self.MAILCATCHER_SMTP_HOST, port=port
         )
+
+
+class _CountingWriter(object):
+    # Message writer discarding data.
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class NullSMTP(SMTP):
+    """Transport which renders messages fully and discards them, counting
+    messages and bytes. Usable anywhere :py:class:`SMTP` is, e.g. to measure
+    throughput of the rendering pipeline without a mail server. *stream* and
+    *dkim* have the same meaning as in :py:class:`SMTP`."""
+
+    def __init__(self, stream=False, dkim=None):
+        super(NullSMTP, self).__init__(stream=stream, dkim=dkim)
+        self._stats_lock = threading.Lock()
+
+        #: Number of messages sent.
+        self.messages = 0
+
+        #: Number of bytes sent.
+        self.bytes = 0
+
+    @property
+    def is_connected(self):
+        return True
+
+    def _connect(self, replace_current=False):
+        pass
+
+    def _max_message_size(self):
+        return None
+
+    def _open_message(self, from_addr, to_addrs):
+        # Returns a writer with write(chunk), close() and abort() methods.
+        return _CountingWriter()
+
+    def _deliver(self, from_addr, to_addrs, render):
+        writer = self._open_message(from_addr, to_addrs)
+        try:
+            render(writer)
+        except Exception:
+            writer.abort()
+            raise
+
+        writer.close()
+        with self._stats_lock:
+            self.messages += 1
+            self.bytes += writer.size
+
+        return {}
+
+    def _transmit(self, from_addr, to_addrs, msg=None, envelope=None):
+        # Rendering, locking and profiling are shared with SMTP.send() and
+        # SMTP.send_rendered(), only delivery differs.
+        with phase('transmit'):
+            if msg is not None:
+                return self._deliver(from_addr, to_addrs,
+                                     lambda writer: writer.write(msg))
+
+            return self._deliver(
+                from_addr, to_addrs,
+                lambda writer: self._serializer.stream(envelope, writer.write)
+            )
+
+
+class _MaildirWriter(object):
+    # Writes a message to tmp/. The transport moves it to new/ once it's
+    # synced to disk.
+
+    def __init__(self, transport, name, header):
+        self._transport = transport
+        self.tmp_path = os.path.join(transport._path, 'tmp', name)
+        self.new_path = os.path.join(transport._path, 'new', name)
+        self._fh = open(self.tmp_path, 'wb')
+        self._fh.write(header)
+        self.size = 0
+
+    def write(self, chunk):
+        self._fh.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        self._fh.close()
+        self._transport._written(self)
+
+    def abort(self):
+        self._fh.close()
+        os.unlink(self.tmp_path)
+
+
+class _MboxWriter(object):
+    # Appends a message to mbox file, converting line endings to LF and
+    # quoting "From " lines (mboxrd). Holds the mbox lock until closed.
+
+    FROM_REGEXP = re.compile(br'^(>*From )', re.M)
+
+    def __init__(self, transport, header):
+        self._transport = transport
+        self._fh = transport._mbox
+        self._start = self._fh.tell()
+        self._tail = b''
+        self.size = 0
+        self._fh.write(header)
+
+    def _write_lines(self, data):
+        data = self.FROM_REGEXP.sub(br'>\1', data.replace(b'\r\n', b'\n'))
+        self._fh.write(data)
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        data = self._tail + bytes(chunk)
+        end = data.rfind(b'\n') + 1
+        self._tail = data[end:]
+        if end:
+            self._write_lines(data[:end])
+
+    def close(self):
+        if self._tail:
+            self._write_lines(self._tail + b'\n')
+        self._fh.write(b'\n')
+        self._fh.flush()
+        self._transport._written(self)
+
+    def abort(self):
+        self._fh.seek(self._start)
+        self._fh.truncate()
+        self._transport._lock.release()
+
+
+class FileSMTP(NullSMTP):
+    """Transport which renders messages and writes them to a local mailbox
+    instead of sending them, e.g. in staging environments. Usable anywhere
+    :py:class:`SMTP` is.
+
+    *path* is a maildir directory (created if needed) if *format* is
+    ``'maildir'``, or a file messages are appended to if it's ``'mbox'``.
+    Written data is fsynced to disk in batches of *fsync_every* messages and
+    on :py:meth:`flush` or :py:meth:`close`. Pass *0* to leave syncing to the
+    OS. Maildir messages are moved to ``new/`` once they're synced, so
+    readers never see partially written ones. *stream* and *dkim* have the same meaning as in :py:class:`SMTP`."""
+
+    FORMATS = ('maildir', 'mbox')
+
+    def __init__(self, path, format='maildir', fsync_every=100, stream=False,
+                 dkim=None):
+        if format not in self.FORMATS:
+            raise ValueError('Unsupported mailbox format: %s' % format)
+
+        super(FileSMTP, self).__init__(stream=stream, dkim=dkim)
+        self._path = path
+        self._format = format
+        self._fsync_every = fsync_every
+        self._pending = []
+        self._counter = itertools.count()
+        self._hostname = socket.gethostname().replace('/', '\\057').replace(
+            ':', '\\072'
+        )
+        self._mbox = None
+
+        if format == 'maildir':
+            for subdir in ('tmp', 'new', 'cur'):
+                try:
+                    os.makedirs(os.path.join(path, subdir))
+                except OSError:
+                    if not os.path.isdir(os.path.join(path, subdir)):
+                        raise
+        else:
+            self._mbox = open(path, 'ab')
+
+    def _open_message(self, from_addr, to_addrs):
+        sender = parseaddr(from_addr)[1] or 'MAILER-DAEMON'
+        if self._format == 'maildir':
+            now = time.time()
+            name = '%d.M%dP%dQ%d.%s' % (
+                now, (now % 1) * 1000000, os.getpid(), next(self._counter),
+                self._hostname
+            )
+            header = ('Return-Path: <%s>\r\n' % sender).encode('utf-8')
+            return _MaildirWriter(self, name, header)
+
+        header = ('From %s %s\n' % (sender, time.asctime())).encode('utf-8')
+        self._lock.acquire()
+        try:
+            if self._mbox is None:
+                # Reopened after close().
+                self._mbox = open(self._path, 'ab')
+            return _MboxWriter(self, header)
+        except Exception:
+            self._lock.release()
+            raise
+
+    def _written(self, writer):
+        # Called by writers once a message is complete.
+        if self._format == 'maildir':
+            with self._lock:
+                if not self._fsync_every:
+                    os.rename(writer.tmp_path, writer.new_path)
+                    return
+
+                self._pending.append(writer)
+                sync = len(self._pending) >= self._fsync_every
+        else:
+            self._pending.append(writer)
+            sync = len(self._pending) >= self._fsync_every > 0
+            if not self._fsync_every:
+                self._pending = []
+            self._lock.release()
+
+        if sync:
+            self.flush()
+
+    def flush(self):
+        """Syncs messages written so far to disk."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._format == 'mbox':
+                if pending:
+                    os.fsync(self._mbox.fileno())
+                return
+
+            for writer in pending:
+                fd = os.open(writer.tmp_path, os.O_RDWR)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.rename(writer.tmp_path, writer.new_path)
+
+            if pending and hasattr(os, 'O_DIRECTORY'):
+                # Make renames into new/ durable as well.
+                fd = os.open(os.path.join(self._path, 'new'),
+                             os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def close(self):
+        """Syncs pending messages and closes the mailbox."""
+        with self._lock:
+            self.flush()
+            if self._mbox is not None:
+                self._mbox.close()
+                self._mbox = None
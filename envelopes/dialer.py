@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.dialer
+================
+
+This module implements opening connections to hosts with many addresses.
+Addresses are resolved once and cached, and connection attempts are raced
+with staggered starts ("Happy Eyeballs", RFC 8305), so a dead address
+doesn't cost a full timeout.
+"""
+
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+__all__ = ['Dialer', 'default_dialer']
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+_IN_PROGRESS = frozenset([
+    errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+    getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)
+])
+
+
+def _interleave(addrinfos):
+    # Alternates address families starting with the preferred (first) one
+    # (RFC 8305, section 4).
+    if not addrinfos:
+        return []
+
+    first = [info for info in addrinfos if info[0] == addrinfos[0][0]]
+    rest = [info for info in addrinfos if info[0] != addrinfos[0][0]]
+
+    result = []
+    for index in range(max(len(first), len(rest))):
+        result.extend(first[index:index + 1])
+        result.extend(rest[index:index + 1])
+    return result
+
+
+class Dialer(object):
+    """Opens TCP connections, racing attempts across addresses of a host.
+
+    Results of :py:func:`socket.getaddrinfo` are cached for *ttl* seconds.
+    Attempts start *delay* seconds apart (or as soon as the previous one
+    fails) and the first established connection wins. Addresses which failed
+    are tried last for *penalty* seconds, and the address which connected
+    most recently first."""
+
+    def __init__(self, ttl=300, delay=0.25, penalty=60):
+        self._ttl = ttl
+        self._delay = delay
+        self._penalty = penalty
+        self._cache = {}
+        self._failures = {}
+        self._preferred = {}
+        self._lock = threading.Lock()
+
+    def _getaddrinfo(self, host, port):
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    def resolve(self, host, port):
+        """Returns cached ``getaddrinfo()`` results for *host* and *port*
+        with address families interleaved."""
+        key = (host, port)
+        now = _monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        addrinfos = _interleave(self._getaddrinfo(host, port))
+        with self._lock:
+            self._cache[key] = (now + self._ttl, addrinfos)
+
+        return addrinfos
+
+    def clear_cache(self):
+        """Forgets resolved addresses and their health."""
+        with self._lock:
+            self._cache.clear()
+            self._failures.clear()
+            self._preferred.clear()
+
+    def is_healthy(self, sockaddr):
+        """Returns *False* if connecting to *sockaddr* failed within the
+        last *penalty* seconds."""
+        with self._lock:
+            failed_until = self._failures.get(sockaddr)
+
+        return failed_until is None or failed_until <= _monotonic()
+
+    def addresses(self, host, port):
+        """Returns ``getaddrinfo()`` results for *host* and *port* in order
+        they're tried."""
+        addrinfos = self.resolve(host, port)
+        with self._lock:
+            preferred = self._preferred.get((host, port))
+
+        def order(item):
+            index, info = item
+            return (info[4] != preferred, not self.is_healthy(info[4]), index)
+
+        return [info for _, info in sorted(enumerate(addrinfos), key=order)]
+
+    def _failed(self, sockaddr):
+        with self._lock:
+            self._failures[sockaddr] = _monotonic() + self._penalty
+
+    def _succeeded(self, host, port, sockaddr):
+        with self._lock:
+            self._failures.pop(sockaddr, None)
+            self._preferred[(host, port)] = sockaddr
+
+    def connect(self, host, port, timeout=None):
+        """Returns a socket connected to *host* on *port*. *timeout* bounds
+        the whole race and is set on the returned socket. Raises
+        :py:class:`socket.timeout` or the last connection error if no
+        attempt succeeds."""
+        addrinfos = self.addresses(host, port)
+        if not addrinfos:
+            raise socket.error('getaddrinfo returns an empty list')
+
+        expires = None if timeout is None else _monotonic() + timeout
+        pending = {}
+        error = None
+        winner = None
+        next_start = 0
+        # Unlike select(), selectors based on epoll or poll handle file
+        # descriptors above FD_SETSIZE, common in busy processes.
+        selector = selectors.DefaultSelector()
+
+        try:
+            while winner is None and (addrinfos or pending):
+                now = _monotonic()
+                if expires is not None and now >= expires:
+                    break
+
+                if addrinfos and (not pending or now >= next_start):
+                    family, socktype, proto, _, sockaddr = addrinfos.pop(0)
+                    sock = None
+                    try:
+                        sock = socket.socket(family, socktype, proto)
+                        sock.setblocking(False)
+                        code = sock.connect_ex(sockaddr)
+                    except socket.error as exc:
+                        if sock is not None:
+                            sock.close()
+                        self._failed(sockaddr)
+                        error = exc
+                        continue
+
+                    if code == 0:
+                        winner = (sock, sockaddr)
+                    elif code in _IN_PROGRESS:
+                        pending[sock] = sockaddr
+                        selector.register(sock, selectors.EVENT_WRITE)
+                        next_start = now + self._delay
+                    else:
+                        sock.close()
+                        self._failed(sockaddr)
+                        error = socket.error(code, os.strerror(code))
+                    continue
+
+                wait = None
+                if addrinfos:
+                    wait = max(next_start - now, 0)
+                if expires is not None:
+                    wait = min(expires - now, wait if wait is not None
+                               else expires - now)
+
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    sockaddr = pending.pop(sock)
+                    code = sock.getsockopt(socket.SOL_SOCKET,
+                                           socket.SO_ERROR)
+                    if code == 0 and winner is None:
+                        winner = (sock, sockaddr)
+                        continue
+
+                    sock.close()
+                    if code:
+                        self._failed(sockaddr)
+                        error = socket.error(code, os.strerror(code))
+                        # Don't wait for the delay after a failure.
+                        next_start = 0
+        finally:
+            for sock in pending:
+                sock.close()
+            selector.close()
+
+        if winner is None:
+            if error is None or (expires is not None and
+                                 _monotonic() >= expires):
+                raise socket.timeout('timed out')
+            raise error
+
+        sock, sockaddr = winner
+        self._succeeded(host, port, sockaddr)
+        sock.setblocking(True)
+        sock.settimeout(timeout)
+        return sock
+
+
+#: :py:class:`Dialer` shared by :py:class:`envelopes.conn.SMTP` connections,
+#: unless given their own.
+default_dialer = Dialer()
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.dkim
+==============
+
+This module implements DKIM (RFC 6376) signing of rendered messages with
+``rsa-sha256`` algorithm. If the `cryptography
+<https://cryptography.io/>`_ package is installed it's used to compute RSA
+signatures. Otherwise they're computed in pure Python, with blinding.
+
+Keys shorter than 1024 bits are rejected (RFC 8301). 2048 bit keys are
+recommended.
+"""
+
+import base64
+import binascii
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import threading
+import time
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+except ImportError:
+    rsa = None
+
+__all__ = ['DKIMSigner', 'DKIMError']
+
+DEFAULT_HEADERS = (
+    'from', 'to', 'cc', 'subject', 'date', 'message-id', 'reply-to',
+    'mime-version', 'content-type'
+)
+CANONICALIZATIONS = ('simple', 'relaxed')
+
+#: Minimum accepted size of RSA keys in bits.
+MIN_KEY_BITS = 1024
+
+# DER encoded DigestInfo prefix of SHA-256 (RFC 8017, section 9.2).
+_SHA256_PREFIX = binascii.unhexlify(b'3031300d060960864801650304020105000420')
+
+_PEM_REGEXP = re.compile(
+    br'-----BEGIN (RSA )?PRIVATE KEY-----(.*?)-----END (RSA )?PRIVATE KEY-----',
+    re.S
+)
+_FIELD_SPLIT_REGEXP = re.compile(br'\r\n(?![ \t])')
+_WSP_REGEXP = re.compile(br'[ \t]+')
+_TRAILING_WSP_REGEXP = re.compile(br'[ \t]+\r\n')
+_TRAILING_EOLS_REGEXP = re.compile(br'(\r\n)+$')
+
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+
+class DKIMError(Exception):
+    """Raised when a DKIM key or signer configuration is invalid."""
+    pass
+
+
+def _der_read(data, offset, expected_tag):
+    # Returns (value, next offset) of a DER TLV at *offset*.
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7f
+            length = int(binascii.hexlify(data[offset:offset + size]), 16)
+            offset += size
+    except (IndexError, ValueError):
+        raise DKIMError('Malformed private key')
+
+    if tag != expected_tag or offset + length > len(data):
+        raise DKIMError('Malformed private key')
+
+    return data[offset:offset + length], offset + length
+
+
+def _der_integers(data):
+    sequence, _ = _der_read(data, 0, 0x30)
+    integers = []
+    offset = 0
+    while offset < len(sequence):
+        if sequence[offset] != 0x02:
+            # PKCS#8 wrapper: version, AlgorithmIdentifier, OCTET STRING.
+            if not integers or sequence[offset] != 0x30:
+                raise DKIMError('Malformed private key')
+            _, offset = _der_read(sequence, offset, 0x30)
+            key, _ = _der_read(sequence, offset, 0x04)
+            return _der_integers(key)
+
+        value, offset = _der_read(sequence, offset, 0x02)
+        integers.append(int(binascii.hexlify(value) or b'0', 16))
+
+    return integers
+
+
+def _inverse(value, modulus):
+    # Modular inverse of *value*, or *None* if it doesn't exist.
+    a, b = value % modulus, modulus
+    x0, x1 = 1, 0
+    while b:
+        quotient = a // b
+        a, b = b, a - quotient * b
+        x0, x1 = x1, x0 - quotient * x1
+
+    if a != 1:
+        return None
+
+    return x0 % modulus
+
+
+class _RSAKey(object):
+    __slots__ = ('n', 'e', 'd', 'p', 'q', 'dp', 'dq', 'qinv', 'size',
+                 '_private')
+
+    def __init__(self, integers):
+        if len(integers) < 9:
+            raise DKIMError('Not an RSA private key')
+
+        (_, self.n, self.e, self.d, self.p, self.q, self.dp, self.dq,
+         self.qinv) = integers[:9]
+        if self.n.bit_length() < MIN_KEY_BITS:
+            raise DKIMError('RSA key too short: %d bits, at least %d '
+                            'required' % (self.n.bit_length(), MIN_KEY_BITS))
+
+        self.size = (self.n.bit_length() + 7) // 8
+        self._private = None
+        if rsa is not None:
+            try:
+                self._private = rsa.RSAPrivateNumbers(
+                    self.p, self.q, self.d, self.dp, self.dq, self.qinv,
+                    rsa.RSAPublicNumbers(self.e, self.n)
+                ).private_key(default_backend())
+            except ValueError:
+                raise DKIMError('Malformed private key')
+
+    @classmethod
+    def from_pem(cls, pem):
+        if not isinstance(pem, bytes):
+            pem = pem.encode('ascii')
+
+        match = _PEM_REGEXP.search(pem)
+        if match is None:
+            raise DKIMError('No PEM encoded private key found')
+
+        try:
+            der = bytearray(base64.b64decode(match.group(2)))
+        except (TypeError, binascii.Error):
+            raise DKIMError('Malformed private key')
+
+        return cls(_der_integers(der))
+
+    def sign(self, digest):
+        # RSASSA-PKCS1-v1_5 with SHA-256.
+        if self._private is not None:
+            return self._private.sign(
+                digest, padding.PKCS1v15(), utils.Prehashed(hashes.SHA256())
+            )
+
+        digest_info = _SHA256_PREFIX + digest
+        pad_len = self.size - len(digest_info) - 3
+        if pad_len < 8:
+            raise DKIMError('RSA key too short')
+
+        message = int(binascii.hexlify(
+            b'\x00\x01' + b'\xff' * pad_len + b'\x00' + digest_info
+        ), 16)
+
+        # pow() doesn't run in constant time, so the message is blinded with
+        # a random factor before CRT exponentiation.
+        while True:
+            blind = int(binascii.hexlify(os.urandom(self.size)), 16) % self.n
+            unblind = _inverse(blind, self.n)
+            if blind > 1 and unblind is not None:
+                break
+
+        blinded = (message * pow(blind, self.e, self.n)) % self.n
+        m1 = pow(blinded, self.dp, self.p)
+        m2 = pow(blinded, self.dq, self.q)
+        signature = m2 + self.q * ((self.qinv * (m1 - m2)) % self.p)
+        signature = (signature * unblind) % self.n
+
+        # A faulty CRT result would leak the factors of the key.
+        if pow(signature, self.e, self.n) != message:
+            raise DKIMError('RSA signature verification failed')
+
+        return binascii.unhexlify('%0*x' % (self.size * 2, signature))
+
+
+def _load_key_file(path):
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime
+    with _key_cache_lock:
+        cached = _key_cache.get(path)
+
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'rb') as fh:
+        key = _RSAKey.from_pem(fh.read())
+
+    with _key_cache_lock:
+        _key_cache[path] = (mtime, key)
+
+    return key
+
+
+def _relaxed_header(field):
+    name, _, value = field.partition(b':')
+    value = _WSP_REGEXP.sub(b' ', value.replace(b'\r\n', b'')).strip()
+    return name.strip().lower() + b':' + value + b'\r\n'
+
+
+class DKIMSigner(object):
+    """Signs messages for *domain* with key published under *selector*.
+
+    *private_key* is a PEM encoded RSA private key (PKCS#1 or unencrypted
+    PKCS#8) of at least :py:data:`MIN_KEY_BITS` bits, 2048 bits is
+    recommended. *headers* lists (lowercase) names of headers to sign, if they're
+    present in the message. *canonicalization* is given as
+    ``header/body``, with ``simple`` or ``relaxed`` algorithm for each.
+
+    Body hashes are cached for messages built from the same parts (see
+    :py:meth:`envelopes.serializer.MessageSerializer`), so in bulk sends only
+    the header block is hashed and signed for each message.
+    """
+
+    #: Maximum number of cached body hashes.
+    BODY_HASH_CACHE_SIZE = 1024
+
+    def __init__(self, domain, selector, private_key, headers=DEFAULT_HEADERS,
+                 canonicalization='relaxed/relaxed', timestamp=True):
+        if isinstance(private_key, _RSAKey):
+            self._key = private_key
+        else:
+            self._key = _RSAKey.from_pem(private_key)
+
+        header_canon, _, body_canon = canonicalization.partition('/')
+        body_canon = body_canon or 'simple'
+        if (header_canon not in CANONICALIZATIONS or
+                body_canon not in CANONICALIZATIONS):
+            raise DKIMError(
+                'Unsupported canonicalization: %s' % canonicalization
+            )
+
+        self.domain = domain
+        self.selector = selector
+        self._headers = [header.lower() for header in headers]
+        self._header_canon = header_canon
+        self._body_canon = body_canon
+        self._timestamp = timestamp
+        self._body_hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, domain, selector, path, **kwargs):
+        """Creates a signer with private key read from *path*. Keys are
+        cached and only read again if the file is modified."""
+        return cls(domain, selector, _load_key_file(path), **kwargs)
+
+    def _canonical_body(self, body):
+        if self._body_canon == 'relaxed':
+            body = _TRAILING_WSP_REGEXP.sub(
+                b'\r\n', _WSP_REGEXP.sub(b' ', bytes(body))
+            )
+            body = _TRAILING_EOLS_REGEXP.sub(b'', body)
+            return body + b'\r\n' if body else body
+
+        if bytes(body[-4:]) != b'\r\n\r\n' and bytes(body[-2:]) == b'\r\n':
+            # Already canonical, hash it without copying.
+            return body
+
+        body = _TRAILING_EOLS_REGEXP.sub(b'', bytes(body))
+        return body + b'\r\n'
+
+    def body_hash(self, body, key=None):
+        """Returns base64 encoded SHA-256 hash of canonicalized *body*. If
+        *key* isn't *None* the hash is cached under it."""
+        if key is not None:
+            with self._lock:
+                try:
+                    result = self._body_hashes.pop(key)
+                except KeyError:
+                    pass
+                else:
+                    self._body_hashes[key] = result
+                    return result
+
+        digest = hashlib.sha256(self._canonical_body(body)).digest()
+        result = base64.b64encode(digest)
+
+        if key is not None:
+            with self._lock:
+                self._body_hashes[key] = result
+                while len(self._body_hashes) > self.BODY_HASH_CACHE_SIZE:
+                    self._body_hashes.popitem(last=False)
+
+        return result
+
+    def _select_headers(self, header_block):
+        fields = {}
+        for field in _FIELD_SPLIT_REGEXP.split(bytes(header_block)):
+            if not field:
+                continue
+            name = field.split(b':', 1)[0].strip().lower().decode('ascii')
+            fields.setdefault(name, []).append(field + b'\r\n')
+
+        # Multiple instances of a header are signed from the bottom up.
+        names = []
+        selected = []
+        for name in self._headers:
+            if fields.get(name):
+                names.append(name)
+                selected.append(fields[name].pop())
+
+        return names, selected
+
+    def _canonical_header(self, field):
+        if self._header_canon == 'relaxed':
+            return _relaxed_header(field)
+
+        return field
+
+    def sign(self, header_block, body, body_key=None):
+        """Returns ``DKIM-Signature`` header (terminated with CRLF) for
+        a message with *header_block* (headers, each terminated with CRLF)
+        and *body*. *body_key* is passed to :py:meth:`body_hash`."""
+        names, selected = self._select_headers(header_block)
+
+        tags = [
+            'v=1', 'a=rsa-sha256',
+            'c=%s/%s' % (self._header_canon, self._body_canon),
+            'd=%s' % self.domain, 's=%s' % self.selector
+        ]
+        if self._timestamp:
+            tags.append('t=%d' % int(time.time()))
+
+        header = ('DKIM-Signature: %s;\r\n h=%s;\r\n bh=%s;\r\n b=' % (
+            '; '.join(tags), ':'.join(names),
+            self.body_hash(body, body_key).decode('ascii')
+        )).encode('ascii')
+
+        digest = hashlib.sha256()
+        for field in selected:
+            digest.update(self._canonical_header(field))
+        digest.update(self._canonical_header(header)[:-2]
+                      if self._header_canon == 'relaxed' else header)
+
+        signature = base64.b64encode(self._key.sign(digest.digest()))
+        lines = [signature[i:i + 72] for i in range(0, len(signature), 72)]
+        return header + b'\r\n '.join(lines) + b'\r\n'
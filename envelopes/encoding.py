@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.encoding
+==================
+
+This module contains low-level helpers for encoding message content for the
+wire.
+"""
+
+import binascii
+from collections import OrderedDict
+import threading
+
+__all__ = ['BODY_ENCODINGS', 'TextPartCache', 'text_part_cache']
+
+CRLF = b'\r\n'
+
+#: Supported values of text part encoding. *None* means the charset's default
+#: and ``'shortest'`` picks the smaller of quoted-printable and base64.
+BODY_ENCODINGS = (None, 'base64', 'quoted-printable', '8bit', 'shortest')
+
+# Base64 is encoded in blocks of whole 57 byte input lines, which keeps the
+# intermediate strings bounded regardless of attachment size.
+BASE64_LINE_LENGTH = 57
+BASE64_BLOCK_SIZE = BASE64_LINE_LENGTH * 1024
+
+
+def base64_lines(data):
+    """Yields base64 encoded *data* as lines of at most 76 characters, without
+    line terminators."""
+    data = memoryview(data)
+    for offset in range(0, len(data), BASE64_BLOCK_SIZE):
+        block = memoryview(binascii.b2a_base64(
+            data[offset:offset + BASE64_BLOCK_SIZE]
+        ))
+        end = len(block) - 1
+        for line_start in range(0, end, 76):
+            yield block[line_start:min(line_start + 76, end)]
+
+
+def normalize_eols(data):
+    """Returns *data* with all line endings converted to CRLF."""
+    return data.replace(CRLF, b'\n').replace(b'\r', b'\n').replace(b'\n', CRLF)
+
+
+def _base64_encode(data):
+    encoded = bytearray()
+    for line in base64_lines(data):
+        encoded += line
+        encoded += CRLF
+    return bytes(encoded)
+
+
+# The CRLF appended to quoted-printable and 8bit bodies belongs to the
+# boundary delimiter which follows the part.
+
+def _qp_encode(data):
+    return normalize_eols(binascii.b2a_qp(data)) + CRLF
+
+
+def _8bit_encode(data):
+    return normalize_eols(data) + CRLF
+
+
+def base64_size(size):
+    """Returns size of *size* bytes encoded by :py:func:`base64_lines`, with
+    CRLF line terminators."""
+    encoded_size = (size + 2) // 3 * 4
+    return encoded_size + (encoded_size + 75) // 76 * len(CRLF)
+
+
+def shortest_encoding(body, charset):
+    """Returns ``'quoted-printable'`` or ``'base64'``, whichever encodes
+    *body* in *charset* to fewer bytes."""
+    if not isinstance(body, bytes):
+        import email.charset
+        charset = email.charset.Charset(charset)
+        body = body.encode(charset.get_output_charset() or 'us-ascii')
+
+    if len(_qp_encode(body)) > base64_size(len(body)):
+        return 'base64'
+    return 'quoted-printable'
+
+
+def encode_text_part(mimetype, body, charset, encoding=None):
+    """Returns the text part rendered for the wire: its MIME headers and
+    *body* encoded using *encoding* (one of :py:data:`BODY_ENCODINGS`)."""
+    import email.charset
+
+    charset = email.charset.Charset(charset)
+    output_charset = charset.get_output_charset() or 'us-ascii'
+    if not isinstance(body, bytes):
+        body = body.encode(output_charset)
+
+    if encoding is None:
+        encoding = {
+            email.charset.BASE64: 'base64',
+            email.charset.QP: 'quoted-printable',
+            email.charset.SHORTEST: 'shortest'
+        }.get(charset.body_encoding, '8bit')
+
+    if encoding == 'shortest':
+        encoded = _qp_encode(body)
+        if len(encoded) > base64_size(len(body)):
+            encoding, encoded = 'base64', _base64_encode(body)
+        else:
+            encoding = 'quoted-printable'
+    elif encoding == 'base64':
+        encoded = _base64_encode(body)
+    elif encoding == 'quoted-printable':
+        encoded = _qp_encode(body)
+    else:
+        encoded = _8bit_encode(body)
+        try:
+            body.decode('ascii')
+        except UnicodeDecodeError:
+            encoding = '8bit'
+        else:
+            encoding = '7bit'
+
+    headers = (
+        'Content-Type: %s; charset="%s"\r\n'
+        'MIME-Version: 1.0\r\n'
+        'Content-Transfer-Encoding: %s\r\n'
+        '\r\n'
+    ) % (mimetype, output_charset, encoding)
+
+    return headers.encode('ascii') + encoded
+
+
+class TextPartCache(object):
+    """Thread-safe LRU cache of text parts rendered by
+    :py:func:`encode_text_part`.
+
+    Entries are keyed by the body itself, so envelopes sharing a body (e.g.
+    rendered from the same template) share a single encoded copy of it.
+
+    :param max_size: approximate limit of memory taken by cached bodies and
+        their encoded forms, in bytes
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024):
+        self._max_size = max_size
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, mimetype, body, charset, encoding=None):
+        """Returns the rendered text part, encoding it if it isn't cached."""
+        key = (body, mimetype, charset, encoding)
+        with self._lock:
+            try:
+                encoded = self._entries.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._entries[key] = encoded
+                return encoded
+
+        encoded = encode_text_part(mimetype, body, charset, encoding)
+        entry_size = len(body) + len(encoded)
+        if entry_size > self._max_size:
+            return encoded
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = encoded
+                self._size += entry_size
+
+            while self._size > self._max_size:
+                (old_body, _, _, _), old_encoded = self._entries.popitem(
+                    last=False
+                )
+                self._size -= len(old_body) + len(old_encoded)
+
+        return encoded
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+#: Process-wide cache used by the message serializer.
+text_part_cache = TextPartCache()
@@ -27,39 +27,54 @@ envelopes.envelope
 This module contains the Envelope class.
 """
 
-import sys
-
-if sys.version_info[0] == 2:
-    from email import Encoders as email_encoders
-elif sys.version_info[0] == 3:
-    from email import encoders as email_encoders
-    basestring = str
-
-    def unicode(_str, _charset):
-        return str(_str.encode(_charset), _charset)
-else:
-    raise RuntimeError('Unsupported Python version: %d.%d.%d' % (
-        sys.version_info[0], sys.version_info[1], sys.version_info[2]
-    ))
-
-from email.header import Header
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.mime.audio import MIMEAudio
-from email.mime.image import MIMEImage
-from email.mime.text import MIMEText
-import mimetypes
+import mmap
 import os
 import re
 
-from .conn import SMTP
 from .compat import encoded
+from .encoding import BODY_ENCODINGS
+from .mimetype import guess_mimetype
+from .packing import pack, unpack
+from .parts import Attachment, InlineImage
+
+# Heavier modules (smtplib, email.mime etc.) are imported by
+# methods using them, so importing this module stays cheap.
+
+# Names of email.charset constants for body encodings.
+_MIME_BODY_ENCODINGS = {
+    'base64': 'BASE64',
+    'quoted-printable': 'QP',
+    '8bit': None
+}
+
+
+class _LazyRegexp(object):
+    # Class attribute compiling its pattern on first access.
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+        self._regexp = None
+
+    def __get__(self, instance, owner):
+        if self._regexp is None:
+            self._regexp = re.compile(self._pattern)
+        return self._regexp
 
 
 class MessageEncodeError(Exception):
     pass
 
+
+def _addr_from_dict(addr):
+    if isinstance(addr, list):
+        return tuple(addr)
+    return addr
+
+
+def _addrs_from_dict(addrs):
+    return [_addr_from_dict(addr) for addr in addrs or []]
+
+
 class Envelope(object):
     """
     The Envelope class.
@@ -84,14 +99,44 @@ class Envelope(object):
     :param bcc_addr: optional single BCC address or list of BCC addresses
     :param headers: optional dictionary of headers
     :param charset: message charset
+    :param text_body_encoding: optional transfer encoding of the plain text
+        part
+    :param html_body_encoding: optional transfer encoding of the HTML part
+    :param text_from_html: if *True* and *text_body* is not given, the plain
+        text part is generated from *html_body* using
+        :py:func:`envelopes.htmltext.html_to_text`
+
+    **Body encodings**
+
+    By default text parts use the charset's preferred transfer encoding
+    (base64 for UTF-8). Choose ``'quoted-printable'`` for mostly ASCII
+    bodies, ``'8bit'`` for relays supporting 8BITMIME or ``'shortest'`` to pick
+    the smaller of quoted-printable and base64 per part. Encoded parts are
+    cached and shared between envelopes with identical bodies, see
+    :py:class:`envelopes.encoding.TextPartCache`.
+
+    Envelopes are meant to be cheap to keep around in large numbers: the class
+    uses ``__slots__``, empty CC/BCC lists and headers dictionary aren't
+    allocated until they're needed and attachments are kept as raw file
+    contents until the message is rendered. An envelope with a single ``To``
+    address, subject and text body takes about 320 bytes on 64-bit CPython 3,
+    not counting the strings passed to it.
     """
 
+    __slots__ = ('_to', '_from', '_subject', '_parts', '_cc', '_bcc',
+                 '_headers', '_charset')
+
     ADDR_FORMAT = '%s <%s>'
-    ADDR_REGEXP = re.compile(r'^(.*) <([^@]+@[^@]+)>$')
+    ADDR_REGEXP = _LazyRegexp(r'^(.*) <([^@]+@[^@]+)>$')
+
+    #: Whether to consult system :py:mod:`mimetypes` database for extensions
+    #: unknown to :py:data:`envelopes.mimetype.TYPES_MAP`.
+    MIMETYPE_SYSTEM_DATABASE = False
 
     def __init__(self, to_addr=None, from_addr=None, subject=None,
                  html_body=None, text_body=None, cc_addr=None, bcc_addr=None,
-                 headers=None, charset='utf-8'):
+                 headers=None, charset='utf-8', text_body_encoding=None,
+                 html_body_encoding=None, text_from_html=False):
         if to_addr:
             if isinstance(to_addr, list):
                 self._to = to_addr
@@ -104,11 +149,19 @@ class Envelope(object):
         self._subject = subject
         self._parts = []
 
+        if html_body and not text_body and text_from_html:
+            from .htmltext import html_to_text
+            text_body = html_to_text(html_body)
+
         if text_body:
-            self._parts.append(('text/plain', text_body, charset))
+            self._parts.append(
+                ('text/plain', text_body, charset, text_body_encoding)
+            )
 
         if html_body:
-            self._parts.append(('text/html', html_body, charset))
+            self._parts.append(
+                ('text/html', html_body, charset, html_body_encoding)
+            )
 
         if cc_addr:
             if isinstance(cc_addr, list):
@@ -116,7 +169,7 @@ class Envelope(object):
             else:
                 self._cc = [cc_addr]
         else:
-            self._cc = []
+            self._cc = None
 
         if bcc_addr:
             if isinstance(bcc_addr, list):
@@ -124,16 +177,91 @@ class Envelope(object):
             else:
                 self._bcc = [bcc_addr]
         else:
-            self._bcc = []
-
-        if headers:
-            self._headers = headers
-        else:
-            self._headers = {}
+            self._bcc = None
 
+        self._headers = headers or None
         self._charset = charset
 
-        self._addr_format = unicode(self.ADDR_FORMAT, charset)
+        for encoding in (text_body_encoding, html_body_encoding):
+            if encoding not in BODY_ENCODINGS:
+                self._raise(MessageEncodeError,
+                            'Unsupported body encoding: %s' % encoding)
+
+    @classmethod
+    def from_dict(cls, data, store=None):
+        """Creates an envelope from dictionary returned by :py:meth:`to_dict`.
+        Attachments referenced by digest are looked up in *store*.
+
+        Lists in place of address tuples are accepted, so the dictionary may
+        come from a JSON decoder."""
+        envelope = cls(
+            to_addr=_addrs_from_dict(data.get('to_addr')),
+            from_addr=_addr_from_dict(data.get('from_addr')),
+            subject=data.get('subject'),
+            cc_addr=_addrs_from_dict(data.get('cc_addr')),
+            bcc_addr=_addrs_from_dict(data.get('bcc_addr')),
+            headers=data.get('headers'),
+            charset=data.get('charset', 'utf-8')
+        )
+
+        for part in data.get('parts', []):
+            if 'body' in part:
+                envelope._parts.append((
+                    part['mimetype'], part['body'], part['charset'],
+                    part.get('encoding')
+                ))
+            elif 'content_id' in part:
+                envelope._parts.append((
+                    part['mimetype'], InlineImage.from_dict(part, store=store)
+                ))
+            else:
+                envelope._parts.append(
+                    (part['mimetype'], Attachment.from_dict(part, store=store))
+                )
+
+        return envelope
+
+    @classmethod
+    def from_bytes(cls, data, store=None):
+        """Creates an envelope from bytes returned by :py:meth:`to_bytes`.
+        See :py:meth:`from_dict` for description of *store*."""
+        return cls.from_dict(unpack(data), store=store)
+
+    def to_dict(self, embed_attachments=True):
+        """Returns the envelope as a dictionary of plain Python values, which
+        can be passed to :py:meth:`from_dict` to recreate the envelope.
+
+        If *embed_attachments* is *False*, attachments added from files are
+        referenced by path instead of carrying their contents. Attachments
+        kept in an attachment store are always referenced by digest."""
+        parts = []
+        for part in self._parts:
+            if isinstance(part[1], Attachment):
+                parts.append(part[1].to_dict(embed=embed_attachments))
+            else:
+                parts.append({
+                    'mimetype': part[0],
+                    'body': part[1],
+                    'charset': part[2],
+                    'encoding': part[3]
+                })
+
+        return {
+            'to_addr': list(self._to),
+            'from_addr': self._from,
+            'subject': self._subject,
+            'cc_addr': list(self._cc or []),
+            'bcc_addr': list(self._bcc or []),
+            'headers': dict(self._headers or {}),
+            'charset': self._charset,
+            'parts': parts
+        }
+
+    def to_bytes(self, embed_attachments=True):
+        """Returns the envelope serialized in compact binary format, suitable
+        for task queues and spools. See :py:meth:`to_dict` for description of
+        *embed_attachments*."""
+        return pack(self.to_dict(embed_attachments=embed_attachments))
 
     def __repr__(self):
         return u'<Envelope from="%s" to="%s" subject="%s">' % (
@@ -166,28 +294,35 @@ class Envelope(object):
     @property
     def cc_addr(self):
         """List of CC addresses."""
+        if self._cc is None:
+            self._cc = []
         return self._cc
 
     def add_cc_addr(self, cc_addr):
         """Adds a CC address."""
-        self._cc.append(cc_addr)
+        self.cc_addr.append(cc_addr)
 
     def clear_cc_addr(self):
         """Clears list of CC addresses."""
-        self._cc = []
+        self._cc = None
 
     @property
     def bcc_addr(self):
         """List of BCC addresses."""
+        if self._bcc is None:
+            self._bcc = []
         return self._bcc
 
     def add_bcc_addr(self, bcc_addr):
         """Adds a BCC address."""
-        self._bcc.append(bcc_addr)
+        self.bcc_addr.append(bcc_addr)
 
     def clear_bcc_addr(self):
         """Clears list of BCC addresses."""
-        self._bcc = []
+        self._bcc = None
+
+    def _recipients(self):
+        return self._to + (self._cc or []) + (self._bcc or [])
 
     @property
     def charset(self):
@@ -198,13 +333,11 @@ class Envelope(object):
     def charset(self, charset):
         self._charset = charset
 
-        self._addr_format = unicode(self.ADDR_FORMAT, charset)
-
     def _addr_tuple_to_addr(self, addr_tuple):
         addr = ''
 
         if len(addr_tuple) == 2 and addr_tuple[1]:
-            addr = self._addr_format % (
+            addr = self.ADDR_FORMAT % (
                 self._header(addr_tuple[1] or ''),
                 addr_tuple[0] or ''
             )
@@ -216,15 +349,17 @@ class Envelope(object):
     @property
     def headers(self):
         """Dictionary of custom headers."""
+        if self._headers is None:
+            self._headers = {}
         return self._headers
 
     def add_header(self, key, value):
         """Adds a custom header."""
-        self._headers[key] = value
+        self.headers[key] = value
 
     def clear_headers(self):
         """Clears custom headers."""
-        self._headers = {}
+        self._headers = None
 
     def _addrs_to_header(self, addrs):
         _addrs = []
@@ -232,7 +367,7 @@ class Envelope(object):
             if not addr:
                 continue
 
-            if isinstance(addr, basestring):
+            if isinstance(addr, str):
                 if self._is_ascii(addr):
                     _addrs.append(self._encoded(addr))
                 else:
@@ -262,6 +397,8 @@ class Envelope(object):
     def _header(self, _str):
         if self._is_ascii(_str):
             return _str
+
+        from email.header import Header
         return Header(_str, self._charset).encode()
 
     def _is_ascii(self, _str):
@@ -270,61 +407,271 @@ class Envelope(object):
     def _encoded(self, _str):
         return encoded(_str, self._charset)
 
-    def to_mime_message(self):
-        """Returns the envelope as
-        :py:class:`email.mime.multipart.MIMEMultipart`."""
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = self._header(self._subject or '')
-
-        msg['From'] = self._encoded(self._addrs_to_header([self._from]))
-        msg['To'] = self._encoded(self._addrs_to_header(self._to))
+    def _message_headers(self):
+        headers = [
+            ('Subject', self._header(self._subject or '')),
+            ('From', self._encoded(self._addrs_to_header([self._from]))),
+            ('To', self._encoded(self._addrs_to_header(self._to)))
+        ]
 
         if self._cc:
-            msg['CC'] = self._addrs_to_header(self._cc)
+            headers.append(('CC', self._addrs_to_header(self._cc)))
 
         if self._headers:
             for key, value in self._headers.items():
-                msg[key] = self._header(value)
+                headers.append((key, self._header(value)))
 
+        return headers
+
+    def _part_tree(self):
+        # Inline images go into multipart/related together with the HTML
+        # body they're referenced from.
+        images = [part for part in self._parts
+                  if isinstance(part[1], InlineImage)]
+        if not images:
+            return self._parts
+
+        has_html = False
+        parts = []
         for part in self._parts:
-            type_maj, type_min = part[0].split('/')
-            if type_maj == 'text' and type_min in ('html', 'plain'):
-                msg.attach(MIMEText(part[1], type_min, self._charset))
+            if isinstance(part[1], InlineImage):
+                continue
+            elif (part[0] == 'text/html' and
+                    not isinstance(part[1], Attachment)):
+                parts.append(('multipart/related', [part] + images))
+                has_html = True
+            else:
+                parts.append(part)
+
+        if not has_html:
+            return self._parts
+
+        return parts
+
+    def _part_to_mime(self, part):
+        if isinstance(part[1], Attachment):
+            return part[1].to_mime()
+
+        import email.charset
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        from .encoding import shortest_encoding
+
+        type_maj, type_min = part[0].split('/')
+        if type_maj == 'multipart':
+            if type_min == 'related':
+                msg = MIMEMultipart(type_min, type='text/html')
             else:
-                msg.attach(part[1])
+                msg = MIMEMultipart(type_min)
+            for subpart in part[1]:
+                msg.attach(self._part_to_mime(subpart))
+            return msg
+
+        charset = email.charset.Charset(self._charset)
+        encoding = part[3]
+        if encoding == 'shortest':
+            encoding = shortest_encoding(part[1], self._charset)
+        if encoding is not None:
+            name = _MIME_BODY_ENCODINGS[encoding]
+            charset.body_encoding = name and getattr(email.charset, name)
+
+        return MIMEText(part[1], type_min, charset)
+
+    def to_mime_message(self):
+        """Returns the envelope as
+        :py:class:`email.mime.multipart.MIMEMultipart`."""
+        from email.mime.multipart import MIMEMultipart
+        from .tracing import span
+
+        with span('envelope.to_mime_message') as current:
+            current.set_attribute('envelope.parts', len(self._parts))
+
+            msg = MIMEMultipart('alternative')
+            for key, value in self._message_headers():
+                msg[key] = value
+
+            for part in self._part_tree():
+                msg.attach(self._part_to_mime(part))
+
+            return msg
+
+    def estimated_size(self):
+        """Returns size in bytes of the message as it's sent over the wire.
+
+        The size is computed from lengths of headers and encoded parts,
+        without rendering the message. Text parts are encoded (and cached
+        for the actual send), attachments are only measured. The result is
+        exact for messages sent by :py:class:`envelopes.conn.SMTP`, except
+        for dot-stuffing added during SMTP ``DATA``."""
+        from .serializer import message_size
+        return message_size(self)
+
+    def _normalized_addr(self, addr):
+        from .address import normalize_address
+
+        addr_spec = normalize_address(addr)
+        if isinstance(addr, (list, tuple)):
+            if len(addr) == 2 and addr[1]:
+                return (addr_spec, addr[1])
+        else:
+            match = self.ADDR_REGEXP.match(addr.strip())
+            if match and match.group(1):
+                return (addr_spec, match.group(1))
+
+        return addr_spec
+
+    def validate_addresses(self, normalize=False):
+        """Validates sender and recipient addresses with
+        :py:func:`envelopes.address.normalize_address`. Returns a list of
+        :py:exc:`envelopes.address.AddressError` instances describing invalid
+        addresses, so they can be rejected before connecting to the server.
+
+        If *normalize* is *True* valid addresses are replaced with their
+        normalized forms, keeping display names."""
+        from .address import AddressError
+
+        errors = []
+
+        def _validate(addr):
+            try:
+                normalized = self._normalized_addr(addr)
+            except AddressError as exc:
+                errors.append(exc)
+                return addr
+
+            return normalized if normalize else addr
+
+        if self._from:
+            self._from = _validate(self._from)
+
+        for attr in ('_to', '_cc', '_bcc'):
+            addrs = getattr(self, attr)
+            if addrs:
+                setattr(self, attr, [_validate(addr) for addr in addrs])
+
+        return errors
+
+    def filter_recipients(self, suppression_list=None):
+        """Drops duplicate recipients across To, CC and BCC lists, keeping
+        the first occurrence, and recipients found in *suppression_list*
+        (:py:class:`envelopes.suppression.SuppressionList`). Returns a list of
+        dropped addresses."""
+        if suppression_list is None:
+            from .suppression import SuppressionList
+            suppression_list = SuppressionList()
+
+        seen = set()
+        dropped = []
+        for attr in ('_to', '_cc', '_bcc'):
+            addrs = getattr(self, attr)
+            if not addrs:
+                continue
+
+            kept = []
+            for addr in addrs:
+                if suppression_list.accept(addr, seen):
+                    kept.append(addr)
+                else:
+                    dropped.append(addr)
+
+            if len(kept) != len(addrs):
+                setattr(self, attr, kept if (kept or attr == '_to') else None)
 
-        return msg
+        return dropped
 
-    def add_attachment(self, file_path, mimetype=None):
+    def add_attachment(self, file_path, mimetype=None, store=None,
+                       use_mmap=False):
         """Attaches a file located at *file_path* to the envelope. If
-        *mimetype* is not specified an attempt to guess it is made. If nothing
-        is guessed then `application/octet-stream` is used."""
+        *mimetype* is not specified an attempt to guess it is made with
+        :py:func:`envelopes.mimetype.guess_mimetype`. If nothing is guessed
+        then `application/octet-stream` is used.
+
+        If *store* (an :py:class:`envelopes.store.AttachmentStore`) is given
+        the file is put in the store and the envelope only keeps its
+        digest.
+
+        If *use_mmap* is *True* the file is memory-mapped instead of being
+        read into memory. Processes attaching the same file then share the
+        OS page cache rather than each holding a private copy. The file
+        shouldn't be modified while the envelope is alive."""
         if not mimetype:
-            mimetype, _ = mimetypes.guess_type(file_path)
+            mimetype = guess_mimetype(
+                file_path, system_database=self.MIMETYPE_SYSTEM_DATABASE
+            )
 
         if mimetype is None:
             mimetype = 'application/octet-stream'
 
-        type_maj, type_min = mimetype.split('/')
-        with open(file_path, 'rb') as fh:
-            part_data = fh.read()
+        part_filename = os.path.basename(self._encoded(file_path))
+        part_path = os.path.abspath(file_path)
+
+        if store is not None:
+            part = Attachment(None, mimetype, part_filename, path=part_path,
+                              digest=store.put_file(file_path), store=store)
+        else:
+            with open(file_path, 'rb') as fh:
+                if use_mmap and os.fstat(fh.fileno()).st_size > 0:
+                    part_data = mmap.mmap(fh.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                else:
+                    part_data = fh.read()
 
-            part = MIMEBase(type_maj, type_min)
-            part.set_payload(part_data)
-            email_encoders.encode_base64(part)
+            part = Attachment(part_data, mimetype, part_filename,
+                              path=part_path)
 
-            part_filename = os.path.basename(self._encoded(file_path))
-            part.add_header('Content-Disposition', 'attachment; filename="%s"'
-                            % part_filename)
+        self._parts.append((mimetype, part))
 
-            self._parts.append((mimetype, part))
+    def add_inline_image(self, file_path, content_id=None, mimetype=None):
+        """Embeds an image located at *file_path* in the envelope and returns
+        its content ID, which should be used in the HTML body as
+        ``<img src="cid:CONTENT_ID">``. The HTML body and inline images are
+        sent as ``multipart/related`` part.
+
+        If *content_id* is not specified one is derived from the image's
+        contents. *mimetype* is handled the same way as in
+        :py:meth:`add_attachment`.
+
+        Images are cached per process (see
+        :py:meth:`envelopes.parts.InlineImage.from_file`), so envelopes
+        embedding the same file share one encoded copy of it."""
+        if not mimetype:
+            mimetype = guess_mimetype(
+                file_path, system_database=self.MIMETYPE_SYSTEM_DATABASE
+            )
+
+        if mimetype is None:
+            mimetype = 'application/octet-stream'
+
+        part = InlineImage.from_file(
+            file_path, mimetype, os.path.basename(self._encoded(file_path)),
+            content_id=content_id
+        )
+        self._parts.append((mimetype, part))
+
+        return part.content_id
 
     def send(self, *args, **kwargs):
         """Sends the envelope using a freshly created SMTP connection. *args*
         and *kwargs* are passed directly to :py:class:`envelopes.conn.SMTP`
         constructor.
 
-        Returns a tuple of SMTP object and whatever its send method returns."""
-        conn = SMTP(*args, **kwargs)
-        send_result = conn.send(self)
-        return conn, send_result
+        Returns a tuple of SMTP object and whatever its send method returns.
+
+        If *profile* keyword argument is *True* (or ``'memory'`` to trace
+        allocations as well) a :py:class:`envelopes.profiling.SendProfile`
+        with per-phase timings is appended to the tuple."""
+        from .conn import SMTP
+
+        profile = kwargs.pop('profile', False)
+        if not profile:
+            conn = SMTP(*args, **kwargs)
+            send_result = conn.send(self)
+            return conn, send_result
+
+        from .profiling import profile as _profile
+
+        with _profile(trace_allocations=(profile == 'memory')) as report:
+            conn = SMTP(*args, **kwargs)
+            send_result = conn.send(self)
+
+        return conn, send_result, report
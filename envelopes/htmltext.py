@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.htmltext
+==================
+
+This module contains a fast HTML to plain text converter used to generate
+text parts of HTML-only envelopes.
+"""
+
+from collections import OrderedDict
+import hashlib
+from html.entities import name2codepoint
+from html.parser import HTMLParser
+import re
+import threading
+
+__all__ = ['html_to_text']
+
+_BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'div', 'dl', 'dt', 'dd',
+    'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table',
+    'tr', 'ul'
+])
+_SKIPPED_TAGS = frozenset(['head', 'script', 'style', 'title'])
+_WHITESPACE_REGEXP = re.compile(r'\s+')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 256
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self._lines = []
+        self._line = []
+        self._skip = 0
+        self._pre = 0
+        self._href = None
+        self._link_text = []
+
+    def _break(self, blank=False):
+        line = ''.join(self._line)
+        if not self._pre:
+            line = _WHITESPACE_REGEXP.sub(' ', line).strip()
+        self._line = []
+
+        if line:
+            self._lines.append(line)
+        if blank and self._lines and self._lines[-1] != '':
+            self._lines.append('')
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip += 1
+        elif tag == 'br':
+            self._break()
+        elif tag in _BLOCK_TAGS:
+            self._break(blank=tag not in ('li', 'tr', 'dt', 'dd'))
+            if tag == 'li':
+                self._line.append('* ')
+            elif tag == 'pre':
+                self._pre += 1
+        elif tag in ('td', 'th'):
+            self._line.append(' ')
+        elif tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._link_text = []
+        elif tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.handle_data(alt)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in _BLOCK_TAGS:
+            self._break(blank=tag not in ('li', 'tr', 'dt', 'dd'))
+            if tag == 'pre':
+                self._pre = max(self._pre - 1, 0)
+        elif tag == 'a' and self._href is not None:
+            href = self._href
+            self._href = None
+            if (href and not href.startswith(('#', 'cid:')) and
+                    ''.join(self._link_text).strip() != href):
+                self._line.append(' (%s)' % href)
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+
+        if self._pre:
+            lines = data.split('\n')
+            self._line.append(lines[0])
+            for line in lines[1:]:
+                self._break()
+                self._line.append(line)
+        else:
+            self._line.append(data)
+
+        if self._href is not None:
+            self._link_text.append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(chr(name2codepoint[name]))
+        else:
+            self.handle_data('&%s;' % name)
+
+    def handle_charref(self, name):
+        try:
+            if name.startswith(('x', 'X')):
+                self.handle_data(chr(int(name[1:], 16)))
+            else:
+                self.handle_data(chr(int(name)))
+        except (ValueError, OverflowError):
+            self.handle_data('&#%s;' % name)
+
+    def text(self):
+        self.close()
+        self._break()
+        while self._lines and self._lines[-1] == '':
+            self._lines.pop()
+        return '\n'.join(self._lines)
+
+
+def html_to_text(html):
+    """Converts *html* to plain text.
+
+    Block elements are separated with blank lines, list items are prefixed
+    with ``*``, links are followed by their URL in parentheses, images are
+    replaced with their ``alt`` text and ``<head>``, ``<script>`` and
+    ``<style>`` contents are dropped. Results are memoized by SHA-1 hash of
+    *html*, so converting the same body for many envelopes is cheap."""
+    key = hashlib.sha1(html.encode('utf-8')).digest()
+    with _cache_lock:
+        try:
+            text = _cache.pop(key)
+        except KeyError:
+            pass
+        else:
+            _cache[key] = text
+            return text
+
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    text = extractor.text()
+
+    with _cache_lock:
+        _cache[key] = text
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return text
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.keepalive
+===================
+
+This module implements background maintenance of idle SMTP connections.
+"""
+
+from collections import Counter
+import smtplib
+import socket
+import threading
+import time
+import weakref
+
+__all__ = ['ConnectionMaintainer']
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class ConnectionMaintainer(object):
+    """Keeps registered :py:class:`envelopes.conn.SMTP` connections ready to
+    send, e.g. long-lived connections pushed on the connection stack.
+
+    Every *interval* seconds a background thread visits each connection:
+
+    * connections unused for *max_idle* seconds are closed before the
+      server drops them (RFC 5321 requires servers to wait at least 5
+      minutes) and, if *prewarm* is *True*, reopened right away,
+    * if *keepalive* is given, connections unused for that many seconds are
+      sent ``NOOP``, so dead ones are found and replaced before the next
+      send,
+    * connections busy sending are skipped.
+
+    Connections are held with weak references and don't need to be
+    unregistered before they're garbage collected::
+
+        maintainer = ConnectionMaintainer(max_idle=120)
+        maintainer.register(conn)
+        maintainer.start()
+    """
+
+    def __init__(self, max_idle=240, keepalive=None, interval=5,
+                 prewarm=True):
+        self._max_idle = max_idle
+        self._keepalive = keepalive
+        self._interval = interval
+        self._prewarm = prewarm
+        self._connections = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def register(self, conn):
+        """Starts maintaining *conn*."""
+        with self._lock:
+            self._connections[conn] = None
+
+    def unregister(self, conn):
+        """Stops maintaining *conn*."""
+        with self._lock:
+            self._connections.pop(conn, None)
+
+    @property
+    def connections(self):
+        """List of maintained connections."""
+        with self._lock:
+            return list(self._connections.keys())
+
+    def stats(self):
+        """Returns a dictionary of counters:
+
+        * ``connections`` - maintained connections,
+        * ``open`` - maintained connections currently open,
+        * ``recycled`` - connections closed after *max_idle* seconds,
+        * ``prewarmed`` - connections reopened in advance,
+        * ``keepalives`` - successful ``NOOP`` commands,
+        * ``dead`` - connections found closed by the server,
+        * ``errors`` - failed attempts to reopen connections,
+        * ``busy`` - visits skipped because the connection was sending.
+        """
+        connections = self.connections
+        result = dict.fromkeys(['recycled', 'prewarmed', 'keepalives',
+                                'dead', 'errors', 'busy'], 0)
+        with self._lock:
+            result.update(self._counts)
+
+        result['connections'] = len(connections)
+        result['open'] = sum(1 for conn in connections
+                             if conn.idle_time is not None)
+        return result
+
+    def start(self):
+        """Starts the maintainer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='envelopes-keepalive')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the maintainer thread and waits up to *timeout* seconds
+        for it to finish. Connections are left open."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.maintain()
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def maintain(self):
+        """Visits all connections once. Called periodically by the
+        maintainer thread."""
+        for conn in self.connections:
+            if not conn._lock.acquire(False):
+                self._count('busy')
+                continue
+
+            try:
+                self._maintain(conn)
+            finally:
+                conn._lock.release()
+
+    def _maintain(self, conn):
+        idle = conn.idle_time
+        if idle is None:
+            return
+
+        if self._max_idle is not None and idle >= self._max_idle:
+            conn.close()
+            self._count('recycled')
+            self._reopen(conn)
+            return
+
+        if self._keepalive is None:
+            return
+
+        now = _monotonic()
+        with self._lock:
+            last_noop = self._connections.get(conn)
+        if last_noop is not None and last_noop > now - idle:
+            idle = now - last_noop
+        if idle < self._keepalive:
+            return
+
+        try:
+            # The socket may still have the timeout of the last DATA.
+            conn._set_timeout(conn._command_timeout)
+            code = conn._conn.noop()[0]
+        except (smtplib.SMTPException, socket.error):
+            code = None
+
+        if code == 250:
+            self._count('keepalives')
+            with self._lock:
+                if conn in self._connections:
+                    self._connections[conn] = now
+            return
+
+        conn.close()
+        self._count('dead')
+        self._reopen(conn)
+
+    def _reopen(self, conn):
+        if not self._prewarm:
+            return
+
+        try:
+            conn._connect(replace_current=True)
+        except (smtplib.SMTPException, socket.error):
+            conn.close()
+            self._count('errors')
+        else:
+            self._count('prewarmed')
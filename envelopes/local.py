@@ -45,10 +45,7 @@
 try:
     from greenlet import getcurrent as get_ident
 except ImportError:  # noqa
-    try:
-        from thread import get_ident  # noqa
-    except ImportError:  # noqa
-        from _thread import get_ident  # noqa
+    from _thread import get_ident  # noqa
 
 
 def release_local(local):
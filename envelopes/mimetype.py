@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.mimetype
+==================
+
+This module implements MIME type detection for attachments using a built-in
+extension table and magic bytes of file contents. Unlike :py:mod:`mimetypes`
+it doesn't read any files at startup and gives the same results on every
+system.
+"""
+
+import os
+
+__all__ = ['TYPES_MAP', 'guess_mimetype', 'sniff_mimetype']
+
+#: Mapping of lowercase file extensions to MIME types.
+TYPES_MAP = {
+    # Text
+    '.txt': 'text/plain',
+    '.text': 'text/plain',
+    '.log': 'text/plain',
+    '.md': 'text/markdown',
+    '.rst': 'text/x-rst',
+    '.csv': 'text/csv',
+    '.tsv': 'text/tab-separated-values',
+    '.htm': 'text/html',
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.ics': 'text/calendar',
+    '.vcf': 'text/vcard',
+    '.xml': 'text/xml',
+    '.py': 'text/x-python',
+    '.c': 'text/x-c',
+    '.h': 'text/x-c',
+    '.java': 'text/x-java',
+    '.sh': 'application/x-sh',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+    '.yml': 'application/yaml',
+    '.eml': 'message/rfc822',
+    '.mht': 'message/rfc822',
+    # Images
+    '.bmp': 'image/bmp',
+    '.gif': 'image/gif',
+    '.ico': 'image/vnd.microsoft.icon',
+    '.jpe': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.svg': 'image/svg+xml',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.webp': 'image/webp',
+    '.heic': 'image/heic',
+    # Audio
+    '.aac': 'audio/aac',
+    '.flac': 'audio/flac',
+    '.m4a': 'audio/mp4',
+    '.mid': 'audio/midi',
+    '.midi': 'audio/midi',
+    '.mp3': 'audio/mpeg',
+    '.oga': 'audio/ogg',
+    '.ogg': 'audio/ogg',
+    '.opus': 'audio/opus',
+    '.wav': 'audio/x-wav',
+    # Video
+    '.avi': 'video/x-msvideo',
+    '.m4v': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.mov': 'video/quicktime',
+    '.mp4': 'video/mp4',
+    '.mpeg': 'video/mpeg',
+    '.mpg': 'video/mpeg',
+    '.ogv': 'video/ogg',
+    '.webm': 'video/webm',
+    # Documents
+    '.pdf': 'application/pdf',
+    '.ps': 'application/postscript',
+    '.eps': 'application/postscript',
+    '.rtf': 'application/rtf',
+    '.doc': 'application/msword',
+    '.dot': 'application/msword',
+    '.xls': 'application/vnd.ms-excel',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.docx': 'application/vnd.openxmlformats-officedocument.'
+             'wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.'
+             'spreadsheetml.sheet',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.'
+             'presentationml.presentation',
+    '.odt': 'application/vnd.oasis.opendocument.text',
+    '.ods': 'application/vnd.oasis.opendocument.spreadsheet',
+    '.odp': 'application/vnd.oasis.opendocument.presentation',
+    '.epub': 'application/epub+zip',
+    # Archives
+    '.7z': 'application/x-7z-compressed',
+    '.bz2': 'application/x-bzip2',
+    '.gz': 'application/gzip',
+    '.tgz': 'application/gzip',
+    '.rar': 'application/vnd.rar',
+    '.tar': 'application/x-tar',
+    '.xz': 'application/x-xz',
+    '.zip': 'application/zip',
+    # Other
+    '.bin': 'application/octet-stream',
+    '.exe': 'application/octet-stream',
+    '.p7s': 'application/pkcs7-signature',
+    '.asc': 'application/pgp-signature',
+    '.sig': 'application/pgp-signature',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.wasm': 'application/wasm'
+}
+
+# (offset, magic bytes, MIME type), checked in order.
+_MAGIC = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'%!PS', 'application/postscript'),
+    (0, b'{\\rtf', 'application/rtf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'BZh', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (4, b'ftyp', 'video/mp4'),
+    (257, b'ustar', 'application/x-tar')
+)
+_RIFF_TYPES = {
+    b'WEBP': 'image/webp',
+    b'WAVE': 'audio/x-wav',
+    b'AVI ': 'video/x-msvideo'
+}
+_MAGIC_SIZE = 262
+
+
+def sniff_mimetype(data):
+    """Returns MIME type of *data* (leading bytes of a file) detected from
+    magic bytes, or *None*."""
+    data = bytes(data[:_MAGIC_SIZE])
+    if data[:4] == b'RIFF':
+        return _RIFF_TYPES.get(data[8:12])
+
+    for offset, magic, mimetype in _MAGIC:
+        if data[offset:offset + len(magic)] == magic:
+            return mimetype
+
+    return None
+
+
+def guess_mimetype(file_path, sniff=True, system_database=False):
+    """Returns MIME type of a file located at *file_path*, or *None* if it
+    can't be guessed.
+
+    The extension is looked up in :py:data:`TYPES_MAP` first. If
+    *system_database* is *True*, unknown extensions are then looked up with
+    :py:func:`mimetypes.guess_type`. Finally, if *sniff* is *True*, the type
+    is detected from the leading bytes of the file."""
+    extension = os.path.splitext(file_path)[1].lower()
+    mimetype = TYPES_MAP.get(extension)
+    if mimetype is not None:
+        return mimetype
+
+    if system_database and extension:
+        import mimetypes
+        mimetype = mimetypes.guess_type(file_path)[0]
+        if mimetype is not None:
+            return mimetype
+
+    if sniff:
+        try:
+            with open(file_path, 'rb') as fh:
+                return sniff_mimetype(fh.read(_MAGIC_SIZE))
+        except (IOError, OSError):
+            return None
+
+    return None
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.mx
+============
+
+This module implements direct delivery of envelopes to MX hosts of
+recipient domains.
+"""
+
+import queue
+import smtplib
+import socket
+import threading
+import time
+
+try:
+    import dns.resolver
+except ImportError:
+    dns = None
+
+from .conn import SMTP
+from .router import _domain
+from .serializer import _SerializerPool
+
+__all__ = ['MXDeliverySMTP', 'DNSResolver', 'StaticResolver']
+
+
+class StaticResolver(object):
+    """MX resolver returning records from *records* mapping of domains to
+    lists of host names or ``(preference, host)`` pairs. Domains without
+    records resolve to themselves (implicit MX, RFC 5321, section 5.1).
+    Useful in tests and setups with fixed mail routing."""
+
+    def __init__(self, records=None, ttl=300):
+        self._records = {}
+        self._ttl = ttl
+        for domain, hosts in (records or {}).items():
+            self._records[domain.lower()] = hosts
+
+    def resolve(self, domain):
+        """Returns a tuple of MX host names sorted by preference and TTL of
+        the answer in seconds."""
+        hosts = self._records.get(domain)
+        if hosts is None:
+            return [domain], self._ttl
+
+        records = []
+        for index, host in enumerate(hosts):
+            if isinstance(host, (list, tuple)):
+                records.append((host[0], index, host[1]))
+            else:
+                records.append((0, index, host))
+
+        return [host for _, _, host in sorted(records)], self._ttl
+
+
+class DNSResolver(object):
+    """MX resolver querying DNS with `dnspython
+    <http://www.dnspython.org/>`_, which has to be installed separately."""
+
+    def __init__(self, nameservers=None, lifetime=10.0):
+        if dns is None:
+            raise RuntimeError('DNSResolver requires dnspython package')
+
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = lifetime
+        if nameservers:
+            self._resolver.nameservers = list(nameservers)
+
+    def resolve(self, domain):
+        """Returns a tuple of MX host names sorted by preference and TTL of
+        the answer in seconds."""
+        query = getattr(self._resolver, 'resolve', None) or self._resolver.query
+        try:
+            answer = query(domain, 'MX')
+        except dns.resolver.NoAnswer:
+            return [domain], 300
+
+        records = sorted(
+            (record.preference, record.exchange.to_text().rstrip('.'))
+            for record in answer
+        )
+        return [host for _, host in records], answer.rrset.ttl
+
+
+class MXDeliverySMTP(object):
+    """Transport delivering envelopes directly to MX hosts of recipient
+    domains, bypassing a smarthost.
+
+    Recipients are grouped by domain and the message, rendered once, is
+    delivered to up to *max_workers* domains concurrently. MX hosts are tried
+    in order of preference until one accepts the message or permanently
+    refuses it.
+
+    *resolver* is an object with ``resolve(domain)`` method returning
+    a tuple of MX host names and TTL, e.g. :py:class:`DNSResolver` (the
+    default) or :py:class:`StaticResolver`. Answers are cached for their TTL,
+    clamped to *max_ttl* seconds. Up to *pool_size* idle connections are kept
+    for each MX host. *port*, *tls* and *timeout* are passed to
+    :py:class:`envelopes.conn.SMTP`. Messages are DKIM signed with *dkim*
+    signer, if given.
+    """
+
+    def __init__(self, resolver=None, port=25, tls=False, timeout=None,
+                 max_workers=8, pool_size=2, max_ttl=3600, dkim=None):
+        self._resolver = resolver or DNSResolver()
+        self._port = port
+        self._tls = tls
+        self._timeout = timeout
+        self._max_workers = max_workers
+        self._pool_size = pool_size
+        self._max_ttl = max_ttl
+        self._cache = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._dkim = dkim
+        self._serializers = _SerializerPool(dkim=dkim)
+
+    def mx_hosts(self, domain):
+        """Returns MX host names of *domain*, sorted by preference."""
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(domain)
+
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        hosts, ttl = self._resolver.resolve(domain)
+        with self._lock:
+            self._cache[domain] = (now + min(ttl, self._max_ttl), hosts)
+
+        return hosts
+
+    def clear_cache(self):
+        """Clears the MX records cache."""
+        with self._lock:
+            self._cache.clear()
+
+    def _acquire(self, host):
+        with self._lock:
+            idle = self._pools.get(host)
+            if idle:
+                return idle.pop()
+
+        return SMTP(host, self._port, tls=self._tls, timeout=self._timeout)
+
+    def _release(self, host, conn):
+        with self._lock:
+            idle = self._pools.setdefault(host, [])
+            if len(idle) < self._pool_size:
+                idle.append(conn)
+                return
+
+        self._quit(conn)
+
+    def _quit(self, conn):
+        try:
+            conn._conn.quit()
+        except (AttributeError, socket.error, smtplib.SMTPException):
+            pass
+
+    def close(self):
+        """Closes idle connections."""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+
+        for idle in pools.values():
+            for conn in idle:
+                self._quit(conn)
+
+    def _deliver(self, domain, from_addr, to_addrs, msg):
+        try:
+            hosts = self.mx_hosts(domain)
+        except Exception as exc:
+            return dict((addr, (-1, str(exc))) for addr in to_addrs)
+
+        error = (-1, 'No MX hosts for domain: %s' % domain)
+        for host in hosts:
+            conn = self._acquire(host)
+            try:
+                refused = conn.send_rendered(from_addr, to_addrs, msg)
+            except smtplib.SMTPRecipientsRefused as exc:
+                self._release(host, conn)
+                return exc.recipients
+            except smtplib.SMTPResponseException as exc:
+                self._quit(conn)
+                error = (exc.smtp_code, exc.smtp_error)
+                if exc.smtp_code >= 500:
+                    # Permanent failure, other MX hosts would refuse too.
+                    break
+            except Exception as exc:
+                # E.g. socket errors or UnicodeEncodeError for addresses
+                # the server can't take.
+                self._quit(conn)
+                error = (-1, str(exc))
+            else:
+                self._release(host, conn)
+                return refused or {}
+
+        return dict((addr, error) for addr in to_addrs)
+
+    def send_rendered(self, from_addr, to_addrs, msg):
+        """Delivers an already rendered message *msg* from *from_addr* to
+        *to_addrs*. Returns a dict of refused recipients, like
+        :py:meth:`smtplib.SMTP.sendmail`, and raises
+        :py:exc:`smtplib.SMTPRecipientsRefused` if all of them were
+        refused."""
+        groups = {}
+        for addr in to_addrs:
+            groups.setdefault(_domain(addr), []).append(addr)
+
+        tasks = queue.Queue()
+        for domain, addrs in groups.items():
+            tasks.put((domain, addrs))
+
+        refused = {}
+        refused_lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    domain, addrs = tasks.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    result = self._deliver(domain, from_addr, addrs, msg)
+                except Exception as exc:
+                    # Recipients of a failed domain are never reported as
+                    # delivered.
+                    result = dict((addr, (-1, str(exc))) for addr in addrs)
+
+                with refused_lock:
+                    refused.update(result)
+
+        workers = min(self._max_workers, len(groups))
+        if workers <= 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker)
+                       for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if to_addrs and len(refused) == len(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        return refused
+
+    def send(self, envelope):
+        """Sends an *envelope*. Can be called from many threads at once."""
+        from_addr = envelope._encoded(
+            envelope._addrs_to_header([envelope._from])
+        )
+        to_addrs = [envelope._addrs_to_header([addr])
+                    for addr in envelope._recipients()]
+
+        serializer = self._serializers.get()
+        try:
+            msg = serializer.serialize(envelope)
+            return self.send_rendered(from_addr, to_addrs, msg)
+        finally:
+            # Drop the view, so the serializer can reuse its buffer.
+            msg = None
+            self._serializers.put(serializer)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.packing
+=================
+
+This module implements the compact binary format used to serialize envelopes
+for task queues and spools.
+
+The format is a tagged encoding of plain Python values similar in spirit to
+MessagePack. Lengths and counts are stored as unsigned LEB128 varints, so
+short strings cost just two bytes of overhead.
+"""
+
+import struct
+
+FORMAT_VERSION = 1
+
+_NONE = 0x00
+_TRUE = 0x01
+_FALSE = 0x02
+_INT = 0x03
+_STR = 0x04
+_BYTES = 0x05
+_LIST = 0x06
+_TUPLE = 0x07
+_DICT = 0x08
+
+_INT_STRUCT = struct.Struct('>q')
+
+__all__ = ['PackingError', 'pack', 'unpack']
+
+
+class PackingError(Exception):
+    pass
+
+
+def _pack_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _pack_value(buf, value):
+    if value is None:
+        buf.append(_NONE)
+    elif value is True:
+        buf.append(_TRUE)
+    elif value is False:
+        buf.append(_FALSE)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        buf.append(_STR)
+        _pack_varint(buf, len(data))
+        buf.extend(data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        buf.append(_BYTES)
+        _pack_varint(buf, len(value))
+        buf.extend(value)
+    elif isinstance(value, int):
+        buf.append(_INT)
+        buf.extend(_INT_STRUCT.pack(value))
+    elif isinstance(value, (list, tuple)):
+        buf.append(_LIST if isinstance(value, list) else _TUPLE)
+        _pack_varint(buf, len(value))
+        for item in value:
+            _pack_value(buf, item)
+    elif isinstance(value, dict):
+        buf.append(_DICT)
+        _pack_varint(buf, len(value))
+        for key, item in value.items():
+            _pack_value(buf, key)
+            _pack_value(buf, item)
+    else:
+        raise PackingError('Can not pack %r' % (value, ))
+
+
+class _Unpacker(object):
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._offset = 0
+
+    def _byte(self):
+        try:
+            value = self._data[self._offset]
+        except IndexError:
+            raise PackingError('Unexpected end of data')
+
+        self._offset += 1
+        return value
+
+    def _varint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self._byte()
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def _bytes(self, length):
+        end = self._offset + length
+        if end > len(self._data):
+            raise PackingError('Unexpected end of data')
+
+        value = self._data[self._offset:end].tobytes()
+        self._offset = end
+        return value
+
+    def value(self):
+        tag = self._byte()
+        if tag == _NONE:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        elif tag == _STR:
+            return self._bytes(self._varint()).decode('utf-8')
+        elif tag == _BYTES:
+            return self._bytes(self._varint())
+        elif tag == _INT:
+            return _INT_STRUCT.unpack(self._bytes(_INT_STRUCT.size))[0]
+        elif tag == _LIST:
+            return [self.value() for _ in range(self._varint())]
+        elif tag == _TUPLE:
+            return tuple([self.value() for _ in range(self._varint())])
+        elif tag == _DICT:
+            result = {}
+            for _ in range(self._varint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        else:
+            raise PackingError('Unknown tag: 0x%02x' % tag)
+
+    def unpack(self):
+        if self._byte() != FORMAT_VERSION:
+            raise PackingError('Unsupported format version')
+
+        result = self.value()
+        if self._offset != len(self._data):
+            raise PackingError('Trailing data')
+
+        return result
+
+
+def pack(value):
+    """Packs *value* made of ``None``, booleans, integers, strings, bytes,
+    lists, tuples and dictionaries. Returns :py:class:`bytes`."""
+    buf = bytearray()
+    buf.append(FORMAT_VERSION)
+    _pack_value(buf, value)
+    return bytes(buf)
+
+
+def unpack(data):
+    """Unpacks a value previously packed with :py:func:`pack`. Raises
+    :py:class:`PackingError` if *data* is malformed."""
+    return _Unpacker(data).unpack()
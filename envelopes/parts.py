@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.parts
+===============
+
+This module contains classes describing message parts other than text bodies.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from .encoding import CRLF, base64_lines
+from .store import AttachmentStoreError
+
+_inline_image_cache = OrderedDict()
+_inline_image_cache_lock = threading.Lock()
+INLINE_IMAGE_CACHE_SIZE = 128
+
+
+class Attachment(object):
+    """A file attached to an envelope.
+
+    Only the file's contents and metadata are kept, the MIME part is built
+    when the envelope is rendered.
+
+    :param data: contents of the file, either :py:class:`bytes` or any object
+        supporting the buffer protocol (e.g. :py:class:`mmap.mmap`)
+    :param mimetype: MIME type of the file
+    :param filename: file name used in ``Content-Disposition`` header
+    :param path: optional path the file was read from
+    :param digest: SHA-256 digest of contents kept in *store*
+    :param store: optional :py:class:`envelopes.store.AttachmentStore`
+        holding the contents, in which case *data* should be *None*
+    """
+
+    __slots__ = ('data', 'mimetype', 'filename', 'path', 'digest', 'store')
+
+    content_id = None
+
+    def __init__(self, data, mimetype, filename, path=None, digest=None,
+                 store=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.filename = filename
+        self.path = path
+        self.digest = digest
+        self.store = store
+
+    @classmethod
+    def from_dict(cls, data, store=None):
+        """Creates an attachment from dictionary returned by
+        :py:meth:`to_dict`. Attachments serialized by path are read from
+        disk, attachments serialized by digest require *store*."""
+        path = data.get('path')
+        digest = data.get('sha256')
+
+        if digest is not None:
+            if store is None:
+                raise AttachmentStoreError(
+                    'Attachment %s requires a store' % digest
+                )
+            part_data = None
+        elif 'data' in data:
+            part_data = data['data']
+        else:
+            with open(path, 'rb') as fh:
+                part_data = fh.read()
+
+        return cls(part_data, data['mimetype'], data['filename'], path=path,
+                   digest=digest,
+                   store=store if digest is not None else None)
+
+    def to_dict(self, embed=True):
+        """Returns the attachment as a dictionary. Attachments kept in a store
+        are referenced by digest. Otherwise, if *embed* is *False* and the
+        attachment was read from a file only the file's path is included."""
+        result = {
+            'mimetype': self.mimetype,
+            'filename': self.filename,
+            'path': self.path
+        }
+
+        if self.content_id is not None:
+            result['content_id'] = self.content_id
+
+        if self.store is not None:
+            result['sha256'] = self.digest
+        elif embed or self.path is None:
+            result['data'] = bytes(self.data)
+
+        return result
+
+    def read(self):
+        """Returns contents of the attachment."""
+        if self.store is not None:
+            return self.store.get(self.digest)
+        return bytes(self.data)
+
+    @property
+    def content_disposition(self):
+        """Value of the part's ``Content-Disposition`` header."""
+        return 'attachment; filename="%s"' % self.filename
+
+    def to_mime(self):
+        """Returns the attachment as base64 encoded
+        :py:class:`email.mime.base.MIMEBase`."""
+        from email import encoders as email_encoders
+        from email.mime.base import MIMEBase
+
+        type_maj, type_min = self.mimetype.split('/')
+
+        part = MIMEBase(type_maj, type_min)
+        part.set_payload(self.read())
+        email_encoders.encode_base64(part)
+        part.add_header('Content-Disposition', self.content_disposition)
+        if self.content_id is not None:
+            part.add_header('Content-ID', '<%s>' % self.content_id)
+
+        return part
+
+
+class InlineImage(Attachment):
+    """An image embedded in the HTML body and referenced by its *content_id*
+    (``<img src="cid:...">``).
+
+    Inline images are usually shared by many envelopes, so use
+    :py:meth:`from_file` to get a per-process cached instance which is base64
+    encoded only once.
+
+    :param content_id: the part's ``Content-ID`` without angle brackets
+
+    Remaining parameters are the same as in :py:class:`Attachment`.
+    """
+
+    __slots__ = ('content_id', '_encoded')
+
+    def __init__(self, data, mimetype, filename, content_id, path=None,
+                 digest=None, store=None):
+        super(InlineImage, self).__init__(data, mimetype, filename, path=path,
+                                          digest=digest, store=store)
+        self.content_id = content_id
+        self._encoded = None
+
+    @classmethod
+    def from_dict(cls, data, store=None):
+        """Creates an inline image from dictionary returned by
+        :py:meth:`to_dict`."""
+        attachment = Attachment.from_dict(data, store=store)
+        return cls(attachment.data, attachment.mimetype, attachment.filename,
+                   data['content_id'], path=attachment.path,
+                   digest=attachment.digest, store=attachment.store)
+
+    @classmethod
+    def from_file(cls, file_path, mimetype, filename, content_id=None):
+        """Returns inline image with contents of file located at *file_path*.
+
+        Instances are cached per process and reused for as long as the file's
+        modification time and size don't change. The cache keeps up to
+        :py:data:`INLINE_IMAGE_CACHE_SIZE` most recently used images. If *content_id* isn't given,
+        one is derived from the file's contents."""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime, stat.st_size,
+               mimetype, filename, content_id)
+
+        with _inline_image_cache_lock:
+            image = _inline_image_cache.pop(key, None)
+            if image is None:
+                with open(file_path, 'rb') as fh:
+                    data = fh.read()
+
+                if content_id is None:
+                    content_id = '%s@envelopes' % (
+                        hashlib.sha256(data).hexdigest()[:32]
+                    )
+
+                image = cls(data, mimetype, filename, content_id,
+                            path=key[0])
+
+            _inline_image_cache[key] = image
+            while len(_inline_image_cache) > INLINE_IMAGE_CACHE_SIZE:
+                _inline_image_cache.popitem(last=False)
+
+        return image
+
+    @classmethod
+    def clear_cache(cls):
+        """Clears the per-process cache used by :py:meth:`from_file`."""
+        with _inline_image_cache_lock:
+            _inline_image_cache.clear()
+
+    @property
+    def content_disposition(self):
+        """Value of the part's ``Content-Disposition`` header."""
+        return 'inline; filename="%s"' % self.filename
+
+    def encoded(self):
+        """Returns contents of the image base64 encoded in CRLF terminated
+        lines. The result is computed once and cached."""
+        if self._encoded is None:
+            if self.store is not None:
+                with self.store.open_encoded(self.digest) as fh:
+                    self._encoded = fh.read()
+            else:
+                encoded = bytearray()
+                for line in base64_lines(self.data):
+                    encoded += line
+                    encoded += CRLF
+                self._encoded = bytes(encoded)
+
+        return self._encoded
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.profiling
+===================
+
+This module implements collection of per-phase timings (and optionally
+memory allocations) of sending envelopes.
+"""
+
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__all__ = ['SendProfile', 'PhaseTiming', 'profile', 'phase', 'active_profile']
+
+_timer = getattr(time, 'perf_counter', time.time)
+_local = threading.local()
+
+#: Timing of a single phase. *allocations* is the number of memory blocks
+#: allocated during the phase and still alive at its end, *memory* and
+#: *memory_peak* are change of memory during the phase and its peak above the
+#: starting point, in bytes. All three are traced by :py:mod:`tracemalloc`,
+#: or *None* if allocations aren't traced.
+PhaseTiming = namedtuple('PhaseTiming', ['name', 'duration', 'allocations',
+                                         'memory', 'memory_peak'])
+
+
+class SendProfile(object):
+    """Report of a profiled send. Phases are recorded in order they happened:
+
+    * ``connect`` - opening the connection,
+    * ``tls`` - STARTTLS negotiation,
+    * ``login`` - authentication,
+    * ``render`` - encoding text parts and headers,
+    * ``serialize`` - writing the message into the serializer's buffer,
+    * ``transmit`` - SMTP transaction. Streamed messages are rendered during
+      this phase.
+    """
+
+    def __init__(self, trace_allocations=False):
+        self.phases = []
+        self.trace_allocations = trace_allocations
+
+    @property
+    def total(self):
+        """Sum of phase durations in seconds."""
+        return sum(phase.duration for phase in self.phases)
+
+    def durations(self):
+        """Returns an ordered mapping of phase names to total time spent in
+        them, in seconds."""
+        result = OrderedDict()
+        for phase in self.phases:
+            result[phase.name] = result.get(phase.name, 0.0) + phase.duration
+        return result
+
+    def as_dict(self):
+        """Returns the report as a dictionary, e.g. for logging."""
+        return {
+            'total': self.total,
+            'phases': [phase._asdict() for phase in self.phases]
+        }
+
+    def __repr__(self):
+        return '<SendProfile %s>' % ' '.join(
+            '%s=%.6f' % item for item in self.durations().items()
+        )
+
+
+def _traced_blocks():
+    # Leaves out blocks allocated by profiling itself.
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)
+    ])
+    return len(snapshot.traces)
+
+
+class _Phase(object):
+    __slots__ = ('_profile', '_name', '_start', '_blocks', '_memory')
+
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        if self._profile.trace_allocations:
+            self._blocks = _traced_blocks()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._start = _timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = _timer() - self._start
+        allocations = memory = memory_peak = None
+        if self._profile.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            memory = current - self._memory
+            memory_peak = max(peak - self._memory, 0)
+            allocations = _traced_blocks() - self._blocks
+
+        self._profile.phases.append(PhaseTiming(
+            self._name, duration, allocations, memory, memory_peak
+        ))
+        return False
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def active_profile():
+    """Returns :py:class:`SendProfile` being collected in the current thread,
+    or *None*."""
+    return getattr(_local, 'profile', None)
+
+
+def phase(name):
+    """Returns a context manager timing phase *name* of the active profile.
+    It's a no-op if no profile is being collected."""
+    current = getattr(_local, 'profile', None)
+    if current is None:
+        return _NO_PHASE
+
+    return _Phase(current, name)
+
+
+class profile(object):
+    """Context manager collecting a :py:class:`SendProfile` of sends done in
+    the current thread within its block::
+
+        with profile() as report:
+            conn.send(envelope)
+        log.info('Sent in %.3fs: %r', report.total, report)
+
+    If *trace_allocations* is *True*, memory blocks and bytes allocated in
+    each phase are traced with :py:mod:`tracemalloc`, which is started if needed and
+    stopped afterwards."""
+
+    def __init__(self, trace_allocations=False):
+        if trace_allocations and tracemalloc is None:
+            raise RuntimeError('Tracing allocations requires tracemalloc')
+
+        self._report = SendProfile(trace_allocations=trace_allocations)
+        self._started_tracing = False
+        self._previous = None
+
+    def __enter__(self):
+        if self._report.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        self._previous = getattr(_local, 'profile', None)
+        _local.profile = self._report
+        return self._report
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.profile = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+        return False
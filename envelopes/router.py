@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.router
+================
+
+This module implements routing of envelopes through different SMTP
+connections based on recipient domains.
+"""
+
+import itertools
+import smtplib
+import threading
+
+from email.utils import parseaddr
+
+from .serializer import _SerializerPool
+
+__all__ = ['Router', 'NoRouteException']
+
+
+class NoRouteException(Exception):
+    """Raised when there's no route for a recipient."""
+
+    def __init__(self, addr):
+        super(NoRouteException, self).__init__(
+            'No route for recipient: %s' % addr
+        )
+        self.addr = addr
+
+
+class _Pool(object):
+    # Hands out connections of a sequence round-robin.
+
+    def __init__(self, connections):
+        if not connections:
+            raise ValueError('Empty connection pool')
+
+        self._cycle = itertools.cycle(connections)
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+def _domain(addr):
+    if isinstance(addr, (list, tuple)):
+        addr = addr[0] or ''
+    else:
+        addr = parseaddr(addr)[1]
+
+    return addr.rpartition('@')[2].strip().rstrip('.').lower()
+
+
+class Router(object):
+    """Transport which sends envelopes through different connections based on
+    recipient domains.
+
+    *routes* is a mapping (or a sequence of pairs) of patterns to connections.
+    A pattern is either a domain (``example.com``), matching the domain
+    exactly, or a domain prefixed with a dot (``.example.com``), matching all
+    of its subdomains. Exact matches win and the longest suffix wins among
+    subdomain patterns. Recipients not matching any pattern are sent through
+    *default* connection.
+
+    A connection is any object implementing ``send_rendered()`` like
+    :py:class:`envelopes.conn.SMTP` or a list of them, used round-robin.
+
+    Example::
+
+        router = Router({
+            'example.com': SMTP('mail.internal'),
+            '.example.com': SMTP('mail.internal'),
+            'tenant.com': [SMTP('relay1.tenant.com'), SMTP('relay2.tenant.com')]
+        }, default=SMTP('smtp.example.com'))
+        router.send(envelope)
+
+    The envelope is rendered once and recipients are grouped, so each
+    connection receives the same message with one transaction. The message
+    is DKIM signed with *dkim* signer, if given.
+    """
+
+    def __init__(self, routes=None, default=None, dkim=None):
+        self._exact = {}
+        self._suffixes = {}
+        self._default = None
+        self._dkim = dkim
+        self._serializers = _SerializerPool(dkim=dkim)
+
+        if hasattr(routes, 'items'):
+            routes = routes.items()
+
+        for pattern, connection in (routes or []):
+            self.add_route(pattern, connection)
+
+        if default is not None:
+            self._default = self._target(default)
+
+    def _target(self, connection):
+        if isinstance(connection, (list, tuple)):
+            return _Pool(connection)
+
+        return connection
+
+    def add_route(self, pattern, connection):
+        """Routes recipients matching *pattern* through *connection*."""
+        pattern = pattern.strip().rstrip('.').lower()
+        target = self._target(connection)
+
+        if not pattern.startswith('.'):
+            self._exact[pattern] = target
+            return
+
+        # Suffix trie keyed by domain labels from the right. None key holds
+        # the target of a pattern ending at the node.
+        node = self._suffixes
+        for label in reversed(pattern[1:].split('.')):
+            node = node.setdefault(label, {})
+
+        node[None] = target
+
+    def _route(self, domain):
+        target = self._exact.get(domain)
+        if target is not None:
+            return target
+
+        target = self._default
+        node = self._suffixes
+        labels = domain.split('.')
+        for depth in range(len(labels) - 1, 0, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                break
+
+            # Subdomain patterns need at least one more label to match.
+            target = node.get(None, target)
+
+        return target
+
+    def route(self, addr):
+        """Returns connection (or pool) that would be used to send a message
+        to *addr*. Raises :py:exc:`NoRouteException` if there's no route."""
+        target = self._route(_domain(addr))
+        if target is None:
+            raise NoRouteException(addr)
+
+        return target
+
+    def send(self, envelope):
+        """Sends an *envelope* through connections routed for its recipients.
+        Returns a dict of refused recipients, like
+        :py:meth:`smtplib.SMTP.sendmail`, and raises
+        :py:exc:`smtplib.SMTPRecipientsRefused` if all of them were refused.
+        Can be called from many threads at once."""
+        groups = []
+        group_index = {}
+        for addr in envelope._recipients():
+            target = self.route(addr)
+            key = id(target)
+            if key not in group_index:
+                group_index[key] = len(groups)
+                groups.append((target, []))
+
+            groups[group_index[key]][1].append(
+                envelope._addrs_to_header([addr])
+            )
+
+        from_addr = envelope._encoded(
+            envelope._addrs_to_header([envelope._from])
+        )
+
+        refused = {}
+        serializer = self._serializers.get()
+        try:
+            msg = serializer.serialize(envelope)
+            for target, to_addrs in groups:
+                if isinstance(target, _Pool):
+                    target = target.get()
+
+                try:
+                    result = target.send_rendered(from_addr, to_addrs, msg)
+                except smtplib.SMTPRecipientsRefused as exc:
+                    # Keep delivering to the other groups.
+                    result = exc.recipients
+
+                refused.update(result or {})
+        finally:
+            # Drop the view, so the serializer can reuse its buffer.
+            msg = None
+            self._serializers.put(serializer)
+
+        recipients = set(addr for _, to_addrs in groups for addr in to_addrs)
+        if recipients and len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        return refused
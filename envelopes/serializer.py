@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.serializer
+====================
+
+This module contains the message serializer which renders envelopes straight
+into a reusable byte buffer.
+"""
+
+import binascii
+from email.header import Header
+import os
+import re
+import threading
+
+from .encoding import CRLF, base64_lines, base64_size, text_part_cache
+from .envelope import MessageEncodeError
+from .parts import Attachment, InlineImage
+from .tracing import span
+
+__all__ = ['MessageSerializer', 'StreamingSerializer']
+
+#: Preferred and maximum length of header lines (RFC 5322, section 2.1.1).
+MAX_LINE_LENGTH = 78
+MAX_LINE_LENGTH_HARD = 998
+
+_FOLD_REGEXP = re.compile(r'\s*\S+')
+# Line breaks not followed by folding whitespace would start a new header.
+_LINE_BREAK_REGEXP = re.compile(r'\r|\n(?![ \t])')
+
+_ADDRESS_HEADERS = frozenset(['from', 'to', 'cc', 'bcc', 'reply-to',
+                              'sender'])
+
+
+def _address_words(line):
+    # Splits after commas separating addresses, outside quoted strings.
+    chunks = []
+    start = 0
+    quoted = escaped = False
+    for index, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = quoted
+        elif char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            chunks.append(line[start:index + 1])
+            start = index + 1
+    chunks.append(line[start:])
+
+    return [word for chunk in chunks for word in _FOLD_REGEXP.findall(chunk)]
+
+
+def _fold_header(line, address_list=False):
+    # Folds a header line before whitespace or, in address lists, after
+    # commas (RFC 5322, section 2.2.3). Words longer than the hard limit
+    # are split.
+    if len(line) <= MAX_LINE_LENGTH:
+        return line
+
+    if address_list:
+        words = _address_words(line)
+    else:
+        words = _FOLD_REGEXP.findall(line)
+
+    lines = []
+    current = ''
+    for word in words:
+        if current and len(current) + len(word) > MAX_LINE_LENGTH:
+            lines.append(current)
+            current = word if word[0] in ' \t' else ' ' + word
+        else:
+            current += word
+
+        while len(current) > MAX_LINE_LENGTH_HARD:
+            lines.append(current[:MAX_LINE_LENGTH_HARD])
+            current = ' ' + current[MAX_LINE_LENGTH_HARD:]
+    lines.append(current)
+
+    return '\r\n'.join(lines)
+
+
+def _release(view):
+    # memoryview.release() is missing on Python 2, where the view is only
+    # dropped.
+    release = getattr(view, 'release', None)
+    if release is not None:
+        release()
+
+
+def _make_boundary():
+    # "=_" can't appear in base64 or quoted-printable encoded content. Raw
+    # 7bit and 8bit text parts are checked by the serializer.
+    return '=_envelopes_%s' % binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+class _Serializer(object):
+    # Rendering shared by the buffered and the streaming serializer.
+    # Subclasses decide where written data goes.
+
+    def __init__(self, size_hint):
+        self._buffer = bytearray(size_hint)
+        self._length = 0
+        self._make_boundaries()
+
+    def _make_boundaries(self):
+        boundary = _make_boundary()
+        self._content_type = (
+            'Content-Type: multipart/alternative;\r\n boundary="%s"' % boundary
+        ).encode('ascii') + CRLF
+        self._delimiter = b'--' + boundary.encode('ascii') + CRLF
+        self._close_delimiter = b'--' + boundary.encode('ascii') + b'--' + CRLF
+
+        # RFC 2387 requires the type of the root part, which is the HTML body.
+        related_boundary = _make_boundary()
+        self._related_content_type = (
+            'Content-Type: multipart/related; type="text/html";\r\n'
+            ' boundary="%s"' % related_boundary
+        ).encode('ascii') + CRLF
+        self._related_delimiter = (
+            b'--' + related_boundary.encode('ascii') + CRLF
+        )
+        self._related_close_delimiter = (
+            b'--' + related_boundary.encode('ascii') + b'--' + CRLF
+        )
+        self._boundaries = (boundary.encode('ascii'),
+                            related_boundary.encode('ascii'))
+
+    def _check_boundaries(self, envelope):
+        # Boundaries are reused between messages, so like email.generator
+        # pick new ones when a text part happens to contain them.
+        charset = envelope._charset
+        parts = [
+            text_part_cache.get(part[0], part[1], charset, part[3])
+            for part in envelope._parts
+            if not isinstance(part[1], Attachment)
+        ]
+        while any(boundary in part for part in parts
+                  for boundary in self._boundaries):
+            self._make_boundaries()
+
+    def _reclaim_buffer(self):
+        # A view that couldn't be released and is still referenced would see
+        # its data overwritten and prevents resizing, so the caller keeps
+        # the old buffer then.
+        try:
+            self._buffer.append(0)
+        except BufferError:
+            self._buffer = bytearray(len(self._buffer))
+        else:
+            del self._buffer[-1]
+
+    def _reserve(self, size):
+        end = self._length + size
+        if end > len(self._buffer):
+            self._buffer.extend(
+                bytearray(max(end - len(self._buffer), len(self._buffer)))
+            )
+
+        return end
+
+    def _write(self, data):
+        end = self._reserve(len(data))
+        self._buffer[self._length:end] = data
+        self._length = end
+
+    def _write_file(self, fh):
+        end = self._reserve(os.fstat(fh.fileno()).st_size)
+
+        view = memoryview(self._buffer)
+        try:
+            while self._length < end:
+                size = fh.readinto(view[self._length:end])
+                if not size:
+                    break
+                self._length += size
+        finally:
+            _release(view)
+
+    def _write_header(self, key, value, charset):
+        if ('\r' in key or '\n' in key or
+                _LINE_BREAK_REGEXP.search(value)):
+            raise MessageEncodeError('Line break in header: %s' % key)
+
+        if not all(ord(c) < 128 for c in value):
+            # Header folds encoded words itself.
+            value = Header(value, charset, header_name=key).encode()
+            line = ('%s: %s' % (key, value)).replace('\n', '\r\n')
+        elif '\n' in value:
+            line = ('%s: %s' % (key, value)).replace('\n', '\r\n')
+        else:
+            line = _fold_header('%s: %s' % (key, value),
+                                key.lower() in _ADDRESS_HEADERS)
+
+        self._write(line.encode('ascii'))
+        self._write(CRLF)
+
+    def _write_base64(self, data):
+        for line in base64_lines(data):
+            self._write(line)
+            self._write(CRLF)
+
+    def _write_text_part(self, part, charset):
+        self._write(text_part_cache.get(part[0], part[1], charset, part[3]))
+
+    def _write_attachment(self, attachment, charset):
+        self._write(
+            ('Content-Type: %s' % attachment.mimetype).encode('ascii') + CRLF
+        )
+        self._write(b'MIME-Version: 1.0' + CRLF)
+        self._write(b'Content-Transfer-Encoding: base64' + CRLF)
+        self._write_header('Content-Disposition',
+                           attachment.content_disposition, charset)
+        if attachment.content_id is not None:
+            self._write_header('Content-ID', '<%s>' % attachment.content_id,
+                               charset)
+        self._write(CRLF)
+
+        if isinstance(attachment, InlineImage):
+            self._write(attachment.encoded())
+        elif attachment.store is not None:
+            with attachment.store.open_encoded(attachment.digest) as fh:
+                self._write_file(fh)
+        else:
+            self._write_base64(attachment.data)
+
+    def _write_part(self, part, charset):
+        if isinstance(part[1], Attachment):
+            self._write_attachment(part[1], charset)
+        else:
+            self._write_text_part(part, charset)
+
+    def _write_related_part(self, parts, charset):
+        self._write(self._related_content_type)
+        self._write(b'MIME-Version: 1.0' + CRLF + CRLF)
+
+        for part in parts:
+            self._write(self._related_delimiter)
+            self._write_part(part, charset)
+        self._write(self._related_close_delimiter)
+
+    def prepare(self, envelope):
+        """Encodes text parts of *envelope* ahead of :py:meth:`serialize`,
+        which then finds them in :py:data:`envelopes.encoding.text_part_cache`.
+        Only useful to measure encoding separately."""
+        for part in envelope._parts:
+            if not isinstance(part[1], Attachment):
+                text_part_cache.get(part[0], part[1], envelope._charset,
+                                    part[3])
+
+    def _render(self, envelope):
+        charset = envelope._charset
+        self._check_boundaries(envelope)
+
+        self._write(self._content_type)
+        self._write(b'MIME-Version: 1.0' + CRLF)
+        for key, value in envelope._message_headers():
+            self._write_header(key, value, charset)
+        self._write(CRLF)
+
+        for part in envelope._part_tree():
+            self._write(self._delimiter)
+            if part[0] == 'multipart/related':
+                self._write_related_part(part[1], charset)
+            else:
+                self._write_part(part, charset)
+        self._write(self._close_delimiter)
+
+
+class MessageSerializer(_Serializer):
+    """Renders envelopes as wire-ready ``multipart/alternative`` messages.
+
+    Unlike :py:mod:`email.generator` the serializer writes headers and
+    encoded parts directly into a single :py:class:`bytearray` which is reused
+    between messages. Lines are terminated with CRLF, so the result can be
+    handed to the SMTP connection as-is.
+
+    :param size_hint: initial size of the buffer in bytes
+    :param dkim: :py:class:`envelopes.dkim.DKIMSigner` used to sign messages
+    """
+
+    def __init__(self, size_hint=65536, dkim=None):
+        super(MessageSerializer, self).__init__(size_hint)
+        self._view = None
+        self._dkim = dkim
+
+    def serialize(self, envelope):
+        """Serializes *envelope* and returns a :py:class:`memoryview` of the
+        rendered message.
+
+        The view points into the serializer's internal buffer and is only
+        valid until the next call to this method, which releases it."""
+        if self._view is not None:
+            _release(self._view)
+            self._view = None
+            self._reclaim_buffer()
+
+        with span('envelope.serialize') as current:
+            self._length = 0
+            self._render(envelope)
+            if self._dkim is not None:
+                self._sign(envelope)
+
+            current.set_attribute('smtp.message_size', self._length)
+            self._view = memoryview(self._buffer)[:self._length]
+            return self._view
+
+    def _body_key(self, envelope):
+        # Identifies the rendered body for DKIM body hash caching. Bodies
+        # depend on boundaries, so keys are only shared by envelopes rendered
+        # with this serializer.
+        parts = []
+        for part in envelope._parts:
+            attachment = part[1]
+            if isinstance(attachment, Attachment):
+                if attachment.digest is None:
+                    return None
+                parts.append((attachment.digest, attachment.mimetype,
+                              attachment.filename, attachment.content_id))
+            else:
+                parts.append(part)
+
+        return (self._delimiter, envelope._charset, tuple(parts))
+
+    def _sign(self, envelope):
+        header_end = self._buffer.find(CRLF + CRLF, 0, self._length) + 2
+        headers = memoryview(self._buffer)[:header_end]
+        body = memoryview(self._buffer)[header_end + 2:self._length]
+        try:
+            signature = self._dkim.sign(headers, body,
+                                        self._body_key(envelope))
+        finally:
+            _release(headers)
+            _release(body)
+
+        self._buffer[0:0] = signature
+        self._length += len(signature)
+
+
+class StreamingSerializer(_Serializer):
+    """Renders envelopes in chunks of about *chunk_size* bytes, so memory
+    used by rendering stays flat regardless of message size.
+
+    :param chunk_size: size of the chunk buffer in bytes
+    """
+
+    def __init__(self, chunk_size=65536):
+        # DKIM signature precedes the body it covers, which doesn't fit
+        # streaming, so there's no *dkim* argument.
+        super(StreamingSerializer, self).__init__(size_hint=chunk_size)
+        self._chunk_size = chunk_size
+        self._sink = None
+
+    def _flush(self):
+        if self._length:
+            view = memoryview(self._buffer)[:self._length]
+            try:
+                self._sink(view)
+            finally:
+                _release(view)
+            self._reclaim_buffer()
+            self._length = 0
+
+    def _write(self, data):
+        if len(data) >= self._chunk_size:
+            # Large blocks (e.g. cached text parts) go out without copying.
+            self._flush()
+            self._sink(data)
+        else:
+            if self._length + len(data) > self._chunk_size:
+                self._flush()
+            super(StreamingSerializer, self)._write(data)
+
+    def _write_file(self, fh):
+        for block in iter(lambda: fh.read(self._chunk_size), b''):
+            self._write(block)
+
+    def stream(self, envelope, write):
+        """Renders *envelope* passing consecutive chunks of the message to
+        *write* callable as they're ready. Chunks are bytes-like objects
+        valid only for the duration of the call."""
+        self._length = 0
+        self._sink = write
+        try:
+            self._render(envelope)
+            self._flush()
+        finally:
+            self._sink = None
+            self._length = 0
+
+
+class _SerializerPool(object):
+    # Idle serializers of a transport used from many threads. Each send
+    # takes its own serializer, so rendered messages aren't overwritten or
+    # released by concurrent sends.
+
+    def __init__(self, dkim=None):
+        self._dkim = dkim
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        return MessageSerializer(dkim=self._dkim)
+
+    def put(self, serializer):
+        with self._lock:
+            self._idle.append(serializer)
+
+
+class _MessageSizer(_Serializer):
+    # Goes through the same steps as the serializer, but only counts bytes.
+
+    def __init__(self):
+        super(_MessageSizer, self).__init__(size_hint=0)
+
+    def _write(self, data):
+        self._length += len(data)
+
+    def _write_file(self, fh):
+        self._length += os.fstat(fh.fileno()).st_size
+
+    def _write_base64(self, data):
+        self._length += base64_size(len(data))
+
+    def measure(self, envelope):
+        self._length = 0
+        self._render(envelope)
+        return self._length
+
+
+def message_size(envelope):
+    """Returns size in bytes of *envelope* as rendered by
+    :py:class:`MessageSerializer`, without rendering it."""
+    return _MessageSizer().measure(envelope)
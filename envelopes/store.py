@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+envelopes.store
+===============
+
+This module contains the content-addressed attachment store.
+"""
+
+import binascii
+import errno
+import hashlib
+import os
+import re
+
+from .encoding import BASE64_BLOCK_SIZE, CRLF, base64_lines
+
+__all__ = ['AttachmentStore', 'AttachmentStoreError']
+
+# Digests come from packed envelopes too, so they must never contain path
+# separators or dots.
+_DIGEST_REGEXP = re.compile(r'[0-9a-f]{64}\Z')
+
+
+class AttachmentStoreError(Exception):
+    pass
+
+
+class AttachmentStore(object):
+    """A directory which keeps attachments by SHA-256 hash of their contents.
+
+    Each unique file is stored once, already base64 encoded in CRLF
+    terminated lines, so envelopes referencing it only carry the hash and the
+    message serializer copies the encoded contents straight from disk.
+
+    :param path: path to the store's directory, created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+        try:
+            os.makedirs(path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    @property
+    def path(self):
+        """Path to the store's directory."""
+        return self._path
+
+    def _blob_path(self, digest):
+        if not isinstance(digest, str) or not _DIGEST_REGEXP.match(digest):
+            raise AttachmentStoreError('Invalid digest: %r' % (digest, ))
+
+        return os.path.join(self._path, digest[:2], digest + '.b64')
+
+    def __contains__(self, digest):
+        try:
+            return os.path.exists(self._blob_path(digest))
+        except AttachmentStoreError:
+            return False
+
+    def _write_blob(self, blocks):
+        # Contents are hashed while they're written, so a blob always matches
+        # its name even if the source changes in the meantime.
+        import tempfile
+
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+        digest = None
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for block in blocks:
+                    sha256.update(block)
+                    for line in base64_lines(block):
+                        fh.write(line)
+                        fh.write(CRLF)
+
+            digest = sha256.hexdigest()
+            if digest in self:
+                os.unlink(tmp_path)
+                return digest
+
+            blob_dir = os.path.dirname(self._blob_path(digest))
+            if not os.path.isdir(blob_dir):
+                try:
+                    os.makedirs(blob_dir)
+                except OSError as exc:
+                    if exc.errno != errno.EEXIST:
+                        raise
+
+            # Another process might have stored the same contents in the
+            # meantime, which is fine as the blobs are identical.
+            os.rename(tmp_path, self._blob_path(digest))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            if digest is None or digest not in self:
+                raise
+
+        return digest
+
+    def put(self, data):
+        """Stores *data* and returns its hex encoded SHA-256 digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self:
+            return digest
+
+        return self._write_blob([data])
+
+    def put_file(self, file_path):
+        """Stores contents of the file located at *file_path* without reading
+        it into memory at once. Returns hex encoded SHA-256 digest of the
+        contents."""
+        with open(file_path, 'rb') as fh:
+            return self._write_blob(
+                iter(lambda: fh.read(BASE64_BLOCK_SIZE), b'')
+            )
+
+    def open_encoded(self, digest):
+        """Returns a binary file object with base64 encoded contents stored
+        under *digest*."""
+        try:
+            return open(self._blob_path(digest), 'rb')
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+            raise AttachmentStoreError('No such attachment: %s' % digest)
+
+    def get(self, digest):
+        """Returns contents stored under *digest*."""
+        with self.open_encoded(digest) as fh:
+            return binascii.a2b_base64(fh.read())
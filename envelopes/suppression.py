@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.suppression
+=====================
+
+This module implements suppression lists used to drop unsubscribed or bounced
+recipients and duplicates before sending.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+from .address import AddressError, _addr_spec, normalize_address
+
+__all__ = ['SuppressionList', 'SuppressionListError']
+
+FILE_MAGIC = b'ENVSUPP1'
+_KEY = struct.Struct('>Q')
+
+
+class SuppressionListError(Exception):
+    """Raised when a suppression list file is invalid."""
+    pass
+
+
+def address_key(addr):
+    """Returns 64-bit hash key of *addr*. Addresses are normalized and
+    compared case-insensitively."""
+    try:
+        addr_spec = normalize_address(addr)
+    except AddressError:
+        addr_spec = _addr_spec(addr)
+
+    digest = hashlib.sha1(addr_spec.lower().encode('utf-8')).digest()
+    return _KEY.unpack_from(digest)[0]
+
+
+class _BloomFilter(object):
+    # Bloom filter over 64-bit keys, using double hashing of key halves.
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self._size = max(
+            int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64
+        )
+        self._hashes = max(
+            int(round(float(self._size) / capacity * math.log(2))), 1
+        )
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, key):
+        h1, h2 = key >> 32, (key & 0xffffffff) | 1
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class SuppressionList(object):
+    """Set of suppressed addresses.
+
+    Addresses are stored as 64-bit hashes of their normalized, lowercased
+    forms, so membership tests are O(1) and don't depend on address lengths.
+    A list can be saved to a file of sorted hashes with
+    :py:meth:`save` and opened with :py:meth:`open`, which memory-maps the
+    file instead of loading it. Lookups in a file use binary search, guarded
+    by a Bloom filter if *bloom* is *True*, so that the common case of
+    a non-suppressed address doesn't touch the file.
+
+    Example::
+
+        suppressed = SuppressionList(unsubscribed)
+        suppressed.update(bounced)
+        for envelope in envelopes:
+            envelope.filter_recipients(suppressed)
+    """
+
+    def __init__(self, addrs=None):
+        self._keys = set()
+        self._file = None
+        self._mmap = None
+        self._count = 0
+        self._bloom = None
+
+        if addrs is not None:
+            self.update(addrs)
+
+    @classmethod
+    def open(cls, path, bloom=True):
+        """Opens a suppression list saved at *path*. Addresses added to the
+        returned object are kept in memory."""
+        result = cls()
+        result._file = open(path, 'rb')
+        try:
+            size = os.fstat(result._file.fileno()).st_size
+            if (result._file.read(len(FILE_MAGIC)) != FILE_MAGIC or
+                    (size - len(FILE_MAGIC)) % _KEY.size != 0):
+                raise SuppressionListError('Invalid file: %s' % path)
+
+            result._count = (size - len(FILE_MAGIC)) // _KEY.size
+            if result._count:
+                result._mmap = mmap.mmap(result._file.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+        except Exception:
+            result.close()
+            raise
+
+        if bloom and result._count:
+            result._bloom = _BloomFilter(result._count)
+            for key in result._file_keys():
+                result._bloom.add(key)
+
+        return result
+
+    def close(self):
+        """Closes the file backing the list."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._count = 0
+        self._bloom = None
+
+    def _file_keys(self):
+        for index in range(self._count):
+            yield _KEY.unpack_from(
+                self._mmap, len(FILE_MAGIC) + index * _KEY.size
+            )[0]
+
+    def _file_contains(self, key):
+        if self._bloom is not None and key not in self._bloom:
+            return False
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            value = _KEY.unpack_from(
+                self._mmap, len(FILE_MAGIC) + middle * _KEY.size
+            )[0]
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle
+            else:
+                return True
+
+        return False
+
+    def _contains_key(self, key):
+        return key in self._keys or (self._count and self._file_contains(key))
+
+    def add(self, addr):
+        """Adds *addr* to the list."""
+        self._keys.add(address_key(addr))
+
+    def update(self, addrs):
+        """Adds all addresses in *addrs* to the list."""
+        self._keys.update(address_key(addr) for addr in addrs)
+
+    def __contains__(self, addr):
+        return bool(self._contains_key(address_key(addr)))
+
+    def __len__(self):
+        if not self._count:
+            return len(self._keys)
+
+        return self._count + sum(
+            1 for key in self._keys if not self._file_contains(key)
+        )
+
+    def save(self, path):
+        """Saves the list to a file at *path*."""
+        keys = set(self._keys)
+        if self._count:
+            keys.update(self._file_keys())
+
+        with open(path, 'wb') as fh:
+            fh.write(FILE_MAGIC)
+            for key in sorted(keys):
+                fh.write(_KEY.pack(key))
+
+    def accept(self, addr, seen):
+        """Returns *True* if *addr* isn't suppressed and its key isn't in
+        *seen* set, which is then updated."""
+        key = address_key(addr)
+        if key in seen or self._contains_key(key):
+            return False
+
+        seen.add(key)
+        return True
+
+    def filter(self, addrs, seen=None):
+        """Yields addresses from *addrs* which aren't suppressed, dropping
+        duplicates. Pass the same *seen* set to many calls to drop duplicates
+        across them."""
+        if seen is None:
+            seen = set()
+
+        for addr in addrs:
+            if self.accept(addr, seen):
+                yield addr
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+"""
+envelopes.tracing
+=================
+
+This module implements optional tracing of SMTP conversations. Spans are
+opened through a tracer compatible with the `OpenTelemetry
+<https://opentelemetry.io/>`_ tracing API. When no tracer is installed
+spans are no-ops.
+"""
+
+__all__ = ['set_tracer', 'get_tracer', 'use_opentelemetry', 'span']
+
+_tracer = None
+
+
+class _NoSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def is_recording(self):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def set_tracer(tracer):
+    """Installs *tracer* used to open spans. It has to implement
+    ``start_as_current_span(name)`` of OpenTelemetry ``Tracer``, returning a
+    context manager which yields a span with ``set_attribute(key, value)``
+    method. Passing *None* disables tracing."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    """Returns installed tracer or *None*."""
+    return _tracer
+
+
+def use_opentelemetry(tracer_provider=None):
+    """Installs a tracer obtained from *opentelemetry-api* package, which
+    has to be installed separately."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        raise RuntimeError('Tracing requires opentelemetry-api package')
+
+    set_tracer(trace.get_tracer('envelopes', tracer_provider=tracer_provider))
+
+
+def span(name):
+    """Returns a context manager opening span *name* with installed tracer.
+    It's a no-op if no tracer is installed."""
+    if _tracer is None:
+        return _NO_SPAN
+
+    return _tracer.start_as_current_span(name)
@@ -32,11 +32,16 @@ celery.conf.BROKER_URL = 'amqp://guest@localhost//'
 
 
 @celery.task
-def send_envelope():
+def send_envelope(envelope_data):
+    envelope = Envelope.from_bytes(envelope_data)
+    envelope.send('localhost', port=1025)
+
+
+def enqueue_envelope():
     envelope = Envelope(
         from_addr='%s@localhost' % os.getlogin(),
         to_addr='%s@localhost' % os.getlogin(),
         subject='Envelopes in Celery demo',
         text_body="I'm a helicopter!"
     )
-    envelope.send('localhost', port=1025)
+    send_envelope.delay(envelope.to_bytes())
@@ -25,6 +25,7 @@ sys.path = ['.'] + sys.path
 
 from envelopes import Envelope, SMTP
 import envelopes.connstack
+from envelopes.keepalive import ConnectionMaintainer
 from flask import Flask, jsonify
 import os
 
@@ -34,6 +35,10 @@ app.config['DEBUG'] = True
 
 conn = SMTP('127.0.0.1', 1025)
 
+maintainer = ConnectionMaintainer(max_idle=120)
+maintainer.register(conn)
+maintainer.start()
+
 
 @app.before_request
 def app_before_request():
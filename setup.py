@@ -37,12 +37,13 @@ setup(
     test_suite='nose.collector',
     zip_safe=False,
     platforms='any',
+    python_requires='>=3.4',
     tests_require=[
         'nose',
     ],
-    author=u'Tomasz Wójcik'.encode('utf-8'),
+    author='Tomasz Wójcik',
     author_email='tomek@bthlabs.pl',
-    maintainer=u'Tomasz Wójcik'.encode('utf-8'),
+    maintainer='Tomasz Wójcik',
     maintainer_email='tomek@bthlabs.pl',
     url='http://tomekwojcik.github.io/envelopes/',
     download_url='http://github.com/tomekwojcik/envelopes/tarball/v%s' %\
@@ -56,11 +57,13 @@ setup(
         "Intended Audience :: Developers",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
-        "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.6",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.4",
+        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
         "Topic :: Software Development :: Libraries :: Python Modules"
     ]
 )
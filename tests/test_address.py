@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+from envelopes import address
+from envelopes.address import (AddressError, normalize_address,
+                               validate_address, validate_many)
+
+
+class Test_Address(object):
+    def _reason(self, addr):
+        try:
+            normalize_address(addr)
+        except AddressError as exc:
+            assert exc.addr == addr
+            return exc.reason
+        else:
+            assert False, "AddressError not raised"
+
+    def test_normalize(self):
+        assert normalize_address('to@example.com') == 'to@example.com'
+        assert normalize_address('To@EXAMPLE.com.') == 'To@example.com'
+        assert normalize_address('To <to@example.com>') == 'to@example.com'
+        assert normalize_address(('to@example.com', 'To')) == 'to@example.com'
+        assert normalize_address("o'hara+tag@example.com") == "o'hara+tag@example.com"
+
+    def test_quoted_local_part(self):
+        assert normalize_address('"john.doe"@example.com') == 'john.doe@example.com'
+        assert normalize_address('"john doe"@example.com') == '"john doe"@example.com'
+        assert normalize_address('"a@b"@example.com') == '"a@b"@example.com'
+        assert normalize_address('"a\\"b"@example.com') == '"a\\"b"@example.com'
+        assert normalize_address('"\\a"@example.com') == 'a@example.com'
+
+    def test_idn(self):
+        assert normalize_address(u'to@bücher.de') == 'to@xn--bcher-kva.de'
+        assert normalize_address(u'żółw@example.com') == u'żółw@example.com'
+
+    def test_domain_literal(self):
+        assert normalize_address('to@[127.0.0.1]') == 'to@[127.0.0.1]'
+        assert normalize_address('to@[ipv6:::1]') == 'to@[IPv6:::1]'
+        assert self._reason('to@[127.0.0]') == 'Invalid domain literal'
+        assert self._reason('to@[IPv6:::g]') == 'Invalid domain literal'
+
+    def test_invalid(self):
+        assert self._reason('to') == 'Missing local part or domain'
+        assert self._reason('@example.com') == 'Missing local part or domain'
+        assert self._reason('to..me@example.com') == 'Invalid local part'
+        assert self._reason('to me@example.com') == 'Invalid local part'
+        assert self._reason('to\n@example.com') == 'Invalid local part'
+        assert self._reason('to\r@example.com') == 'Invalid local part'
+        assert self._reason('to@example\n.com') == 'Invalid domain'
+        assert self._reason('"to@example.com') == 'Unterminated quoted local part'
+        assert self._reason('"a\nb"@example.com') == 'Invalid character in quoted local part'
+        assert self._reason('to@-example.com') == 'Invalid domain'
+        assert self._reason('to@example..com') == 'Invalid domain'
+        assert self._reason('to@example.123') == 'Invalid top level domain'
+        assert self._reason('%s@example.com' % ('a' * 65)) == 'Local part too long'
+        assert self._reason('%s@%s.com' % ('a' * 10, '.'.join(['a' * 60] * 4))) == 'Address too long'
+
+    def test_validate(self):
+        assert validate_address('to@example.com') is True
+        assert validate_address('to@@example.com') is False
+
+        valid, invalid = validate_many([
+            'to@EXAMPLE.com', 'bad', ('cc@example.com', 'CC'), 'bad@'
+        ])
+        assert valid == ['to@example.com', 'cc@example.com']
+        assert [exc.addr for exc in invalid] == ['bad', 'bad@']
+
+    def test_cache(self):
+        address._cache.clear()
+        normalize_address('to@example.com')
+        validate_address('bad')
+        assert len(address._cache) == 2
+        assert self._reason('bad') == 'Missing local part or domain'
+        assert len(address._cache) == 2
+
+    def test_cached_error(self):
+        address._cache.clear()
+        errors = []
+        for _ in range(3):
+            try:
+                normalize_address('bad')
+            except AddressError as exc:
+                errors.append(exc)
+
+        assert len(set(id(exc) for exc in errors)) == 3
+        depths = []
+        for exc in errors:
+            depth, traceback = 0, exc.__traceback__
+            while traceback is not None:
+                depth, traceback = depth + 1, traceback.tb_next
+            depths.append(depth)
+        assert depths[1] == depths[2]
@@ -27,9 +27,20 @@ test_conn
 This module contains test suite for the *SMTP* class.
 """
 
-from envelopes.conn import SMTP
+import email
+import mailbox
+import os
+import shutil
+import tempfile
+import threading
+
+from envelopes import conn as conn_module
+from envelopes.conn import (SMTP, FileSMTP, MessageTooLargeException,
+                            NullSMTP, TimeoutException, _DataWriter)
+from envelopes.dkim import DKIMSigner
 from envelopes.envelope import Envelope
-from lib.testing import BaseTestCase
+from envelopes.serializer import MessageSerializer
+from lib.testing import BaseTestCase, DKIM_PRIVATE_KEY
 
 
 class Test_SMTPConnection(BaseTestCase):
@@ -139,3 +150,376 @@ class Test_SMTPConnection(BaseTestCase):
         assert call_args[0] == mime_msg['From']
         assert call_args[1] == [envelope._addrs_to_header([addr]) for addr in envelope._to + envelope._cc + envelope._bcc]
         assert call_args[2] != ''
+        assert call_args[2].startswith(b'Content-Type: multipart/alternative')
+
+    def test_max_message_size(self):
+        conn = SMTP('localhost')
+        assert conn.max_message_size is None
+
+        conn._conn.esmtp_features['size'] = '0'
+        assert conn.max_message_size is None
+
+        conn._conn.esmtp_features['size'] = '1024'
+        assert conn.max_message_size == 1024
+
+    def test_send_too_large(self):
+        conn = SMTP('localhost')
+        conn._connect()
+
+        envelope = Envelope(**self._dummy_message())
+        conn._conn.esmtp_features['size'] = str(envelope.estimated_size() - 1)
+
+        try:
+            conn.send(envelope)
+        except MessageTooLargeException as exc:
+            assert exc.size == envelope.estimated_size()
+            assert exc.max_size == envelope.estimated_size() - 1
+        else:
+            assert False, "MessageTooLargeException not raised"
+
+        assert len(conn._conn._call_stack.get('sendmail', [])) == 0
+
+        conn._conn.esmtp_features['size'] = str(envelope.estimated_size())
+        conn.send(envelope)
+        assert len(conn._conn._call_stack.get('sendmail', [])) == 1
+
+    def test_send_stream(self):
+        conn = SMTP('localhost', stream=True)
+        conn._connect()
+        conn._conn.does_esmtp = 1
+        conn._conn.esmtp_features['size'] = '1048576'
+
+        msg = self._dummy_message()
+        msg['text_body'] = u'.leading dot\n..two dots\nlast line'
+        envelope = Envelope(text_body_encoding='8bit', **msg)
+
+        assert conn.send(envelope) == {}
+        assert len(conn._conn._call_stack.get('sendmail', [])) == 0
+
+        mail_args, mail_kwargs = conn._conn._call_stack['mail'][0]
+        assert mail_args[0] == envelope.to_mime_message()['From']
+        assert mail_kwargs['options'] == ['size=%d' % envelope.estimated_size()]
+
+        rcpts = [args[0] for args, _ in conn._conn._call_stack['rcpt']]
+        assert rcpts == [envelope._addrs_to_header([addr]) for addr in envelope._to + envelope._cc + envelope._bcc]
+
+        assert conn._conn._call_stack['putcmd'][0][0] == ['data']
+        data = b''.join(args[0] for args, _ in conn._conn._call_stack['send'])
+        assert data.startswith(b'Content-Type: multipart/alternative')
+        assert data.endswith(b'\r\n.\r\n')
+        assert b'\r\n..leading dot\r\n...two dots\r\n' in data
+
+    def _bdat_commands(self, conn):
+        return [kwargs['args'] for args, kwargs in conn._conn._call_stack['putcmd']
+                if args[0] == 'bdat']
+
+    def test_send_bdat(self):
+        conn = SMTP('localhost')
+        conn.BDAT_CHUNK_SIZE = 512
+        conn._connect()
+        conn._conn.does_esmtp = 1
+        conn._conn.esmtp_features['chunking'] = ''
+        conn._conn.esmtp_features['binarymime'] = ''
+
+        msg = self._dummy_message()
+        msg['text_body'] = u'.leading dot\nlast line'
+        envelope = Envelope(text_body_encoding='8bit', **msg)
+
+        assert conn.send(envelope) == {}
+        assert len(conn._conn._call_stack.get('sendmail', [])) == 0
+        assert conn._conn._call_stack['mail'][0][1]['options'] == ['body=BINARYMIME']
+
+        data = b''.join(args[0] for args, _ in conn._conn._call_stack['send'])
+        assert b'\r\n.leading dot\r\n' in data
+        assert not data.endswith(b'\r\n.\r\n')
+
+        commands = self._bdat_commands(conn)
+        assert len(commands) == (len(data) + 511) // 512
+        assert all(command == '512' for command in commands[:-1])
+        assert commands[-1] == '%d LAST' % (len(data) - 512 * (len(commands) - 1))
+
+    def test_send_rendered_bdat_bytes(self):
+        conn = SMTP('localhost')
+        conn.BDAT_CHUNK_SIZE = 4
+        conn._connect()
+        conn._conn.does_esmtp = 1
+        conn._conn.esmtp_features['chunking'] = ''
+
+        assert conn.send_rendered('from@example.com', ['to@example.com'],
+                                  b'Subject: Hi\r\n\r\nBody\r\n') == {}
+        assert self._bdat_commands(conn)[-1] == '1 LAST'
+        assert conn._conn.messages.to('to@example.com')[0].msg == (
+            b'Subject: Hi\r\n\r\nBody\r\n'
+        )
+
+    def test_send_bdat_stream(self):
+        conn = SMTP('localhost', stream=True)
+        conn._connect()
+        conn._conn.does_esmtp = 1
+        conn._conn.esmtp_features['chunking'] = ''
+
+        envelope = Envelope(**self._dummy_message())
+        conn.send(envelope)
+
+        data = b''.join(args[0] for args, _ in conn._conn._call_stack['send'])
+        assert data.startswith(b'Content-Type: multipart/alternative')
+
+        commands = self._bdat_commands(conn)
+        assert commands[-1] == '0 LAST'
+        assert sum(int(command) for command in commands[:-1]) == len(data)
+
+    def test_send_dkim(self):
+        signer = DKIMSigner('example.com', 'mail', DKIM_PRIVATE_KEY)
+        conn = SMTP('localhost', stream=True, dkim=signer)
+
+        conn.send(Envelope(**self._dummy_message()))
+        msg = conn._conn._call_stack['sendmail'][0][0][2]
+        assert msg.startswith(b'DKIM-Signature: v=1; a=rsa-sha256;')
+
+    def test_close(self):
+        conn = SMTP('localhost')
+        assert conn.idle_time is None
+
+        conn._connect()
+        old_conn = conn._conn
+        assert conn.idle_time >= 0
+
+        conn.close()
+        assert conn._conn is None
+        assert conn.idle_time is None
+        assert old_conn.call_counts['quit'] == 1
+
+        conn.send(Envelope(**self._dummy_message()))
+        assert conn._conn is not None
+
+    def test_constructor_timeouts(self):
+        conn = SMTP('localhost', timeout=10, tls_timeout=5, data_timeout=60)
+        assert conn._connect_timeout == 10
+        assert conn._tls_timeout == 5
+        assert conn._command_timeout == 10
+        assert conn._data_timeout == 60
+        assert conn._deadline is None
+
+    def test_send_timeouts(self):
+        conn = SMTP('localhost', tls=True, connect_timeout=1, tls_timeout=2,
+                    command_timeout=3, data_timeout=4)
+        conn.send(Envelope(**self._dummy_message()))
+
+        assert conn._conn._timeout == 1
+        assert conn._conn.sock.timeouts == [1, 2, 3, 3, 4]
+
+    def test_send_deadline(self):
+        conn = SMTP('localhost', command_timeout=30, deadline=2)
+        conn.send(Envelope(**self._dummy_message()))
+
+        timeouts = conn._conn.sock.timeouts
+        assert all(0 < timeout <= 2 for timeout in timeouts)
+        assert conn._expires is None
+
+    def test_send_deadline_exceeded(self):
+        clock = [100.0]
+        orig_monotonic = conn_module._monotonic
+        conn_module._monotonic = lambda: clock[0]
+        try:
+            conn = SMTP('localhost', stream=True, deadline=10)
+            conn._connect()
+            conn._conn.does_esmtp = 1
+            conn._conn.esmtp_features['chunking'] = ''
+
+            mail = conn._conn.mail
+
+            def slow_mail(sender, options=[]):
+                clock[0] += 20
+                return mail(sender, options)
+            conn._conn.mail = slow_mail
+
+            try:
+                conn.send(Envelope(**self._dummy_message()))
+            except TimeoutException:
+                pass
+            else:
+                assert False, 'TimeoutException not raised'
+
+            assert len(conn._conn._call_stack['close']) == 1
+            assert len(conn._conn._call_stack.get('putcmd', [])) == 0
+            assert conn._expires is None
+        finally:
+            conn_module._monotonic = orig_monotonic
+
+
+class Test_DataWriter(object):
+    def _write(self, *chunks):
+        sent = []
+        writer = _DataWriter(sent.append)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+        return b''.join(sent)
+
+    def test_dot_stuffing(self):
+        assert self._write(b'.a\r\n.b\r\n') == b'..a\r\n..b\r\n.\r\n'
+        assert self._write(b'a\r\n', b'.b') == b'a\r\n..b\r\n.\r\n'
+        assert self._write(b'a\r', b'\n.b') == b'a\r\n..b\r\n.\r\n'
+
+    def test_line_endings(self):
+        assert self._write(b'a\nb\rc') == b'a\r\nb\r\nc\r\n.\r\n'
+        assert self._write(b'a\r') == b'a\r\n.\r\n'
+        assert self._write(b'') == b'.\r\n'
+
+
+class Test_NullSMTP(BaseTestCase):
+    def test_send(self):
+        envelope = Envelope(**self._dummy_message())
+        size = len(MessageSerializer().serialize(envelope))
+
+        for stream in (False, True):
+            conn = NullSMTP(stream=stream)
+            assert conn.is_connected
+            assert conn.max_message_size is None
+
+            assert conn.send(envelope) == {}
+            assert conn.send(envelope) == {}
+            assert conn.messages == 2
+            assert conn.bytes == size * 2
+
+        conn.send_rendered('from@example.com', ['to@example.com'], b'12345')
+        assert conn.messages == 3
+        assert conn.bytes == size * 2 + 5
+
+    def test_send_threads(self):
+        envelope = Envelope(**self._dummy_message())
+        size = len(MessageSerializer().serialize(envelope))
+        conn = NullSMTP()
+        errors = []
+
+        def send():
+            try:
+                for _ in range(50):
+                    conn.send(envelope)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert conn.messages == 200
+        assert conn.bytes == size * 200
+
+
+class Test_FileSMTP(BaseTestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def _envelope(self):
+        msg = self._dummy_message()
+        msg['text_body'] = u'From here\n>From there\nend'
+        return Envelope(text_body_encoding='8bit', **msg)
+
+    def test_maildir(self):
+        path = os.path.join(self._path, 'Maildir')
+        conn = FileSMTP(path, fsync_every=2, stream=True)
+        envelope = self._envelope()
+
+        for _ in range(3):
+            conn.send(envelope)
+        assert len(conn._pending) == 1
+        assert len(os.listdir(os.path.join(path, 'tmp'))) == 1
+        assert len(os.listdir(os.path.join(path, 'new'))) == 2
+        conn.close()
+        assert conn._pending == []
+
+        assert os.listdir(os.path.join(path, 'tmp')) == []
+        names = os.listdir(os.path.join(path, 'new'))
+        assert len(names) == 3 and len(set(names)) == 3
+
+        with open(os.path.join(path, 'new', names[0]), 'rb') as fh:
+            raw = fh.read()
+        assert raw.startswith(b'Return-Path: <from@example.com>\r\n')
+        message = email.message_from_bytes(raw)
+        assert message['Subject'] == envelope.to_mime_message()['Subject']
+        assert conn.messages == 3
+
+    def test_mbox(self):
+        path = os.path.join(self._path, 'mbox')
+        conn = FileSMTP(path, format='mbox', fsync_every=0)
+        envelope = self._envelope()
+
+        conn.send(envelope)
+        conn.send(envelope)
+        conn.close()
+
+        with open(path, 'rb') as fh:
+            raw = fh.read()
+        assert b'\r\n' not in raw
+        assert b'\n>From here\n>>From there\n' in raw
+
+        messages = list(mailbox.mbox(path))
+        assert len(messages) == 2
+        assert messages[0]['Subject'] == envelope.to_mime_message()['Subject']
+        assert messages[0].get_from().startswith('from@example.com ')
+
+    def test_mbox_reopen(self):
+        path = os.path.join(self._path, 'mbox')
+        conn = FileSMTP(path, format='mbox')
+        conn.send(self._envelope())
+        conn.close()
+
+        conn.send(self._envelope())
+        conn.close()
+        assert len(mailbox.mbox(path)) == 2
+
+    def test_mbox_open_error(self):
+        conn = FileSMTP(os.path.join(self._path, 'mbox'), format='mbox')
+        conn._mbox = None
+        conn._path = self._path
+
+        try:
+            conn.send(self._envelope())
+        except (IOError, OSError):
+            pass
+        else:
+            assert False, "IOError not raised"
+
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(conn._lock.acquire(False))
+        )
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+
+    def test_abort(self):
+        path = os.path.join(self._path, 'mbox')
+        conn = FileSMTP(path, format='mbox')
+        conn.send(self._envelope())
+
+        def render(writer):
+            writer.write(b'Subject: partial\r\n')
+            raise RuntimeError('Rendering failed')
+
+        try:
+            conn._deliver('from@example.com', ['to@example.com'], render)
+        except RuntimeError:
+            pass
+        else:
+            assert False, "RuntimeError not raised"
+
+        conn.send(self._envelope())
+        conn.close()
+        assert len(mailbox.mbox(path)) == 2
+        assert conn.messages == 2
+
+    def test_invalid_format(self):
+        try:
+            FileSMTP(self._path, format='mh')
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
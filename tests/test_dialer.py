@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_dialer
+===========
+
+This module contains test suite for the *Dialer* class.
+"""
+
+import os
+import smtplib
+import socket
+import threading
+
+from envelopes.conn import SMTP
+from envelopes.dialer import Dialer, _interleave
+from lib.testing import BaseTestCase
+
+V4 = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '')
+
+
+def _info(port, family=socket.AF_INET):
+    if family == socket.AF_INET:
+        return (family,) + V4[1:] + (('127.0.0.1', port),)
+    return (family,) + V4[1:] + (('::1', port, 0, 0),)
+
+
+def _dead_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class StaticDialer(Dialer):
+    def __init__(self, addrinfos, **kwargs):
+        Dialer.__init__(self, **kwargs)
+        self.addrinfos = addrinfos
+        self.lookups = 0
+
+    def _getaddrinfo(self, host, port):
+        self.lookups += 1
+        return list(self.addrinfos)
+
+
+class Test_Dialer(BaseTestCase):
+    def setUp(self):
+        self._server = socket.socket()
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self._port = self._server.getsockname()[1]
+
+    def tearDown(self):
+        self._server.close()
+
+    def test_interleave(self):
+        v6 = [_info(1, socket.AF_INET6), _info(2, socket.AF_INET6),
+              _info(3, socket.AF_INET6)]
+        v4 = [_info(4), _info(5)]
+
+        assert _interleave(v6 + v4) == [v6[0], v4[0], v6[1], v4[1], v6[2]]
+        assert _interleave(v4 + v6) == [v4[0], v6[0], v4[1], v6[1], v6[2]]
+        assert _interleave([]) == []
+
+    def test_resolve_cache(self):
+        dialer = StaticDialer([_info(self._port)], ttl=60)
+
+        assert dialer.resolve('mx.example.com', 25) == [_info(self._port)]
+        assert dialer.resolve('mx.example.com', 25) == [_info(self._port)]
+        assert dialer.lookups == 1
+
+        dialer.clear_cache()
+        dialer.resolve('mx.example.com', 25)
+        assert dialer.lookups == 2
+
+    def test_connect(self):
+        dialer = StaticDialer([_info(self._port)])
+        sock = dialer.connect('mx.example.com', 25, timeout=5)
+        try:
+            assert sock.getpeername() == ('127.0.0.1', self._port)
+            assert sock.gettimeout() == 5
+        finally:
+            sock.close()
+
+    def test_connect_high_fd(self):
+        try:
+            import resource
+        except ImportError:
+            return
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1100:
+            return
+
+        # Push socket file descriptors past FD_SETSIZE of select().
+        fds = []
+        try:
+            while not fds or fds[-1] < 1030:
+                fds.append(os.dup(self._server.fileno()))
+
+            dialer = StaticDialer([_info(self._port)])
+            sock = dialer.connect('mx.example.com', 25, timeout=5)
+            assert sock.fileno() > 1024
+            sock.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def test_connect_failover(self):
+        dead, live = _info(_dead_port()), _info(self._port)
+        dialer = StaticDialer([dead, live], penalty=60)
+
+        sock = dialer.connect('mx.example.com', 25, timeout=5)
+        sock.close()
+
+        assert dialer.is_healthy(dead[4]) is False
+        assert dialer.is_healthy(live[4]) is True
+        assert dialer.addresses('mx.example.com', 25) == [live, dead]
+
+    def test_connect_failed(self):
+        dialer = StaticDialer([_info(_dead_port()), _info(_dead_port())])
+
+        try:
+            dialer.connect('mx.example.com', 25, timeout=5)
+        except socket.timeout:
+            assert False, 'Refused connections reported as timeout'
+        except socket.error:
+            pass
+        else:
+            assert False, 'socket.error not raised'
+
+    def test_smtp_connect(self):
+        def serve():
+            client, _ = self._server.accept()
+            client.sendall(b'220 localhost ESMTP\r\n')
+            client.recv(1024)
+            client.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+
+        dialer = StaticDialer([_info(_dead_port()), _info(self._port)])
+        conn = SMTP('mx.example.com', 2525, connect_timeout=5, dialer=dialer)
+        try:
+            conn._connect()
+            assert isinstance(conn._conn, smtplib.SMTP)
+            assert conn._conn.sock.getpeername()[1] == self._port
+        finally:
+            conn._conn.close()
+            thread.join()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_encoding
+=============
+
+This module contains test suite for the *envelopes.encoding* module.
+"""
+
+import base64
+import quopri
+
+from envelopes.encoding import TextPartCache, encode_text_part,\
+    shortest_encoding
+
+
+def _split_part(part):
+    headers, body = part.split(b'\r\n\r\n', 1)
+    return headers.split(b'\r\n'), body
+
+
+class Test_Encoding(object):
+    def test_encode_text_part(self):
+        headers, body = _split_part(
+            encode_text_part('text/plain', u'ęóąśłżźćń', 'utf-8')
+        )
+        assert headers == [
+            b'Content-Type: text/plain; charset="utf-8"',
+            b'MIME-Version: 1.0',
+            b'Content-Transfer-Encoding: base64'
+        ]
+        assert base64.b64decode(body) == u'ęóąśłżźćń'.encode('utf-8')
+
+    def test_encode_text_part_quoted_printable(self):
+        headers, body = _split_part(encode_text_part(
+            'text/html', u'<p>ęóą</p>\n', 'utf-8', 'quoted-printable'
+        ))
+        assert headers[2] == b'Content-Transfer-Encoding: quoted-printable'
+        assert quopri.decodestring(body) == u'<p>ęóą</p>\r\n\r\n'.encode('utf-8')
+
+    def test_encode_text_part_8bit(self):
+        headers, body = _split_part(
+            encode_text_part('text/plain', u'ęóą\n', 'utf-8', '8bit')
+        )
+        assert headers[2] == b'Content-Transfer-Encoding: 8bit'
+        assert body == u'ęóą\r\n\r\n'.encode('utf-8')
+
+        headers, body = _split_part(
+            encode_text_part('text/plain', u'spam', 'utf-8', '8bit')
+        )
+        assert headers[2] == b'Content-Transfer-Encoding: 7bit'
+
+    def test_shortest_encoding(self):
+        assert shortest_encoding(u'spam and eggs', 'utf-8') ==\
+            'quoted-printable'
+        assert shortest_encoding(u'ęóąśłżźćń', 'utf-8') == 'base64'
+
+        headers, body = _split_part(encode_text_part(
+            'text/plain', u'spam and eggs', 'utf-8', 'shortest'
+        ))
+        assert headers[2] == b'Content-Transfer-Encoding: quoted-printable'
+
+
+class Test_TextPartCache(object):
+    def test_get(self):
+        cache = TextPartCache()
+        body = u'<p>spam</p>' * 100
+
+        part = cache.get('text/html', body, 'utf-8')
+        assert part == encode_text_part('text/html', body, 'utf-8')
+        assert cache.get('text/html', body, 'utf-8') is part
+        assert cache.get('text/html', body, 'utf-8', 'base64') is not part
+        assert len(cache) == 2
+
+    def test_max_size(self):
+        cache = TextPartCache(max_size=1500)
+
+        cache.get('text/plain', u'spam' * 100, 'utf-8')
+        cache.get('text/plain', u'eggs' * 100, 'utf-8')
+        assert len(cache) == 1
+
+        cache.get('text/plain', u'ham' * 1000, 'utf-8')
+        assert len(cache) == 1
+
+        cache.clear()
+        assert len(cache) == 0
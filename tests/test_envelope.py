@@ -28,12 +28,19 @@ This module contains test suite for the *Envelope* class.
 """
 
 from email.header import Header
+import mmap
 import os
+import shutil
 import sys
+import tempfile
 
 from envelopes.envelope import Envelope, MessageEncodeError
 from envelopes.compat import encoded
-from lib.testing import BaseTestCase
+from envelopes import parts
+from envelopes.parts import InlineImage
+from envelopes.serializer import MessageSerializer
+from envelopes.store import AttachmentStore
+from lib.testing import BaseTestCase, TEXT_BODY
 
 
 class Test_Envelope(BaseTestCase):
@@ -64,6 +71,19 @@ class Test_Envelope(BaseTestCase):
         assert envelope._headers == msg['headers']
         assert envelope._charset == msg['charset']
 
+    def test_constructor_text_from_html(self):
+        msg = self._dummy_message()
+        msg.pop('text_body')
+        envelope = Envelope(text_from_html=True, **msg)
+
+        assert len(envelope._parts) == 2
+        assert envelope._parts[0][0] == 'text/plain'
+        assert envelope._parts[0][1] == TEXT_BODY
+
+        msg['text_body'] = u'Spam'
+        envelope = Envelope(text_from_html=True, **msg)
+        assert envelope._parts[0][1] == u'Spam'
+
     def test_addr_tuple_to_addr(self):
         addr = Envelope()._addr_tuple_to_addr(('test@example.com', 'Test'))
         assert addr == 'Test <test@example.com>'
@@ -221,6 +241,49 @@ class Test_Envelope(BaseTestCase):
         assert html_part.get_content_type() == 'text/html'
         assert html_part.get_payload(decode=True) == msg['html_body'].encode('utf-8')
 
+    def test_to_mime_message_body_encoding(self):
+        envelope = Envelope(
+            text_body=u'ęóąśłżźćń', html_body=u'<p>spam</p>',
+            text_body_encoding='quoted-printable',
+            html_body_encoding='shortest'
+        )
+        assert envelope._parts[0][3] == 'quoted-printable'
+
+        mime_msg_parts = [part for part in envelope.to_mime_message().walk()]
+        text_part, html_part = mime_msg_parts[1:]
+        assert text_part['Content-Transfer-Encoding'] == 'quoted-printable'
+        assert text_part.get_payload(decode=True) ==\
+            u'ęóąśłżźćń'.encode('utf-8')
+        assert html_part['Content-Transfer-Encoding'] == 'quoted-printable'
+
+        try:
+            Envelope(text_body=u'spam', text_body_encoding='uuencode')
+        except MessageEncodeError as exc:
+            assert exc.args[0] == 'Unsupported body encoding: uuencode'
+        else:
+            assert False, "MessageEncodeError not raised"
+
+    def test_estimated_size(self):
+        envelope = Envelope(**self._dummy_message())
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(os.urandom(10001))
+        envelope.add_attachment(_bin)
+        envelope.add_attachment(_bin, use_mmap=True)
+
+        _png = self._tempfile(suffix='.png')
+        envelope.add_inline_image(_png)
+
+        store_path = tempfile.mkdtemp()
+        try:
+            envelope.add_attachment(_bin, store=AttachmentStore(store_path))
+
+            view = MessageSerializer().serialize(envelope)
+            assert envelope.estimated_size() == len(view)
+        finally:
+            shutil.rmtree(store_path)
+
     def test_send(self):
         envelope = Envelope(
             from_addr='spam@example.com',
@@ -368,26 +431,201 @@ class Test_Envelope(BaseTestCase):
         assert envelope._parts[1][0] == 'text/html'
 
         assert envelope._parts[2][0] == 'image/jpeg'
-        assert envelope._parts[2][1]['Content-Disposition'] ==\
+        assert envelope._parts[2][1].content_disposition ==\
             'attachment; filename="%s"' % os.path.basename(_jpg)
 
         assert envelope._parts[3][0] == 'audio/mpeg'
-        assert envelope._parts[3][1]['Content-Disposition'] ==\
+        assert envelope._parts[3][1].content_disposition ==\
             'attachment; filename="%s"' % os.path.basename(_mp3)
 
         assert envelope._parts[4][0] == 'application/pdf'
-        assert envelope._parts[4][1]['Content-Disposition'] ==\
+        assert envelope._parts[4][1].content_disposition ==\
             'attachment; filename="%s"' % os.path.basename(_pdf)
 
         assert envelope._parts[5][0] == 'application/octet-stream'
-        assert envelope._parts[5][1]['Content-Disposition'] ==\
+        assert envelope._parts[5][1].content_disposition ==\
             'attachment; filename="%s"' %\
             os.path.basename(encoded(_something, 'utf-8'))
 
         assert envelope._parts[6][0] == 'application/octet-stream'
-        assert envelope._parts[6][1]['Content-Disposition'] ==\
+        assert envelope._parts[6][1].content_disposition ==\
             'attachment; filename="%s"' % os.path.basename(_octet)
 
+    def test_attachment_to_mime_message(self):
+        msg = self._dummy_message()
+        envelope = Envelope(**msg)
+
+        _octet = self._tempfile(suffix='.txt')
+        with open(_octet, 'wb') as fh:
+            fh.write(b'spam and eggs')
+        envelope.add_attachment(_octet)
+
+        attachment = envelope._parts[2][1]
+        assert attachment.data == b'spam and eggs'
+
+        mime_msg_parts = [part for part in envelope.to_mime_message().walk()]
+        assert len(mime_msg_parts) == 4
+
+        assert mime_msg_parts[3].get_content_type() == 'text/plain'
+        assert mime_msg_parts[3].get_payload(decode=True) == b'spam and eggs'
+        assert mime_msg_parts[3]['Content-Disposition'] ==\
+            attachment.content_disposition
+
+    def test_add_attachment_mmap(self):
+        envelope = Envelope(**self._dummy_message())
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(os.urandom(200000))
+        with open(_bin, 'rb') as fh:
+            data = fh.read()
+        envelope.add_attachment(_bin, use_mmap=True)
+
+        _empty = self._tempfile(suffix='.bin')
+        envelope.add_attachment(_empty, use_mmap=True)
+
+        assert isinstance(envelope._parts[2][1].data, mmap.mmap)
+        assert envelope._parts[3][1].data == b''
+
+        mime_msg_parts = [part for part in envelope.to_mime_message().walk()]
+        assert mime_msg_parts[3].get_payload(decode=True) == data
+        assert mime_msg_parts[4].get_payload(decode=True) == b''
+
+        assert envelope.to_dict()['parts'][2]['data'] == data
+
+    def test_add_inline_image(self):
+        InlineImage.clear_cache()
+        _png = self._tempfile(suffix='.png')
+        with open(_png, 'wb') as fh:
+            fh.write(b'\x89PNG spam')
+
+        envelope = Envelope(**self._dummy_message())
+        content_id = envelope.add_inline_image(_png)
+        assert envelope.add_inline_image(_png, content_id='logo') == 'logo'
+
+        image = envelope._parts[2][1]
+        assert image.mimetype == 'image/png'
+        assert image.content_id == content_id
+        assert image.content_disposition ==\
+            'inline; filename="%s"' % os.path.basename(_png)
+
+        other_envelope = Envelope(**self._dummy_message())
+        assert other_envelope.add_inline_image(_png) == content_id
+        assert other_envelope._parts[2][1] is image
+
+        mime_msg_parts = [part for part in envelope.to_mime_message().walk()]
+        assert [part.get_content_type() for part in mime_msg_parts] == [
+            'multipart/alternative', 'text/plain', 'multipart/related',
+            'text/html', 'image/png', 'image/png'
+        ]
+        assert mime_msg_parts[2].get_param('type') == 'text/html'
+        assert mime_msg_parts[4]['Content-ID'] == '<%s>' % content_id
+        assert mime_msg_parts[4].get_payload(decode=True) == b'\x89PNG spam'
+        assert mime_msg_parts[5]['Content-ID'] == '<logo>'
+
+        new_envelope = Envelope.from_dict(envelope.to_dict())
+        assert isinstance(new_envelope._parts[2][1], InlineImage)
+        assert new_envelope._parts[2][1].content_id == content_id
+        assert new_envelope.to_dict() == envelope.to_dict()
+
+    def test_inline_image_cache_size(self):
+        InlineImage.clear_cache()
+        _png = self._tempfile(suffix='.png')
+        with open(_png, 'wb') as fh:
+            fh.write(b'\x89PNG spam')
+
+        first = InlineImage.from_file(_png, 'image/png', 'logo.png', 'cid0')
+        for index in range(1, parts.INLINE_IMAGE_CACHE_SIZE + 1):
+            InlineImage.from_file(_png, 'image/png', 'logo.png',
+                                  'cid%d' % index)
+
+        assert len(parts._inline_image_cache) == parts.INLINE_IMAGE_CACHE_SIZE
+        assert InlineImage.from_file(_png, 'image/png', 'logo.png',
+                                     'cid0') is not first
+        InlineImage.clear_cache()
+
+    def test_add_inline_image_without_html(self):
+        _png = self._tempfile(suffix='.png')
+
+        envelope = Envelope(text_body='spam')
+        envelope.add_inline_image(_png, content_id='logo')
+
+        mime_msg_parts = [part for part in envelope.to_mime_message().walk()]
+        assert [part.get_content_type() for part in mime_msg_parts] == [
+            'multipart/alternative', 'text/plain', 'image/png'
+        ]
+
+    def test_slots(self):
+        envelope = Envelope(**self._dummy_message())
+        assert not hasattr(envelope, '__dict__')
+
+        envelope = Envelope(to_addr='to@example.com')
+        assert envelope._cc is None
+        assert envelope._bcc is None
+        assert envelope._headers is None
+
+        mime_msg = envelope.to_mime_message()
+        assert 'CC' not in mime_msg
+
+    def test_to_dict(self):
+        msg = self._dummy_message()
+        envelope = Envelope(**msg)
+
+        data = envelope.to_dict()
+        assert data['to_addr'] == [msg['to_addr']]
+        assert data['from_addr'] == msg['from_addr']
+        assert data['cc_addr'] == msg['cc_addr']
+        assert data['bcc_addr'] == msg['bcc_addr']
+        assert data['headers'] == msg['headers']
+        assert data['parts'][0] == {
+            'mimetype': 'text/plain',
+            'body': msg['text_body'],
+            'charset': msg['charset'],
+            'encoding': None
+        }
+
+    def test_from_dict(self):
+        msg = self._dummy_message()
+        envelope = Envelope(**msg)
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(b'\x00spam')
+        envelope.add_attachment(_bin)
+
+        data = envelope.to_dict()
+        assert data['parts'][2]['data'] == b'\x00spam'
+
+        new_envelope = Envelope.from_dict(data)
+        assert new_envelope.to_dict() == data
+        assert new_envelope._parts[2][1].data == b'\x00spam'
+
+        data['to_addr'] = [['to@example.com', 'Example To']]
+        assert Envelope.from_dict(data)._to == [msg['to_addr']]
+
+    def test_from_dict_attachment_path(self):
+        envelope = Envelope(**self._dummy_message())
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(b'spam')
+        envelope.add_attachment(_bin)
+
+        data = envelope.to_dict(embed_attachments=False)
+        assert 'data' not in data['parts'][2]
+        assert data['parts'][2]['path'] == os.path.abspath(_bin)
+
+        new_envelope = Envelope.from_dict(data)
+        assert new_envelope._parts[2][1].data == b'spam'
+
+    def test_to_bytes(self):
+        msg = self._dummy_message()
+        envelope = Envelope(**msg)
+
+        new_envelope = Envelope.from_bytes(envelope.to_bytes())
+        assert new_envelope.to_dict() == envelope.to_dict()
+        assert new_envelope._to == [msg['to_addr']]
+
     def test_repr(self):
         msg = self._dummy_message()
         envelope = Envelope(**msg)
@@ -397,3 +635,22 @@ class Test_Envelope(BaseTestCase):
             u"""to="Example To <to@example.com>" """
             u"""subject="I'm a helicopter!">"""
         )
+
+    def test_validate_addresses(self):
+        envelope = Envelope(
+            from_addr=('From@EXAMPLE.com', 'From'),
+            to_addr=[u'To <to@Bücher.de>', 'bad'],
+            cc_addr=['"cc"@example.com'],
+            bcc_addr=['bcc@example..com']
+        )
+
+        errors = envelope.validate_addresses()
+        assert [exc.addr for exc in errors] == ['bad', 'bcc@example..com']
+        assert envelope.to_addr[0] == u'To <to@Bücher.de>'
+
+        errors = envelope.validate_addresses(normalize=True)
+        assert len(errors) == 2
+        assert envelope.from_addr == ('From@example.com', 'From')
+        assert envelope.to_addr == [('to@xn--bcher-kva.de', 'To'), 'bad']
+        assert envelope.cc_addr == ['cc@example.com']
+        assert envelope.bcc_addr == ['bcc@example..com']
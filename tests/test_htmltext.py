@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_htmltext
+=============
+
+This module contains test suite for the *envelopes.htmltext* module.
+"""
+
+from envelopes.htmltext import html_to_text
+from lib.testing import HTML_BODY, TEXT_BODY
+
+
+class Test_HTMLToText(object):
+    def test_html_to_text(self):
+        assert html_to_text(HTML_BODY) == TEXT_BODY
+
+    def test_blocks(self):
+        html = (
+            u'<h1>Spam &amp; eggs</h1><p>First   paragraph\n'
+            u'continues.<br>Second&nbsp;line</p>'
+            u'<ul><li>spam</li><li>eggs</li></ul>'
+            u'<pre>a\n  b</pre>'
+        )
+        assert html_to_text(html) == (
+            u'Spam & eggs\n'
+            u'\n'
+            u'First paragraph continues.\n'
+            u'Second line\n'
+            u'\n'
+            u'* spam\n'
+            u'* eggs\n'
+            u'\n'
+            u'a\n'
+            u'  b'
+        )
+
+    def test_skipped_tags(self):
+        html = (
+            u'<html><head><title>Spam</title><style>p {}</style></head>'
+            u'<body><script>var eggs;</script><p>Ham</p></body></html>'
+        )
+        assert html_to_text(html) == u'Ham'
+
+    def test_links_and_images(self):
+        html = (
+            u'<p><a href="http://example.com/">Example</a> '
+            u'<a href="http://example.com/">http://example.com/</a> '
+            u'<img src="cid:logo" alt="Logo"></p>'
+        )
+        assert html_to_text(html) == (
+            u'Example (http://example.com/) http://example.com/ Logo'
+        )
+
+    def test_memoized(self):
+        html = u'<p>%s</p>' % (u'spam ' * 100)
+        assert html_to_text(html) is html_to_text(html)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+import json
+import os
+import subprocess
+import sys
+
+import envelopes
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which must not be loaded just by importing the package and creating
+# an envelope.
+DEFERRED_MODULES = [
+    'smtplib', 'socket', 'ssl', 'email.charset', 'email.header',
+    'email.mime.multipart', 'email.mime.text', 'mimetypes', 'html.parser',
+    'tempfile', 'envelopes.conn', 'envelopes.serializer', 'envelopes.mx',
+    'envelopes.router'
+]
+
+SCRIPT = """
+import json, sys
+before = set(sys.modules)
+import envelopes
+from envelopes import Envelope
+Envelope(from_addr='from@example.com', to_addr='to@example.com',
+         subject='Subject', text_body='Body')
+print(json.dumps(sorted(set(sys.modules) - before)))
+"""
+
+SUBMODULES_SCRIPT = """
+import json
+import envelopes
+result = [envelopes.conn.__name__, envelopes.envelope.__name__]
+try:
+    envelopes.does_not_exist
+except AttributeError:
+    result.append(None)
+print(json.dumps(result))
+"""
+
+
+class Test_LazyImports(object):
+    def _run(self, script):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=ROOT_PATH)
+        return json.loads(output.decode('utf-8'))
+
+    def test_deferred_modules(self):
+        if sys.version_info < (3, 7):
+            # The package imports everything eagerly without PEP 562.
+            return
+
+        modules = self._run(SCRIPT)
+
+        loaded = [name for name in DEFERRED_MODULES if name in modules]
+        assert loaded == [], 'Loaded eagerly: %s' % ', '.join(loaded)
+
+    def test_submodules(self):
+        assert self._run(SUBMODULES_SCRIPT) == [
+            'envelopes.conn', 'envelopes.envelope', None
+        ]
+
+    def test_lazy_attributes(self):
+        from envelopes.conn import SMTP
+        from envelopes.envelope import Envelope
+
+        assert envelopes.SMTP is SMTP
+        assert envelopes.Envelope is Envelope
+        assert 'Router' in dir(envelopes)
+        assert 'MXDeliverySMTP' in envelopes.__all__
+
+        try:
+            envelopes.DoesNotExist
+        except AttributeError:
+            pass
+        else:
+            assert False, "AttributeError not raised"
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_keepalive
+==============
+
+This module contains test suite for the *ConnectionMaintainer* class.
+"""
+
+import gc
+import smtplib
+import threading
+import time
+
+from envelopes.conn import SMTP
+from envelopes.keepalive import ConnectionMaintainer
+from lib.testing import BaseTestCase
+
+
+class Test_ConnectionMaintainer(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+
+    def _idle_connection(self, idle):
+        conn = SMTP('localhost')
+        conn._connect()
+        conn._last_used -= idle
+        return conn
+
+    def test_fresh(self):
+        conn = self._idle_connection(0)
+        old_conn = conn._conn
+
+        maintainer = ConnectionMaintainer(max_idle=240, keepalive=30)
+        maintainer.register(conn)
+        maintainer.maintain()
+
+        assert conn._conn is old_conn
+        assert 'noop' not in conn._conn.call_counts
+        assert maintainer.stats()['open'] == 1
+
+    def test_recycle(self):
+        conn = self._idle_connection(300)
+        old_conn = conn._conn
+
+        maintainer = ConnectionMaintainer(max_idle=240)
+        maintainer.register(conn)
+        maintainer.maintain()
+
+        assert old_conn.call_counts['quit'] == 1
+        assert conn._conn is not None
+        assert conn._conn is not old_conn
+        assert conn.idle_time < 240
+
+        stats = maintainer.stats()
+        assert stats['recycled'] == 1
+        assert stats['prewarmed'] == 1
+        assert stats['open'] == 1
+        assert stats['connections'] == 1
+
+    def test_recycle_no_prewarm(self):
+        conn = self._idle_connection(300)
+
+        maintainer = ConnectionMaintainer(max_idle=240, prewarm=False)
+        maintainer.register(conn)
+        maintainer.maintain()
+
+        assert conn._conn is None
+        assert conn.idle_time is None
+        assert maintainer.stats()['open'] == 0
+        assert maintainer.stats()['prewarmed'] == 0
+
+    def test_keepalive(self):
+        conn = self._idle_connection(60)
+        old_conn = conn._conn
+
+        maintainer = ConnectionMaintainer(max_idle=None, keepalive=30)
+        maintainer.register(conn)
+        maintainer.maintain()
+        maintainer.maintain()
+
+        assert conn._conn is old_conn
+        assert old_conn.call_counts['noop'] == 1
+        assert maintainer.stats()['keepalives'] == 1
+
+    def test_keepalive_timeout(self):
+        conn = SMTP('localhost', command_timeout=5, data_timeout=60)
+        conn._connect()
+        conn._last_used -= 60
+        conn._conn.sock.settimeout(60)
+
+        timeouts = []
+        noop = conn._conn.noop
+
+        def timed_noop():
+            timeouts.append(conn._conn.sock.gettimeout())
+            return noop()
+        conn._conn.noop = timed_noop
+
+        maintainer = ConnectionMaintainer(max_idle=None, keepalive=30)
+        maintainer.register(conn)
+        maintainer.maintain()
+
+        assert timeouts == [5]
+
+    def test_keepalive_dead(self):
+        conn = self._idle_connection(60)
+        old_conn = conn._conn
+
+        def noop():
+            raise smtplib.SMTPServerDisconnected('Connection closed')
+        old_conn.noop = noop
+
+        maintainer = ConnectionMaintainer(max_idle=None, keepalive=30)
+        maintainer.register(conn)
+        maintainer.maintain()
+
+        assert conn._conn is not old_conn
+        stats = maintainer.stats()
+        assert stats['dead'] == 1
+        assert stats['prewarmed'] == 1
+
+    def test_busy(self):
+        conn = self._idle_connection(300)
+        maintainer = ConnectionMaintainer(max_idle=240)
+        maintainer.register(conn)
+
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            with conn._lock:
+                locked.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+        try:
+            maintainer.maintain()
+        finally:
+            release.set()
+            thread.join()
+
+        assert maintainer.stats()['busy'] == 1
+        assert maintainer.stats()['recycled'] == 0
+
+    def test_weak_references(self):
+        maintainer = ConnectionMaintainer()
+        conn = self._idle_connection(0)
+        maintainer.register(conn)
+        assert maintainer.connections == [conn]
+
+        maintainer.unregister(conn)
+        assert maintainer.connections == []
+
+        maintainer.register(conn)
+        del conn
+        gc.collect()
+        assert maintainer.connections == []
+
+    def test_thread(self):
+        conn = self._idle_connection(300)
+        maintainer = ConnectionMaintainer(max_idle=240, interval=0.01)
+        maintainer.register(conn)
+
+        maintainer.start()
+        try:
+            for _ in range(100):
+                if maintainer.stats()['recycled']:
+                    break
+                time.sleep(0.01)
+        finally:
+            maintainer.stop()
+
+        assert maintainer.stats()['recycled'] == 1
+        assert maintainer._thread is None
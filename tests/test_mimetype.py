@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+from envelopes.envelope import Envelope
+from envelopes.mimetype import guess_mimetype, sniff_mimetype
+from lib.testing import BaseTestCase
+
+
+class Test_MimeType(BaseTestCase):
+    def _file(self, data, suffix=''):
+        path = self._tempfile(suffix=suffix)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_extension(self):
+        assert guess_mimetype('/tmp/photo.JPG') == 'image/jpeg'
+        assert guess_mimetype('report.pdf') == 'application/pdf'
+        assert guess_mimetype('sheet.xlsx') == (
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+    def test_sniff(self):
+        assert sniff_mimetype(b'\x89PNG\r\n\x1a\n\x00\x00') == 'image/png'
+        assert sniff_mimetype(b'%PDF-1.4') == 'application/pdf'
+        assert sniff_mimetype(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+        assert sniff_mimetype(b'\x00\x00\x00\x18ftypmp42') == 'video/mp4'
+        assert sniff_mimetype(b'\x00' * 257 + b'ustar\x0000') == 'application/x-tar'
+        assert sniff_mimetype(b'spam and eggs') is None
+        assert sniff_mimetype(b'') is None
+
+    def test_guess_sniffs_unknown_files(self):
+        path = self._file(b'GIF89a\x01\x00')
+        assert guess_mimetype(path) == 'image/gif'
+        assert guess_mimetype(path, sniff=False) is None
+
+        # Extension wins over contents.
+        assert guess_mimetype(self._file(b'GIF89a', suffix='.txt')) == 'text/plain'
+        assert guess_mimetype('/does/not/exist') is None
+
+    def test_system_database(self):
+        path = self._file(b'', suffix='.dvi')
+        assert guess_mimetype(path) is None
+        assert guess_mimetype(path, system_database=True) == 'application/x-dvi'
+
+    def test_add_attachment(self):
+        envelope = Envelope(to_addr='to@example.com', text_body='Body')
+        envelope.add_attachment(self._file(b'%PDF-1.4\n'))
+        envelope.add_attachment(self._file(b'', suffix='.dvi'))
+        assert envelope._parts[1][0] == 'application/pdf'
+        assert envelope._parts[2][0] == 'application/octet-stream'
+
+        Envelope.MIMETYPE_SYSTEM_DATABASE = True
+        try:
+            envelope.add_attachment(self._file(b'', suffix='.dvi'))
+        finally:
+            Envelope.MIMETYPE_SYSTEM_DATABASE = False
+        assert envelope._parts[3][0] == 'application/x-dvi'
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+import smtplib
+import socket
+import threading
+
+from envelopes.envelope import Envelope
+from envelopes.mx import MXDeliverySMTP, StaticResolver
+from lib.testing import BaseTestCase, MockSMTP
+
+
+class FailingMockSMTP(MockSMTP):
+    """MockSMTP failing for hosts starting with ``down``, ``reject`` or
+    ``broken``."""
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=[],
+                 rcpt_options=[]):
+        if self._host.startswith('down'):
+            raise socket.error('Connection refused')
+        if self._host.startswith('reject'):
+            raise smtplib.SMTPSenderRefused(550, b'Go away', from_addr)
+        if self._host.startswith('broken'):
+            raise ValueError('Unexpected failure')
+
+        return MockSMTP.sendmail(self, from_addr, to_addrs, msg,
+                                 mail_options, rcpt_options)
+
+
+class CountingResolver(StaticResolver):
+    def __init__(self, *args, **kwargs):
+        StaticResolver.__init__(self, *args, **kwargs)
+        self.queries = []
+
+    def resolve(self, domain):
+        self.queries.append(domain)
+        return StaticResolver.resolve(self, domain)
+
+
+class Test_StaticResolver(object):
+    def test_resolve(self):
+        resolver = StaticResolver({
+            'Example.com': [(20, 'mx2.example.com'), (10, 'mx1.example.com')],
+            'example.org': ['mx.example.org']
+        }, ttl=60)
+
+        assert resolver.resolve('example.com') == (
+            ['mx1.example.com', 'mx2.example.com'], 60
+        )
+        assert resolver.resolve('example.org') == (['mx.example.org'], 60)
+        assert resolver.resolve('example.net') == (['example.net'], 60)
+
+
+class Test_MXDeliverySMTP(BaseTestCase):
+    def setUp(self):
+        self._orig_smtp = smtplib.SMTP
+        smtplib.SMTP = FailingMockSMTP
+
+    def _envelope(self):
+        return Envelope(
+            from_addr='from@example.com',
+            to_addr=['to1@example.com', 'to@example.org'],
+            cc_addr=['To 2 <to2@example.com>'],
+            bcc_addr=['bcc@example.net'],
+            subject="I'm a helicopter!",
+            text_body="I'm a helicopter!"
+        )
+
+    def _sent(self, transport):
+        sent = {}
+        for host, idle in transport._pools.items():
+            for conn in idle:
+                for args, _ in conn._conn._call_stack.get('sendmail', []):
+                    sent.setdefault(host, []).append(args)
+
+        return sent
+
+    def test_send(self):
+        transport = MXDeliverySMTP(StaticResolver({
+            'example.com': ['mx.example.com'],
+            'example.org': ['mx.example.org']
+        }))
+
+        assert transport.send(self._envelope()) == {}
+
+        sent = self._sent(transport)
+        assert sorted(sent.keys()) == [
+            'example.net', 'mx.example.com', 'mx.example.org'
+        ]
+        assert sent['mx.example.com'][0][1] == [
+            'to1@example.com', 'To 2 <to2@example.com>'
+        ]
+        assert sent['mx.example.org'][0][1] == ['to@example.org']
+        assert sent['mx.example.org'][0][2] == sent['mx.example.com'][0][2]
+
+    def test_failover(self):
+        transport = MXDeliverySMTP(StaticResolver({
+            'example.com': [(10, 'down.example.com'), (20, 'mx.example.com')],
+            'example.org': ['reject.example.org', 'mx.example.org'],
+            'example.net': ['down.example.net']
+        }), max_workers=1)
+
+        refused = transport.send(self._envelope())
+        assert refused == {
+            'to@example.org': (550, b'Go away'),
+            'bcc@example.net': (-1, 'Connection refused')
+        }
+        assert list(self._sent(transport).keys()) == ['mx.example.com']
+
+    def test_all_refused(self):
+        transport = MXDeliverySMTP(StaticResolver({}, ttl=60))
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr='to@down.example.com')
+
+        try:
+            transport.send(envelope)
+        except smtplib.SMTPRecipientsRefused as exc:
+            assert list(exc.recipients.keys()) == ['to@down.example.com']
+        else:
+            assert False, "SMTPRecipientsRefused not raised"
+
+    def test_mx_cache(self):
+        resolver = CountingResolver({'example.com': ['mx.example.com']})
+        transport = MXDeliverySMTP(resolver, max_ttl=3600)
+
+        assert transport.mx_hosts('example.com') == ['mx.example.com']
+        assert transport.mx_hosts('example.com') == ['mx.example.com']
+        assert resolver.queries == ['example.com']
+
+        transport._cache['example.com'] = (0, ['stale.example.com'])
+        assert transport.mx_hosts('example.com') == ['mx.example.com']
+        assert resolver.queries == ['example.com', 'example.com']
+
+        transport.clear_cache()
+        transport.mx_hosts('example.com')
+        assert len(resolver.queries) == 3
+
+    def test_pool(self):
+        transport = MXDeliverySMTP(StaticResolver({}), pool_size=1)
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr='to@example.com')
+
+        transport.send(envelope)
+        conn = transport._pools['example.com'][0]
+        transport.send(envelope)
+        assert transport._pools['example.com'] == [conn]
+        assert len(conn._conn._call_stack['sendmail']) == 2
+
+        transport.close()
+        assert transport._pools == {}
+        assert len(conn._conn._call_stack['quit']) == 1
+
+    def test_unexpected_error(self):
+        transport = MXDeliverySMTP(StaticResolver({
+            'example.com': ['broken.example.com'],
+            'example.org': ['mx.example.org']
+        }))
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr=['to@example.com', 'to@example.org'])
+
+        assert transport.send(envelope) == {
+            'to@example.com': (-1, 'Unexpected failure')
+        }
+
+    def test_send_threads(self):
+        transport = MXDeliverySMTP(StaticResolver({}), max_workers=1)
+        errors = []
+
+        def send():
+            try:
+                for _ in range(25):
+                    transport.send(self._envelope())
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
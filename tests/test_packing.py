@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_packing
+============
+
+This module contains test suite for the *envelopes.packing* module.
+"""
+
+from envelopes.packing import PackingError, pack, unpack
+
+
+class Test_Packing(object):
+    def test_round_trip(self):
+        value = {
+            u'none': None,
+            u'bools': [True, False],
+            u'ints': [0, -1, 2 ** 40],
+            u'unicode': u'ęóąśłżźćń',
+            u'bytes': b'\x00\xff' * 200,
+            u'tuple': (u'to@example.com', u'Example To'),
+            u'nested': {u'list': [[], {}, ()]}
+        }
+
+        assert unpack(pack(value)) == value
+        assert isinstance(unpack(pack(value))[u'tuple'], tuple)
+
+    def test_compact(self):
+        assert len(pack(u'spam')) == 7
+        assert len(pack([None] * 127)) == 130
+
+    def test_pack_unsupported(self):
+        try:
+            pack(object())
+        except PackingError:
+            pass
+        else:
+            assert False, "PackingError not raised"
+
+    def test_unpack_malformed(self):
+        data = pack([u'spam', u'eggs'])
+
+        for bad_data in (data[:-1], data + b'\x00', b'\x02' + data[1:],
+                         data[:1] + b'\xff'):
+            try:
+                unpack(bad_data)
+            except PackingError:
+                pass
+            else:
+                assert False, "PackingError not raised for %r" % bad_data
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_profiling
+==============
+
+This module contains test suite for the *envelopes.profiling* module.
+"""
+
+from envelopes.conn import SMTP, NullSMTP
+from envelopes.envelope import Envelope
+from envelopes.profiling import SendProfile, active_profile, phase, profile
+from lib.testing import BaseTestCase
+
+
+class Test_Profile(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+
+    def tearDown(self):
+        self._unpatch_smtplib()
+
+    def _names(self, report):
+        return [timing.name for timing in report.phases]
+
+    def test_phase_inactive(self):
+        assert active_profile() is None
+        with phase('render'):
+            pass
+
+    def test_nested(self):
+        with profile() as outer:
+            with profile() as inner:
+                assert active_profile() is inner
+                with phase('render'):
+                    pass
+            assert active_profile() is outer
+
+        assert active_profile() is None
+        assert self._names(inner) == ['render']
+        assert outer.phases == []
+
+    def test_smtp_phases(self):
+        envelope = Envelope(**self._dummy_message())
+        conn = SMTP('localhost', tls=True, login='spam', password='eggs')
+
+        with profile() as report:
+            conn.send(envelope)
+
+        assert isinstance(report, SendProfile)
+        assert self._names(report) == [
+            'connect', 'tls', 'login', 'render', 'serialize', 'transmit'
+        ]
+        assert all(timing.duration >= 0 for timing in report.phases)
+        assert all(timing.allocations is None and timing.memory is None
+                   for timing in report.phases)
+        assert report.total == sum(report.durations().values())
+
+    def test_stream_phases(self):
+        envelope = Envelope(**self._dummy_message())
+        conn = SMTP('localhost', stream=True)
+
+        with profile() as report:
+            conn.send(envelope)
+
+        assert self._names(report) == ['connect', 'render', 'transmit']
+
+    def test_null_smtp_phases(self):
+        with profile() as report:
+            NullSMTP().send(Envelope(**self._dummy_message()))
+
+        assert self._names(report) == ['render', 'serialize', 'transmit']
+
+    def test_trace_allocations(self):
+        with profile(trace_allocations=True) as report:
+            NullSMTP().send(Envelope(**self._dummy_message()))
+
+        for timing in report.phases:
+            assert isinstance(timing.allocations, int)
+            assert timing.memory is not None
+            assert timing.memory_peak >= 0
+
+        data = report.as_dict()
+        assert data['total'] == report.total
+        assert data['phases'][0]['name'] == 'render'
+
+    def test_envelope_send(self):
+        envelope = Envelope(**self._dummy_message())
+
+        result = envelope.send('localhost', profile=True)
+        assert len(result) == 3
+        assert 'transmit' in result[2].durations()
+
+        assert len(envelope.send('localhost')) == 2
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+import smtplib
+import threading
+
+from envelopes.conn import SMTP, NullSMTP
+from envelopes.envelope import Envelope
+from envelopes.router import Router, NoRouteException
+from lib.testing import BaseTestCase
+
+
+class Test_Router(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+
+    def _envelope(self):
+        return Envelope(
+            from_addr='from@example.com',
+            to_addr=['to@example.com', ('to@mail.example.com', 'Sub')],
+            cc_addr=['Tenant <cc@tenant.com>', 'cc@deep.mail.example.com'],
+            bcc_addr=['bcc@other.org'],
+            subject="I'm a helicopter!",
+            text_body="I'm a helicopter!"
+        )
+
+    def _sent(self, conn):
+        return conn._conn._call_stack.get('sendmail', [])
+
+    def test_route(self):
+        internal = SMTP('internal')
+        subdomains = SMTP('subdomains')
+        deep = SMTP('deep')
+        default = SMTP('default')
+        router = Router({
+            'example.com': internal,
+            '.example.com': subdomains,
+            '.mail.example.com': deep
+        }, default=default)
+
+        assert router.route('to@example.com') is internal
+        assert router.route('to@EXAMPLE.com.') is internal
+        assert router.route('to@mail.example.com') is subdomains
+        assert router.route('to@x.mail.example.com') is deep
+        assert router.route(('to@www.example.com', 'To')) is subdomains
+        assert router.route('To <to@example.org>') is default
+        assert router.route('to@com') is default
+
+    def test_no_route(self):
+        router = Router({'example.com': SMTP('internal')})
+        try:
+            router.route('to@example.org')
+        except NoRouteException as exc:
+            assert exc.addr == 'to@example.org'
+        else:
+            assert False, "NoRouteException not raised"
+
+    def test_send(self):
+        internal = SMTP('internal')
+        pool = [SMTP('relay1'), SMTP('relay2')]
+        default = SMTP('default')
+        router = Router([
+            ('example.com', internal),
+            ('.example.com', internal),
+            ('tenant.com', pool)
+        ], default=default)
+
+        envelope = self._envelope()
+        assert router.send(envelope) == {}
+
+        assert len(self._sent(internal)) == 1
+        internal_args = self._sent(internal)[0][0]
+        assert internal_args[0] == 'from@example.com'
+        assert internal_args[1] == [
+            'to@example.com', 'Sub <to@mail.example.com>',
+            'cc@deep.mail.example.com'
+        ]
+
+        assert len(self._sent(default)) == 1
+        default_args = self._sent(default)[0][0]
+        assert default_args[1] == ['bcc@other.org']
+        assert default_args[2] == internal_args[2]
+
+        assert len(self._sent(pool[0])) == 1
+        assert pool[0]._conn is not None and pool[1]._conn is None
+
+        router.send(envelope)
+        assert len(self._sent(pool[1])) == 1
+
+    def _refusing(self, conn):
+        def send_rendered(from_addr, to_addrs, msg):
+            raise smtplib.SMTPRecipientsRefused(
+                dict((addr, (550, b'No such user')) for addr in to_addrs)
+            )
+        conn.send_rendered = send_rendered
+        return conn
+
+    def test_send_refused_group(self):
+        default = SMTP('default')
+        router = Router({'example.com': self._refusing(SMTP('internal'))},
+                        default=default)
+
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr=['to@example.com', 'to@example.org'])
+        assert router.send(envelope) == {
+            'to@example.com': (550, b'No such user')
+        }
+        assert len(self._sent(default)) == 1
+
+    def test_send_all_refused(self):
+        router = Router(default=self._refusing(SMTP('default')))
+
+        try:
+            router.send(self._envelope())
+        except smtplib.SMTPRecipientsRefused as exc:
+            assert len(exc.recipients) == 5
+        else:
+            assert False, "SMTPRecipientsRefused not raised"
+
+    def test_send_threads(self):
+        target = NullSMTP()
+        router = Router(default=target)
+        errors = []
+
+        def send():
+            try:
+                for _ in range(50):
+                    router.send(self._envelope())
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert target.messages == 200
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_serializer
+===============
+
+This module contains test suite for the *MessageSerializer* class.
+"""
+
+import email
+import os
+
+from envelopes.envelope import Envelope, MessageEncodeError
+from envelopes.serializer import _fold_header, MessageSerializer, StreamingSerializer
+from lib.testing import BaseTestCase
+
+
+class Test_MessageSerializer(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+
+    def _parse(self, view):
+        return email.message_from_bytes(view.tobytes())
+
+    def test_serialize(self):
+        msg = self._dummy_message()
+        envelope = Envelope(**msg)
+
+        raw = MessageSerializer().serialize(envelope).tobytes()
+        assert b'\r\n' in raw
+        assert b'\n' not in raw.replace(b'\r\n', b'')
+
+        mime_msg = email.message_from_bytes(raw)
+        ok_msg = envelope.to_mime_message()
+        for key in ('Subject', 'From', 'To', 'CC', 'Reply-To', 'X-Mailer'):
+            assert mime_msg[key].replace('\r\n', '') == ok_msg[key]
+        assert 'BCC' not in mime_msg
+        assert mime_msg.get_content_type() == 'multipart/alternative'
+
+        mime_msg_parts = [part for part in mime_msg.walk()]
+        assert len(mime_msg_parts) == 3
+        text_part, html_part = mime_msg_parts[1:]
+
+        assert text_part.get_content_type() == 'text/plain'
+        assert text_part.get_payload(decode=True) == msg['text_body'].encode('utf-8')
+
+        assert html_part.get_content_type() == 'text/html'
+        assert html_part.get_payload(decode=True) == msg['html_body'].encode('utf-8')
+
+    def test_boundary_in_body(self):
+        serializer = MessageSerializer()
+        boundary = serializer._boundaries[0].decode('ascii')
+
+        envelope = Envelope(
+            to_addr='to@example.com',
+            from_addr='from@example.com',
+            subject='Boundary',
+            charset='us-ascii',
+            text_body='--%s\nContent-Type: text/html\n\n<b>Hi</b>' % boundary
+        )
+
+        mime_msg = self._parse(serializer.serialize(envelope))
+        parts = [part.get_content_type() for part in mime_msg.walk()]
+        assert parts == ['multipart/alternative', 'text/plain']
+        assert serializer._boundaries[0].decode('ascii') != boundary
+
+    def test_fold_headers(self):
+        recipients = ['rcpt%d@example.com' % index for index in range(100)]
+        envelope = Envelope(
+            to_addr=recipients,
+            from_addr='from@example.com',
+            subject='Folded',
+            text_body='Body'
+        )
+
+        raw = MessageSerializer().serialize(envelope).tobytes()
+        headers = raw[:raw.index(b'\r\n\r\n')].split(b'\r\n')
+        assert max(len(line) for line in headers) <= 78
+
+        mime_msg = email.message_from_bytes(raw)
+        assert mime_msg['To'].replace('\r\n ', '') == ','.join(recipients)
+
+    def test_fold_long_word(self):
+        line = _fold_header('X-Token: ' + 'x' * 2000)
+        assert max(len(part) for part in line.split('\r\n')) == 998
+        assert line.replace('\r\n', '').replace(' ', '') == (
+            'X-Token:' + 'x' * 2000
+        )
+
+    def test_fold_address_list(self):
+        line = _fold_header('To: "Doe, John" <john@example.com>,' +
+                            ','.join(['rcpt@example.com'] * 5), True)
+        assert line.split('\r\n') == [
+            'To: "Doe, John" <john@example.com>,rcpt@example.com,rcpt@example.com,',
+            ' rcpt@example.com,rcpt@example.com,rcpt@example.com'
+        ]
+
+    def test_header_injection(self):
+        for kwargs in ({'headers': {'X-A': 'a\nBcc: evil@example.com'}},
+                       {'headers': {'X-A': 'a\rBcc: evil@example.com'}},
+                       {'subject': 'Hi\nBcc: evil@example.com'},
+                       {'to_addr': ('to@example.com',
+                                    'To\nBcc: evil@example.com')}):
+            message = self._dummy_message()
+            message.update(kwargs)
+            try:
+                MessageSerializer().serialize(Envelope(**message))
+            except MessageEncodeError:
+                pass
+            else:
+                assert False, "MessageEncodeError not raised: %r" % kwargs
+
+    def test_folded_header(self):
+        message = self._dummy_message()
+        message['subject'] = u'Zażółć gęślą jaźń ' * 5
+        raw = MessageSerializer().serialize(Envelope(**message)).tobytes()
+        assert b'\r\n ' in raw.split(b'\r\n\r\n', 1)[0]
+
+    def test_serialize_unicode(self):
+        envelope = Envelope(
+            to_addr=('to@example.com', u'ęóąśłżźćń'),
+            from_addr='from@example.com',
+            subject=u'ęóąśłżźćń',
+            text_body=u'ęóąśłżźćń\n.line'
+        )
+
+        mime_msg = self._parse(MessageSerializer().serialize(envelope))
+        assert mime_msg['Subject'] == envelope.to_mime_message()['Subject']
+        assert mime_msg['To'] == envelope.to_mime_message()['To']
+
+        text_part = [part for part in mime_msg.walk()][1]
+        assert text_part.get_payload(decode=True) ==\
+            u'ęóąśłżźćń\n.line'.encode('utf-8')
+
+    def test_serialize_quoted_printable(self):
+        envelope = Envelope(text_body=u'ęóąśłżźćń', charset='iso-8859-2')
+
+        mime_msg = self._parse(MessageSerializer().serialize(envelope))
+        text_part = [part for part in mime_msg.walk()][1]
+        assert text_part['Content-Transfer-Encoding'] == 'quoted-printable'
+        assert text_part.get_payload(decode=True) ==\
+            u'ęóąśłżźćń'.encode('iso-8859-2')
+
+    def test_serialize_attachment(self):
+        envelope = Envelope(**self._dummy_message())
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(os.urandom(100000))
+        envelope.add_attachment(_bin)
+
+        mime_msg = self._parse(MessageSerializer().serialize(envelope))
+        mime_msg_parts = [part for part in mime_msg.walk()]
+        assert len(mime_msg_parts) == 4
+
+        with open(_bin, 'rb') as fh:
+            assert mime_msg_parts[3].get_payload(decode=True) == fh.read()
+        assert mime_msg_parts[3]['Content-Disposition'] ==\
+            'attachment; filename="%s"' % os.path.basename(_bin)
+
+    def test_serialize_mmap_attachment(self):
+        envelope = Envelope(**self._dummy_message())
+
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(os.urandom(100000))
+        envelope.add_attachment(_bin, use_mmap=True)
+
+        mime_msg = self._parse(MessageSerializer().serialize(envelope))
+        mime_msg_parts = [part for part in mime_msg.walk()]
+        with open(_bin, 'rb') as fh:
+            assert mime_msg_parts[3].get_payload(decode=True) == fh.read()
+
+    def test_serialize_inline_image(self):
+        _png = self._tempfile(suffix='.png')
+        with open(_png, 'wb') as fh:
+            fh.write(b'\x89PNG spam')
+
+        envelope = Envelope(**self._dummy_message())
+        content_id = envelope.add_inline_image(_png)
+
+        mime_msg = self._parse(MessageSerializer().serialize(envelope))
+        mime_msg_parts = [part for part in mime_msg.walk()]
+        assert [part.get_content_type() for part in mime_msg_parts] == [
+            'multipart/alternative', 'text/plain', 'multipart/related',
+            'text/html', 'image/png'
+        ]
+        assert mime_msg_parts[2].get_param('type') == 'text/html'
+        assert mime_msg_parts[4]['Content-ID'] == '<%s>' % content_id
+        assert mime_msg_parts[4]['Content-Disposition'] ==\
+            'inline; filename="%s"' % os.path.basename(_png)
+        assert mime_msg_parts[4].get_payload(decode=True) == b'\x89PNG spam'
+
+    def test_serialize_reuses_buffer(self):
+        serializer = MessageSerializer(size_hint=16)
+        envelope = Envelope(**self._dummy_message())
+
+        view = serializer.serialize(envelope)
+        raw = view.tobytes()
+        buffer = serializer._buffer
+
+        view = serializer.serialize(envelope)
+        assert view.tobytes() == raw
+        assert serializer._buffer is buffer
+
+    def test_serialize_releases_previous_view(self):
+        serializer = MessageSerializer()
+        envelope = Envelope(**self._dummy_message())
+
+        view = serializer.serialize(envelope)
+        serializer.serialize(envelope)
+
+        try:
+            view.tobytes()
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
+
+    def test_reclaim_referenced_buffer(self):
+        # Views can't be released on Python 2.
+        serializer = MessageSerializer()
+        buffer = serializer._buffer
+
+        view = memoryview(buffer)
+        serializer._reclaim_buffer()
+        assert serializer._buffer is not buffer
+        assert len(serializer._buffer) == len(buffer)
+
+        buffer = serializer._buffer
+        view = None
+        serializer._reclaim_buffer()
+        assert serializer._buffer is buffer
+
+
+class Test_StreamingSerializer(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+
+    def test_stream(self):
+        envelope = Envelope(**self._dummy_message())
+        envelope.add_attachment(__file__)
+
+        chunks = []
+        StreamingSerializer(chunk_size=256).stream(
+            envelope, lambda chunk: chunks.append(bytes(chunk))
+        )
+
+        assert len(chunks) > 1
+        assert max(len(chunk) for chunk in chunks) <= 256
+
+        raw = b''.join(chunks)
+        ok_raw = MessageSerializer().serialize(envelope).tobytes()
+        boundary = email.message_from_bytes(raw).get_boundary().encode('ascii')
+        ok_boundary = email.message_from_bytes(ok_raw).get_boundary().encode('ascii')
+        assert raw.replace(boundary, b'') == ok_raw.replace(ok_boundary, b'')
+
+    def test_not_a_message_serializer(self):
+        serializer = StreamingSerializer()
+        assert not isinstance(serializer, MessageSerializer)
+        assert not hasattr(serializer, 'serialize')
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_store
+==========
+
+This module contains test suite for the *AttachmentStore* class.
+"""
+
+import email
+import hashlib
+import os
+import shutil
+import tempfile
+
+from envelopes.envelope import Envelope
+from envelopes.serializer import MessageSerializer
+from envelopes.store import AttachmentStore, AttachmentStoreError
+from lib.testing import BaseTestCase
+
+
+class Test_AttachmentStore(BaseTestCase):
+    def setUp(self):
+        self._store_path = tempfile.mkdtemp()
+        self._store = AttachmentStore(os.path.join(self._store_path, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self._store_path)
+
+    def _blobs(self):
+        blobs = []
+        for root, dirs, files in os.walk(self._store.path):
+            blobs.extend(files)
+        return blobs
+
+    def test_put(self):
+        data = os.urandom(100000)
+
+        digest = self._store.put(data)
+        assert digest == hashlib.sha256(data).hexdigest()
+        assert digest in self._store
+        assert self._store.get(digest) == data
+
+        with self._store.open_encoded(digest) as fh:
+            encoded = fh.read()
+        assert encoded.endswith(b'\r\n')
+        assert max(len(line) for line in encoded.split(b'\r\n')) == 76
+
+    def test_put_deduplicates(self):
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(b'spam' * 100000)
+
+        digest = self._store.put_file(_bin)
+        assert self._store.put_file(_bin) == digest
+        assert self._store.put(b'spam' * 100000) == digest
+        assert self._blobs() == [digest + '.b64']
+
+    def test_get_missing(self):
+        try:
+            self._store.get('0' * 64)
+        except AttachmentStoreError:
+            pass
+        else:
+            assert False, "AttachmentStoreError not raised"
+
+    def test_invalid_digest(self):
+        for digest in ('../' * 21 + 'x', '0' * 63, '0' * 64 + '\n',
+                       'A' * 64, '..', None):
+            assert digest not in self._store
+            try:
+                self._store.get(digest)
+            except AttachmentStoreError:
+                pass
+            else:
+                assert False, "AttachmentStoreError not raised"
+
+    def test_envelope_attachment(self):
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(os.urandom(10000))
+        with open(_bin, 'rb') as fh:
+            data = fh.read()
+
+        envelope = Envelope(**self._dummy_message())
+        envelope.add_attachment(_bin, store=self._store)
+
+        attachment = envelope._parts[2][1]
+        assert attachment.data is None
+        assert attachment.read() == data
+
+        packed = envelope.to_bytes()
+        assert len(packed) < len(data)
+        assert envelope.to_dict()['parts'][2]['sha256'] == attachment.digest
+
+        try:
+            Envelope.from_bytes(packed)
+        except AttachmentStoreError:
+            pass
+        else:
+            assert False, "AttachmentStoreError not raised"
+
+        new_envelope = Envelope.from_bytes(packed, store=self._store)
+        raw = MessageSerializer().serialize(new_envelope).tobytes()
+        mime_msg_parts = [part for part in email.message_from_bytes(raw).walk()]
+        assert mime_msg_parts[3].get_payload(decode=True) == data
+
+        mime_msg_parts = [
+            part for part in new_envelope.to_mime_message().walk()
+        ]
+        assert mime_msg_parts[3].get_payload(decode=True) == data
+
+    def test_mixed_attachments(self):
+        stored = self._tempfile(suffix='.bin')
+        with open(stored, 'wb') as fh:
+            fh.write(b'stored' * 1000)
+        embedded = self._tempfile(suffix='.bin')
+        with open(embedded, 'wb') as fh:
+            fh.write(b'embedded' * 1000)
+
+        envelope = Envelope(**self._dummy_message())
+        envelope.add_attachment(stored, store=self._store)
+        envelope.add_attachment(embedded)
+
+        new_envelope = Envelope.from_bytes(envelope.to_bytes(),
+                                           store=self._store)
+        assert new_envelope._parts[3][1].store is None
+        assert new_envelope.to_dict()['parts'][3]['data'] == b'embedded' * 1000
+
+        for msg in (MessageSerializer().serialize(new_envelope).tobytes(),
+                    new_envelope.to_mime_message().as_bytes()):
+            payloads = [part.get_payload(decode=True)
+                        for part in email.message_from_bytes(msg).walk()]
+            assert payloads[3] == b'stored' * 1000
+            assert payloads[4] == b'embedded' * 1000
+
+    def test_put_file_hashes_written_contents(self):
+        _bin = self._tempfile(suffix='.bin')
+        with open(_bin, 'wb') as fh:
+            fh.write(b'spam' * 100000)
+
+        digest = self._store.put_file(_bin)
+        assert digest == hashlib.sha256(self._store.get(digest)).hexdigest()
+        assert self._blobs() == [digest + '.b64']
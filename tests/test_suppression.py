@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+from envelopes.envelope import Envelope
+from envelopes.suppression import (SuppressionList, SuppressionListError,
+                                   _BloomFilter, address_key)
+from lib.testing import BaseTestCase
+
+
+class Test_SuppressionList(BaseTestCase):
+    def test_contains(self):
+        suppressed = SuppressionList(['Bounced@Example.com', 'bad'])
+        suppressed.add(('unsub@example.com', 'Unsubscribed'))
+
+        assert 'bounced@example.com' in suppressed
+        assert 'Bounced <BOUNCED@EXAMPLE.COM>' in suppressed
+        assert 'unsub@example.com' in suppressed
+        assert 'bad' in suppressed
+        assert 'ok@example.com' not in suppressed
+        assert len(suppressed) == 3
+
+    def test_address_key(self):
+        assert address_key('to@example.com') == address_key(u'TO@example.com.')
+        assert address_key(u'to@bücher.de') == address_key('to@xn--bcher-kva.de')
+        assert address_key('to@example.com') != address_key('to@example.org')
+
+    def test_filter(self):
+        suppressed = SuppressionList(['bounced@example.com'])
+        seen = set()
+
+        assert list(suppressed.filter(
+            ['to@example.com', 'bounced@example.com', 'TO@example.com'], seen
+        )) == ['to@example.com']
+        assert list(suppressed.filter(
+            ['to@example.com', 'cc@example.com'], seen
+        )) == ['cc@example.com']
+
+    def test_save_open(self):
+        path = self._tempfile()
+        addrs = ['user%d@example.com' % i for i in range(1000)]
+        SuppressionList(addrs).save(path)
+
+        for bloom in (True, False):
+            suppressed = SuppressionList.open(path, bloom=bloom)
+            try:
+                assert len(suppressed) == 1000
+                for addr in addrs:
+                    assert addr in suppressed
+                assert 'other@example.com' not in suppressed
+
+                suppressed.add('other@example.com')
+                suppressed.add('user1@example.com')
+                assert 'other@example.com' in suppressed
+                assert len(suppressed) == 1001
+            finally:
+                suppressed.close()
+
+        empty_path = self._tempfile()
+        SuppressionList().save(empty_path)
+        suppressed = SuppressionList.open(empty_path)
+        assert len(suppressed) == 0
+        assert 'to@example.com' not in suppressed
+        suppressed.close()
+
+    def test_open_invalid(self):
+        path = self._tempfile()
+        with open(path, 'wb') as fh:
+            fh.write(b'garbage')
+
+        try:
+            SuppressionList.open(path)
+        except SuppressionListError:
+            pass
+        else:
+            assert False, "SuppressionListError not raised"
+
+    def test_bloom_filter(self):
+        bloom = _BloomFilter(1000)
+        keys = [address_key('user%d@example.com' % i) for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        assert all(key in bloom for key in keys)
+        false_positives = sum(
+            1 for i in range(10000)
+            if address_key('other%d@example.com' % i) in bloom
+        )
+        assert false_positives < 300
+
+    def test_filter_recipients(self):
+        envelope = Envelope(
+            to_addr=['to@example.com', 'bounced@example.com'],
+            cc_addr=['TO@example.com', 'cc@example.com', 'cc@example.com'],
+            bcc_addr=[('unsub@example.com', 'Unsub')]
+        )
+
+        dropped = envelope.filter_recipients(
+            SuppressionList(['bounced@example.com', 'unsub@example.com'])
+        )
+        assert dropped == [
+            'bounced@example.com', 'TO@example.com', 'cc@example.com',
+            ('unsub@example.com', 'Unsub')
+        ]
+        assert envelope.to_addr == ['to@example.com']
+        assert envelope.cc_addr == ['cc@example.com']
+        assert envelope.bcc_addr == []
+
+        assert envelope.filter_recipients() == []
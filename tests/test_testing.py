@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+from envelopes.conn import SMTP
+from envelopes.envelope import Envelope
+from lib.testing import BaseTestCase, MessageLog
+
+
+class Test_MessageLog(object):
+    def _msg(self, subject):
+        return ('Subject: %s\r\nTo: x\r\n\r\nBody\r\n' % subject).encode('utf-8')
+
+    def test_lookups(self):
+        log = MessageLog()
+        log.record('from@example.com', ['To <to@example.com>'], self._msg('A'))
+        log.record('from@example.com', ['TO@example.com', 'cc@example.com'],
+                   self._msg('=?utf-8?q?=C5=BC?='))
+
+        assert len(log) == 2 and log.total == 2
+        assert len(log.to('to@example.com')) == 2
+        assert len(log.to('cc@example.com')) == 1
+        assert log.to('other@example.com') == []
+        assert log.with_subject('A')[0].to_addrs == ['To <to@example.com>']
+        assert len(log.with_subject(u'ż')) == 1
+
+    def test_ring_buffer(self):
+        log = MessageLog(max_messages=3)
+        for i in range(10):
+            log.record('from@example.com', ['to%d@example.com' % (i % 2)],
+                       self._msg('Message %d' % i))
+
+        assert len(log) == 3
+        assert log.total == 10
+        assert [message.msg for message in log] == [
+            self._msg('Message %d' % i) for i in (7, 8, 9)
+        ]
+        assert len(log.to('to0@example.com')) == 1
+        assert len(log.to('to1@example.com')) == 2
+        assert log.with_subject('Message 0') == []
+        assert len(log._by_subject) == 3
+
+        log.clear()
+        assert len(log) == 0 and log.total == 0
+
+
+class Test_MockSMTP(BaseTestCase):
+    def test_bounded_calls(self):
+        self._patch_smtplib(max_calls=5, max_messages=2)
+        conn = SMTP('localhost')
+
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr='to@example.com', subject='Hello',
+                            text_body='Body')
+        for _ in range(20):
+            conn.send(envelope)
+
+        assert len(conn._conn._call_stack['sendmail']) == 5
+        assert conn._conn.call_counts['sendmail'] == 20
+        assert len(conn._conn.messages) == 2
+        assert conn._conn.messages.total == 20
+        assert len(conn._conn.messages.with_subject('Hello')) == 2
+
+    def test_streamed_messages(self):
+        self._patch_smtplib()
+
+        envelope = Envelope(from_addr='from@example.com',
+                            to_addr='to@example.com', subject='Streamed',
+                            text_body=u'.dot\n', text_body_encoding='8bit')
+        for features in ({}, {'chunking': ''}):
+            conn = SMTP('localhost', stream=True)
+            conn._connect()
+            conn._conn.does_esmtp = 1
+            conn._conn.esmtp_features.update(features)
+            conn.send(envelope)
+
+            message = conn._conn.messages.to('to@example.com')[0]
+            assert message.from_addr == 'from@example.com'
+            assert b'\r\n.dot\r\n' in message.msg
+            assert conn._conn.messages.with_subject('Streamed') == [message]
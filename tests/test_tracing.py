@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Tomasz Wójcik <tomek@bthlabs.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+test_tracing
+============
+
+This module contains test suite for the *envelopes.tracing* module.
+"""
+
+import smtplib
+
+from envelopes import tracing
+from envelopes.conn import SMTP
+from envelopes.envelope import Envelope
+from envelopes.serializer import MessageSerializer
+from lib.testing import BaseTestCase
+
+
+class _Span(object):
+    def __init__(self, name):
+        self.name = name
+        self.attributes = {}
+        self.exception = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exception = exc_value
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class _Tracer(object):
+    def __init__(self):
+        self.spans = []
+
+    def start_as_current_span(self, name):
+        self.spans.append(_Span(name))
+        return self.spans[-1]
+
+
+class Test_Tracing(BaseTestCase):
+    def setUp(self):
+        self._patch_smtplib()
+        self._tracer = _Tracer()
+        tracing.set_tracer(self._tracer)
+
+    def tearDown(self):
+        tracing.set_tracer(None)
+        self._unpatch_smtplib()
+
+    def _spans(self):
+        return dict((span.name, span) for span in self._tracer.spans)
+
+    def test_no_tracer(self):
+        tracing.set_tracer(None)
+        assert tracing.get_tracer() is None
+
+        with tracing.span('smtp.connect') as current:
+            current.set_attribute('server.port', 25)
+            assert current.is_recording() is False
+
+        SMTP('localhost').send(Envelope(**self._dummy_message()))
+        assert self._tracer.spans == []
+
+    def test_send(self):
+        conn = SMTP('localhost', port=587, tls=True, login='spam',
+                    password='eggs')
+        conn.send(Envelope(**self._dummy_message()))
+
+        assert [span.name for span in self._tracer.spans] == [
+            'smtp.connect', 'smtp.starttls', 'smtp.login',
+            'envelope.serialize', 'smtp.sendmail'
+        ]
+
+        spans = self._spans()
+        assert spans['smtp.connect'].attributes == {
+            'server.address': 'localhost', 'server.port': 587
+        }
+        assert spans['smtp.starttls'].attributes['smtp.reply_code'] == 220
+        assert spans['smtp.login'].attributes['smtp.reply_code'] == 235
+
+        size = spans['envelope.serialize'].attributes['smtp.message_size']
+        sendmail = spans['smtp.sendmail'].attributes
+        assert sendmail['smtp.message_size'] == size
+        assert sendmail['smtp.recipients'] == 7
+        assert sendmail['smtp.reply_code'] == 250
+        assert sendmail['smtp.refused_recipients'] == 0
+
+    def test_send_stream(self):
+        envelope = Envelope(**self._dummy_message())
+        SMTP('localhost', stream=True).send(envelope)
+
+        attributes = self._spans()['smtp.sendmail'].attributes
+        assert attributes['smtp.message_size'] == envelope.estimated_size()
+
+    def test_send_refused(self):
+        conn = SMTP('localhost')
+        conn._connect()
+
+        def mail(from_addr, options):
+            return (552, b'5.3.4 Message size exceeds fixed limit')
+        conn._conn.mail = mail
+
+        conn._conn.does_esmtp = 1
+        conn._conn.esmtp_features['chunking'] = ''
+
+        msg = MessageSerializer().serialize(Envelope(**self._dummy_message()))
+        try:
+            conn.send_rendered('from@example.com', ['to@example.com'], msg)
+        except smtplib.SMTPSenderRefused:
+            pass
+        else:
+            assert False, 'SMTPSenderRefused not raised'
+
+        sendmail = self._spans()['smtp.sendmail']
+        assert sendmail.attributes['smtp.reply_code'] == 552
+        assert isinstance(sendmail.exception, smtplib.SMTPSenderRefused)
+
+    def test_to_mime_message(self):
+        Envelope(**self._dummy_message()).to_mime_message()
+
+        attributes = self._spans()['envelope.to_mime_message'].attributes
+        assert attributes['envelope.parts'] == 2
+
+    def test_use_opentelemetry(self):
+        try:
+            import opentelemetry
+        except ImportError:
+            try:
+                tracing.use_opentelemetry()
+            except RuntimeError:
+                pass
+            else:
+                assert False, 'RuntimeError not raised'
+        else:
+            tracing.use_opentelemetry()
+            assert tracing.get_tracer() is not self._tracer